@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+
+"""Benchmark the pipeline steps and the data_helper functions on fixed size data
+
+The data is one season generated by synthetic_data.py with a fixed seed, so each run times the same work.
+It is generated in --data-dir the first time it is needed, then reused while --year, --scale and --seed
+are unchanged.
+
+Each benchmark is run --repeat times, and its best and median seconds are written as JSON to
+benchmarks/{YYYYmmdd_HHMMSS}.json, or to the --save file.  Keep one run as the baseline, then compare:
+
+  ./benchmark.py --save=benchmarks/baseline.json
+  ./benchmark.py --compare=benchmarks/baseline.json
+
+A benchmark whose best time is more than --threshold slower than the baseline is a regression, and
+the script exits with an error.  To compare two saved runs without running the benchmarks:
+
+  ./benchmark.py --compare=benchmarks/baseline.json --results=benchmarks/20200105_101500.json
+"""
+
+__author__ = 'Stephen Diehl'
+
+import argparse
+import csv
+import json
+import logging
+import platform
+import re
+import shutil
+import statistics
+import sys
+import time
+from datetime import datetime
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data_helper as dh
+import postgres_load_data
+import retrosheet_collect
+import retrosheet_wrangle
+import synthetic_data
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+BENCHMARKS_DIR = 'benchmarks'
+
+# marks a data directory as generated by this script, so that it may be regenerated
+FIXTURE_FILE = 'benchmark_fixture.json'
+
+
+def get_parser():
+    """Args Description"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("--data-dir", type=str, help="benchmark data directory", default='../data_benchmark')
+    parser.add_argument("--year", type=int, help="season to generate", default='2019')
+    parser.add_argument("--scale", type=float, help="multiple of the number of teams in the season", default=1.0)
+    parser.add_argument("--seed", type=int, help="random seed of the generated data", default=0)
+    parser.add_argument("--repeat", type=int, help="times to run each benchmark", default=5)
+    parser.add_argument("--bench", action="append", choices=list(BENCHMARKS), metavar='NAME',
+                        help="run only this benchmark, may be repeated")
+    parser.add_argument("--save", type=str, help="JSON file for the results")
+    parser.add_argument("--compare", type=str, metavar='BASELINE', help="compare the results with this JSON file")
+    parser.add_argument("--results", type=str, help="with --compare, compare this JSON file rather than a new run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="with --compare, the fraction slower than the baseline which is a regression")
+    parser.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level")
+
+    return parser
+
+
+class Fixtures:
+    """The benchmark data, generated and loaded on first use.
+
+    The data is generated, collected and wrangled only as far as the benchmarks being run need it.
+    """
+
+    def __init__(self, data_dir, year, scale, seed):
+        self.data_dir = Path(data_dir).resolve()
+        self.year = year
+        self.params = {'year': year, 'scale': scale, 'seed': seed}
+        self.parsed = self.data_dir / 'retrosheet/parsed'
+        self.collected = self.data_dir / 'retrosheet/collected'
+        self.wrangled = self.data_dir / 'retrosheet/wrangled'
+
+        # the benchmarks write their output here
+        self.tmp = self.data_dir / 'tmp'
+        self.cache = {}
+
+    def get(self, name, load):
+        if name not in self.cache:
+            self.cache[name] = load()
+        return self.cache[name]
+
+    def generate(self):
+        """Generate the synthetic data, unless it was already generated with the same parameters."""
+        p_fixture = self.data_dir / FIXTURE_FILE
+        if p_fixture.exists():
+            if json.loads(p_fixture.read_text()) == self.params:
+                return
+            for sub_dir in ['retrosheet', 'lahman', 'tmp']:
+                shutil.rmtree(self.data_dir / sub_dir, ignore_errors=True)
+        elif self.data_dir.exists() and any(self.data_dir.iterdir()):
+            raise ValueError(f'{self.data_dir} has data which was not generated by benchmark.py')
+
+        logger.info(f'Generating the benchmark data in {self.data_dir} ...')
+        synthetic_data.main([f'--data-dir={self.data_dir}', f'--start-year={self.year}', f'--end-year={self.year}',
+                             f'--scale={self.params["scale"]}', f'--seed={self.params["seed"]}'])
+        p_fixture.write_text(json.dumps(self.params))
+
+    def get_parsed_dir(self):
+        def generate():
+            self.generate()
+            return self.parsed
+        return self.get('parsed', generate)
+
+    def get_collected_dir(self):
+        def collect():
+            self.get_parsed_dir()
+            if not (self.collected / 'player_game.csv.gz').exists():
+                retrosheet_collect.main([f'--data-dir={self.data_dir}', '--use-datatypes'])
+            return self.collected
+        return self.get('collected', collect)
+
+    def get_wrangled_dir(self):
+        def wrangle():
+            self.get_collected_dir()
+            if not (self.wrangled / 'event.csv.gz').exists():
+                retrosheet_wrangle.main([f'--data-dir={self.data_dir}'])
+            return self.wrangled
+        return self.get('wrangled', wrangle)
+
+    def get_tmp_dir(self):
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        return self.tmp
+
+    def read_collected(self, name):
+        return self.get(f'collected {name}',
+                        lambda: dh.from_csv_with_types(self.get_collected_dir() / f'{name}.csv.gz'))
+
+    def read_wrangled(self, name):
+        return self.get(f'wrangled {name}',
+                        lambda: dh.from_csv_with_types(self.get_wrangled_dir() / f'{name}.csv.gz'))
+
+    def get_game_start(self):
+        return self.read_wrangled('game')[['game_id', 'game_start']]
+
+
+# Each benchmark returns (setup, run, rows).  setup is not timed, and returns the args passed to run.
+
+def bench_optimize_df_dtypes(fx):
+    df = fx.get('cwdaily', lambda: pd.read_csv(fx.get_parsed_dir() / f'cwdaily{fx.year}.csv'))
+    return lambda: (df.copy(),), dh.optimize_df_dtypes, len(df)
+
+
+def bench_to_csv_with_types(fx):
+    batting = fx.read_wrangled('batting')
+    filename = fx.get_tmp_dir() / 'batting.csv.gz'
+    return lambda: (), lambda: dh.to_csv_with_types(batting, filename), len(batting)
+
+
+def bench_from_csv_with_types(fx):
+    filename = fx.get_wrangled_dir() / 'batting.csv.gz'
+    rows = len(fx.read_wrangled('batting'))
+    return lambda: (), lambda: dh.from_csv_with_types(filename), rows
+
+
+def bench_sum_stats_for_dups(fx):
+    """The synthetic data has no duplicate keys, so 1% of the player_game rows are duplicated"""
+    player_game = fx.read_collected('player_game')
+    df = pd.concat([player_game, player_game.sample(frac=0.01, random_state=0)], ignore_index=True)
+    stat_cols = [col for col in df.columns if re.search(r'^[bpf]_', col) and col != 'b_g']
+    return lambda: (), lambda: dh.sum_stats_for_dups(df, ['game_id', 'player_id'], stat_cols), len(df)
+
+
+def bench_event_pkey(fx):
+    """The primary key check of test_event_pkey"""
+    event = fx.read_wrangled('event')
+    return lambda: (), lambda: dh.is_unique(event, ['game_id', 'event_id']), len(event)
+
+
+def bench_augment_event_files(fx):
+    p_parsed = fx.get_tmp_dir() / 'parsed'
+    p_parsed.mkdir(exist_ok=True)
+    filename = f'cwevent{fx.year}.csv'
+    shutil.copyfile(fx.get_parsed_dir() / filename, p_parsed / filename)
+    rows = sum(1 for _ in open(p_parsed / filename)) - 1
+    return lambda: (p_parsed,), retrosheet_collect.augment_event_files, rows
+
+
+def bench_wrangle_game(fx):
+    game = fx.read_collected('game')
+    p_tmp = fx.get_tmp_dir()
+    return lambda: (game.copy(), p_tmp), retrosheet_wrangle.wrangle_game, len(game)
+
+
+def bench_create_fielding(fx):
+    player_game = fx.read_collected('player_game')
+    args = (player_game, fx.get_game_start(), fx.get_tmp_dir())
+    return lambda: args, retrosheet_wrangle.create_fielding, len(player_game)
+
+
+def bench_csv_writer_encode(fx):
+    """The serialization of psql_insert_copy()"""
+    batting = fx.read_wrangled('batting')
+
+    def encode():
+        writer = csv.writer(StringIO())
+        writer.writerows(batting.itertuples(index=False))
+
+    return lambda: (), encode, len(batting)
+
+
+def bench_to_pg_binary(fx):
+    batting = fx.read_wrangled('batting')
+    pg_types = get_pg_types(batting)
+    return lambda: (batting, pg_types), postgres_load_data.to_pg_binary, len(batting)
+
+
+def bench_batting_team_game_groupby(fx):
+    """The aggregation of test_batting_team_game_data"""
+    batting = fx.read_wrangled('batting')
+    cols = list(set(batting.columns) & set(fx.read_wrangled('team_game').columns) -
+                {'game_id', 'team_id', 'player_id', 'game_start', 'year'})
+
+    def groupby():
+        return batting[['game_id', 'team_id'] + cols].groupby(['game_id', 'team_id']).agg('sum')
+
+    return lambda: (), groupby, len(batting)
+
+
+def bench_event_team_game_groupby(fx):
+    """The aggregation of test_event"""
+    event = fx.read_wrangled('event')
+    key = ['game_id', 'team_id', 'opponent_team_id']
+    cols = list(set(fx.read_wrangled('team_game').columns) & set(event.columns) - set(key))
+
+    def groupby():
+        return event[key + cols].groupby(key).agg('sum')
+
+    return lambda: (), groupby, len(event)
+
+
+BENCHMARKS = {
+    'optimize_df_dtypes': bench_optimize_df_dtypes,
+    'to_csv_with_types': bench_to_csv_with_types,
+    'from_csv_with_types': bench_from_csv_with_types,
+    'sum_stats_for_dups': bench_sum_stats_for_dups,
+    'event_pkey': bench_event_pkey,
+    'augment_event_files': bench_augment_event_files,
+    'wrangle_game': bench_wrangle_game,
+    'create_fielding': bench_create_fielding,
+    'csv_writer_encode': bench_csv_writer_encode,
+    'to_pg_binary': bench_to_pg_binary,
+    'batting_team_game_groupby': bench_batting_team_game_groupby,
+    'event_team_game_groupby': bench_event_team_game_groupby,
+}
+
+
+def get_pg_types(df):
+    """Postgres type name per column, for to_pg_binary(), as the smallest type which holds the column's dtype."""
+    pg_types = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            pg_types[col] = 'bool'
+        elif pd.api.types.is_integer_dtype(dtype):
+            # an unsigned type needs the next larger signed type
+            size = dtype.itemsize * (2 if dtype.kind == 'u' else 1)
+            pg_types[col] = 'int2' if size <= 2 else 'int4' if size <= 4 else 'int8'
+        elif pd.api.types.is_float_dtype(dtype):
+            pg_types[col] = 'float8'
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            pg_types[col] = 'timestamp'
+        else:
+            pg_types[col] = 'text'
+    return pg_types
+
+
+def time_benchmark(setup, run, repeat):
+    """Seconds of each run.  setup is called before each run, so that a run may modify its args."""
+    seconds = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_benchmarks(fx, names, repeat):
+    """Run the benchmarks.  Returns a dict of name => result."""
+    results = {}
+    for name in names:
+        setup, run, rows = BENCHMARKS[name](fx)
+        seconds = time_benchmark(setup, run, repeat)
+        best = min(seconds)
+        results[name] = {'rows': rows, 'repeat': repeat, 'min_s': round(best, 4),
+                         'median_s': round(statistics.median(seconds), 4),
+                         'rows_per_s': round(rows / best) if best > 0 else None}
+        logger.info(f'{name}: {best:.3f}s best of {repeat}, {rows:,d} rows')
+    return results
+
+
+def get_environment():
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'node': platform.node()}
+
+
+def compare_results(baseline, current, threshold):
+    """Compare the best seconds of each benchmark.
+
+    Returns a DataFrame with one row per benchmark, whose status is one of:
+    regression, improvement (faster by more than threshold), ok, new (not in baseline) or missing.
+    """
+    base, cur = baseline['benchmarks'], current['benchmarks']
+    rows = []
+    for name in list(base) + [name for name in cur if name not in base]:
+        base_s = base[name]['min_s'] if name in base else np.nan
+        cur_s = cur[name]['min_s'] if name in cur else np.nan
+        change = cur_s / base_s - 1 if base_s else np.nan
+        if name not in base:
+            status = 'new'
+        elif name not in cur:
+            status = 'missing'
+        elif change > threshold:
+            status = 'regression'
+        elif change < -threshold:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append({'benchmark': name, 'baseline_s': base_s, 'current_s': cur_s, 'change': change,
+                     'status': status})
+
+    return pd.DataFrame(rows, columns=['benchmark', 'baseline_s', 'current_s', 'change', 'status'])
+
+
+def main(argv=None):
+    """Run the benchmarks and compare them with a baseline.  Returns True if there was no regression.
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.log_level:
+        fh = logging.FileHandler('download.log')
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        fh.setFormatter(formatter)
+        fh.setLevel(args.log_level)
+        logger.addHandler(fh)
+
+    if args.verbose:
+        # send INFO level logging to stdout
+        sh = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        sh.setFormatter(formatter)
+        sh.setLevel(logging.INFO)
+        logger.addHandler(sh)
+
+    if args.results:
+        if not args.compare:
+            parser.error('--results requires --compare')
+        current = json.loads(Path(args.results).read_text())
+    else:
+        fx = Fixtures(args.data_dir, args.year, args.scale, args.seed)
+        names = args.bench or list(BENCHMARKS)
+        current = {'created': datetime.now().isoformat(timespec='seconds'), 'fixture': fx.params,
+                   'environment': get_environment(), 'benchmarks': run_benchmarks(fx, names, args.repeat)}
+
+        save = Path(args.save or f'{BENCHMARKS_DIR}/{datetime.now():%Y%m%d_%H%M%S}.json')
+        save.parent.mkdir(parents=True, exist_ok=True)
+        save.write_text(json.dumps(current, indent=2) + '\n')
+        logger.info(f'results written to {save}')
+
+    if not args.compare:
+        return True
+
+    baseline = json.loads(Path(args.compare).read_text())
+    if baseline['fixture'] != current['fixture']:
+        logger.warning(f'the benchmark data differs: baseline {baseline["fixture"]}, current {current["fixture"]}')
+    if baseline['environment'] != current['environment']:
+        logger.warning(f'the environment differs: baseline {baseline["environment"]}, '
+                       f'current {current["environment"]}')
+
+    comparison = compare_results(baseline, current, args.threshold)
+    print(comparison.to_string(index=False, float_format=lambda x: f'{x:.3f}'))
+    regressions = comparison.loc[comparison['status'] == 'regression', 'benchmark'].tolist()
+    if regressions:
+        print(f'Regressions of more than {args.threshold:.0%}: {" ".join(regressions)}')
+    return not regressions
+
+
+if __name__ == '__main__':
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,347 @@
+"""Columnar Cache of the Wrangled csv Files
+
+Reading a wrangled csv file decompresses and parses every column, even if only a few are needed.
+The first time a file is read through this module, each of its columns is saved as a numpy .npy
+file, so that afterwards a column is loaded on its own, in about the time it takes to read it from disk.
+
+    batting = LazyTable(data_dir / 'retrosheet/wrangled/batting.csv.gz', cache_dir, years=(1974, 2019))
+    batting['hr'].sum()        # loads only hr, and game_start the first time
+    batting[['game_id', 'hr']] # a DataFrame of the two columns
+
+A cached table is rebuilt when its csv file changes (by size or modification time).
+
+The .npy files are memory mapped rather than read, so processes reading the same table, such as
+parallel pytest workers (pytest -n 4), share one copy of it in the page cache.  Where possible,
+the columns selected from the table are views of the memory mapped files, see LazyTable.
+"""
+
+__author__ = 'Stephen Diehl'
+
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+import data_helper as dh
+
+MANIFEST = 'manifest.json'
+
+
+def get_source_stamp(source):
+    """Identifies the version of the csv file and its types file."""
+    p = Path(source)
+    p_types = p.parent / (p.name.split('.')[0] + '_types.csv')
+    return [[os.stat(file).st_size, os.stat(file).st_mtime_ns] for file in [p, p_types]]
+
+
+def save_column(s, p_dir, i):
+    """Save the column as .npy files named by its position.  Returns its manifest entry.
+
+    kind is how the column is stored:
+      numpy -- the values, for numpy dtypes such as uint8, bool and datetime64
+      masked -- the values with missing values as 0, and the mask, for nullable dtypes such as UInt8
+      string -- integer codes and the fixed width unicode strings they index, with -1 for missing
+      pickle -- anything else
+    """
+    entry = {'name': s.name, 'dtype': str(s.dtype)}
+    if isinstance(s.dtype, np.dtype) and s.dtype.kind in 'biufmM':
+        entry['kind'] = 'numpy'
+        np.save(p_dir / f'{i}.npy', s.to_numpy())
+    elif isinstance(s.dtype, pd.api.extensions.ExtensionDtype) and hasattr(s.array, '_mask'):
+        entry['kind'] = 'masked'
+        np.save(p_dir / f'{i}.npy', s.to_numpy(dtype=s.dtype.numpy_dtype, na_value=0))
+        np.save(p_dir / f'{i}_mask.npy', s.isna().to_numpy())
+    elif s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) in ['string', 'empty']:
+        entry['kind'] = 'string'
+        codes, uniques = pd.factorize(s)
+        np.save(p_dir / f'{i}.npy', codes.astype(np.int32))
+        np.save(p_dir / f'{i}_strings.npy', np.array(uniques, dtype=str))
+    else:
+        entry['kind'] = 'pickle'
+        s.to_pickle(p_dir / f'{i}.pkl')
+    return entry
+
+
+def load_column(p_dir, i, entry):
+    """Load the column saved by save_column() as a numpy array or pandas array.
+
+    numpy and masked columns are read-only memory mapped arrays.  A string column is an object
+    array, which holds one pointer per row to the strings, of which there is one copy per process.
+    """
+    kind = entry['kind']
+    if kind == 'numpy':
+        return np.load(p_dir / f'{i}.npy', mmap_mode='r')
+    elif kind == 'masked':
+        values = np.load(p_dir / f'{i}.npy', mmap_mode='r')
+        mask = np.load(p_dir / f'{i}_mask.npy', mmap_mode='r')
+        return pd.api.types.pandas_dtype(entry['dtype']).construct_array_type()(values, mask)
+    elif kind == 'string':
+        codes = np.load(p_dir / f'{i}.npy', mmap_mode='r')
+        strings = np.load(p_dir / f'{i}_strings.npy').astype(object)
+
+        # missing values are NaN, as read by read_csv
+        values = np.append(strings, np.nan)[codes]
+        return values
+    else:
+        return pd.read_pickle(p_dir / f'{i}.pkl').array
+
+
+def build_cache(source, cache_dir):
+    """Read the csv file and save each of its columns.
+
+    The cache is written to a temporary directory which is then renamed, so a partly written
+    cache is never read, even if several processes build it at once.
+    """
+    cache_dir = Path(cache_dir)
+    df = dh.from_csv_with_types(source)
+
+    p_tmp = cache_dir.parent / f'{cache_dir.name}.tmp{os.getpid()}'
+    shutil.rmtree(p_tmp, ignore_errors=True)
+    p_tmp.mkdir(parents=True)
+    columns = [save_column(df[col], p_tmp, i) for i, col in enumerate(df.columns)]
+    manifest = {'source': get_source_stamp(source), 'rows': len(df), 'columns': columns}
+    (p_tmp / MANIFEST).write_text(json.dumps(manifest, indent=2))
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.rename(p_tmp, cache_dir)
+    except OSError:
+        # another process renamed its copy first
+        shutil.rmtree(p_tmp, ignore_errors=True)
+
+
+@contextmanager
+def build_lock(cache_dir):
+    """Only one process builds the cache of a table, the others wait for it to finish."""
+    if fcntl is None:
+        yield
+        return
+
+    p_lock = Path(cache_dir).parent / f'{Path(cache_dir).name}.lock'
+    p_lock.parent.mkdir(parents=True, exist_ok=True)
+    with open(p_lock, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_manifest(source, cache_dir):
+    """The manifest of the cached columns, or None if the cache is missing or out of date."""
+    p_manifest = Path(cache_dir) / MANIFEST
+    if p_manifest.exists():
+        manifest = json.loads(p_manifest.read_text())
+        if manifest['source'] == get_source_stamp(source):
+            return manifest
+    return None
+
+
+def get_manifest(source, cache_dir):
+    """The manifest of the cached columns, building the cache if it is missing or out of date."""
+    manifest = read_manifest(source, cache_dir)
+    if manifest is None:
+        with build_lock(cache_dir):
+            # another process may have built it while this one waited
+            manifest = read_manifest(source, cache_dir)
+            if manifest is None:
+                build_cache(source, cache_dir)
+                manifest = read_manifest(source, cache_dir)
+    return manifest
+
+
+def save_array(filename, values):
+    """Save the array, renamed into place as it may be read by another process."""
+    p = Path(filename)
+    p_tmp = p.parent / f'{p.stem}.tmp{os.getpid()}.npy'
+    np.save(p_tmp, values)
+    os.replace(p_tmp, p)
+
+
+def save_json(filename, obj):
+    """Save the object as json, renamed into place as it may be read by another process."""
+    p = Path(filename)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p_tmp = p.parent / f'{p.stem}.tmp{os.getpid()}.json'
+    p_tmp.write_text(json.dumps(obj))
+    os.replace(p_tmp, p)
+
+
+def get_table(data_dir, filename, years=None):
+    """Handle to data_dir/filename, cached in data_dir/test_cache/{retrosheet|lahman}/{table}."""
+    cache_dir = data_dir / 'test_cache' / Path(filename).parts[0] / Path(filename).name.split('.')[0]
+    return LazyTable(data_dir / filename, cache_dir, years)
+
+
+class LazyTable:
+    """Read-only handle to a wrangled csv file, whose columns are loaded on first use.
+
+    Selecting one column returns a Series, and selecting a list of columns returns a DataFrame,
+    as for a DataFrame.  Loaded columns are kept, so each column is read at most once.
+
+    The numeric columns are read-only views of the memory mapped cache, unless the rows in years
+    are not contiguous in the csv file, in which case they are copied.  Selecting a list of
+    columns copies them into the DataFrame.
+
+    If years is given, only the rows from (first year, last year) inclusive are returned.  The
+    year of each row is saved in the cache, see get_years().
+    """
+
+    def __init__(self, source, cache_dir, years=None):
+        self.source = Path(source)
+        self.cache_dir = Path(cache_dir)
+        self.years = years
+        self._manifest = None
+        self._loaded = {}
+        self._years = None
+        self._year_order = None
+        self._rows = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = get_manifest(self.source, self.cache_dir)
+        return self._manifest
+
+    @property
+    def columns(self):
+        return pd.Index([entry['name'] for entry in self.manifest['columns']])
+
+    @property
+    def dtypes(self):
+        return pd.Series({entry['name']: entry['dtype'] for entry in self.manifest['columns']})
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, col):
+        return col in self.columns
+
+    def __repr__(self):
+        return f'LazyTable({self.source.name}, {len(self.columns)} columns, {len(self._loaded)} loaded)'
+
+    def load(self, col):
+        """All the values of the column, ignoring the year filter."""
+        if col not in self._loaded:
+            positions = {entry['name']: (i, entry) for i, entry in enumerate(self.manifest['columns'])}
+            if col not in positions:
+                raise KeyError(col)
+            i, entry = positions[col]
+            self._loaded[col] = load_column(self.cache_dir, i, entry)
+        return self._loaded[col]
+
+    def get_years(self):
+        """The year of each row: the year of game_start, or the year column, or the year in game_id."""
+        if self._years is None:
+            # the cache is built, or rebuilt, before the years are read from it
+            p_years = self.cache_dir / 'years.npy'
+            if self.manifest is not None and p_years.exists():
+                self._years = np.load(p_years, mmap_mode='r')
+            else:
+                if 'game_start' in self.columns:
+                    years = pd.DatetimeIndex(self.load('game_start')).year
+                elif 'year' in self.columns:
+                    years = self.load('year')
+                else:
+                    years = pd.Series(self.load('game_id')).str[3:7]
+                self._years = np.asarray(years, dtype=np.int16)
+                save_array(p_years, self._years)
+        return self._years
+
+    def get_rows(self):
+        """The rows in years, as a slice if they are contiguous, otherwise as their positions."""
+        if self._rows is None:
+            if self.years is None:
+                self._rows = slice(None)
+            else:
+                first, last = self.years
+                years = self.get_years()
+                positions = np.flatnonzero((first <= years) & (years <= last))
+                if len(positions) == 0 or positions[-1] - positions[0] + 1 == len(positions):
+                    # a slice of a memory mapped array is a view of it
+                    start = positions[0] if len(positions) else 0
+                    self._rows = slice(start, start + len(positions))
+                else:
+                    self._rows = positions
+        return self._rows
+
+    def get_year_order(self):
+        """The row positions sorted by year, and the sorted years."""
+        if self._year_order is None:
+            years = self.get_years()
+            order = np.argsort(years, kind='stable')
+            self._year_order = order, years[order]
+        return self._year_order
+
+    def get_year_rows(self, year):
+        """The positions of the rows of the year, in order, ignoring the year filter."""
+        order, sorted_years = self.get_year_order()
+        start, end = np.searchsorted(sorted_years, [year, year + 1])
+        return order[start:end]
+
+    def get_year_digests(self, cols):
+        """Digest of each column for each year: {col: {year: digest}}.
+
+        The digest of a year is the number of rows and the sum of the hashes of their values,
+        so it does not depend upon the order of the rows.  The digests are saved in the cache.
+        """
+        p_digests = self.cache_dir / 'digests.json'
+        digests = {}
+        if self.manifest is not None and p_digests.exists():
+            digests = json.loads(p_digests.read_text())
+
+        missing = [col for col in cols if col not in digests]
+        if missing:
+            order, sorted_years = self.get_year_order()
+            years, starts, counts = np.unique(sorted_years, return_index=True, return_counts=True)
+            for col in missing:
+                hashes = pd.util.hash_pandas_object(pd.Series(self.load(col)), index=False).to_numpy()[order]
+
+                # the sums wrap around at 2 ** 64
+                sums = np.add.reduceat(hashes, starts) if len(hashes) else []
+                digests[col] = {str(year): f'{count}:{total:016x}' for year, count, total in zip(years, counts, sums)}
+            save_json(p_digests, digests)
+
+        return {col: digests[col] for col in cols}
+
+    def get_index(self, rows):
+        if isinstance(rows, slice):
+            return pd.RangeIndex(self.manifest['rows'])[rows]
+        return pd.Index(rows)
+
+    @property
+    def index(self):
+        """The row labels of the rows in years, the same as DataFrame.query() would keep."""
+        return self.get_index(self.get_rows())
+
+    def get_column(self, col, rows=None):
+        """The column for the rows in years, or for the rows at the positions given by rows."""
+        rows = self.get_rows() if rows is None else rows
+        return pd.Series(self.load(col)[rows], index=self.get_index(rows), name=col, copy=False)
+
+    def select(self, cols, rows=None):
+        """The columns as a DataFrame, for the rows in years, or for the rows at the positions given by rows."""
+        rows = self.get_rows() if rows is None else rows
+        return pd.DataFrame({col: self.get_column(col, rows) for col in cols},
+                            index=self.get_index(rows), columns=list(cols))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.get_column(key)
+        if isinstance(key, (list, tuple, set, pd.Index)):
+            return self.select(list(key))
+        raise TypeError(f'select columns from a LazyTable by name, not by {type(key).__name__}')
+
+    def to_frame(self):
+        """All the columns as a DataFrame."""
+        return self[self.columns]
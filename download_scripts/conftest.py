@@ -1,10 +1,27 @@
 """Fixtures for Data Consistency Testing
 
    Data Consistency Testing is for the year 1974 through 2019 inclusive.
+
+   The Retrosheet fixtures are column_store.LazyTable handles: a column is read when it is first
+   selected, from a copy of the csv file saved by column in {data_dir}/test_cache.  The first run
+   builds the copy, later runs only read the columns the tests use.
+
+   The validator fixture runs the checks of validation.py, which save their results for each year,
+   so that only the years whose data changed are checked again.
 """
+import sys
 import pytest
 from pathlib import Path
-from . import data_helper as dh
+
+# the scripts, and data_helper itself, import the other modules as top-level modules,
+# so this directory must be on the path before data_helper is imported
+sys.path.insert(0, str(Path(__file__).parent))
+
+from . import data_helper as dh  # noqa: E402
+from . import column_store  # noqa: E402
+from . import validation  # noqa: E402
+
+YEARS = (1974, 2019)
 
 
 def pytest_addoption(parser):
@@ -40,44 +57,34 @@ def data_dir(request):
 #     return player_game
 
 
+def get_table(data_dir, filename, years=YEARS):
+    """Handle to a wrangled Retrosheet csv file, with the rows for years."""
+    return column_store.get_table(data_dir, f'retrosheet/wrangled/{filename}', years)
+
+
 @pytest.fixture(scope='session')
 def team_game(data_dir):
-    filename = data_dir / 'retrosheet' / 'wrangled' / 'team_game.csv.gz'
-    team_game = dh.from_csv_with_types(filename)
-    team_game = team_game.query('1974 <= game_start.dt.year <= 2019')
-    return team_game
+    return get_table(data_dir, 'team_game.csv.gz')
 
 
 @pytest.fixture(scope='session')
 def game(data_dir):
-    filename = data_dir / 'retrosheet' / 'wrangled' / 'game.csv.gz'
-    game = dh.from_csv_with_types(filename)
-    game = game.query('1974 <= game_start.dt.year <= 2019')
-    return game
+    return get_table(data_dir, 'game.csv.gz')
 
 
 @pytest.fixture(scope='session')
 def batting(data_dir):
-    filename = data_dir / 'retrosheet' / 'wrangled' / 'batting.csv.gz'
-    batting = dh.from_csv_with_types(filename)
-    batting = batting.query('1974 <= game_start.dt.year <= 2019')
-    return batting
+    return get_table(data_dir, 'batting.csv.gz')
 
 
 @pytest.fixture(scope='session')
 def pitching(data_dir):
-    filename = data_dir / 'retrosheet' / 'wrangled' / 'pitching.csv.gz'
-    pitching = dh.from_csv_with_types(filename)
-    pitching = pitching.query('1974 <= game_start.dt.year <= 2019')
-    return pitching
+    return get_table(data_dir, 'pitching.csv.gz')
 
 
 @pytest.fixture(scope='session')
 def fielding(data_dir):
-    filename = data_dir / 'retrosheet' / 'wrangled' / 'fielding.csv.gz'
-    fielding = dh.from_csv_with_types(filename)
-    fielding = fielding.query('1974 <= game_start.dt.year <= 2019')
-    return fielding
+    return get_table(data_dir, 'fielding.csv.gz')
 
 
 @pytest.fixture(scope='session')
@@ -120,5 +127,14 @@ def lahman_people(data_dir):
 
 @pytest.fixture(scope='session')
 def event(data_dir):
-    filename = data_dir / 'retrosheet' / 'wrangled' / 'event.csv.gz'
-    return dh.from_csv_with_types(filename)
+    return get_table(data_dir, 'event.csv.gz', years=None)
+
+
+@pytest.fixture(scope='session')
+def team_game_from_events(data_dir):
+    return get_table(data_dir, 'team_game_from_events.csv.gz')
+
+
+@pytest.fixture(scope='session')
+def validator(data_dir):
+    return validation.Validator(data_dir, YEARS)
@@ -7,9 +7,13 @@ import numpy as np
 import re
 import io
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import statsmodels.api as sm
+from patsy import dmatrices
 from IPython.display import HTML, display
-from sqlalchemy.types import SmallInteger, Integer, BigInteger, Float
+from sqlalchemy.types import SmallInteger, Integer, BigInteger, Numeric, Float, Boolean, DateTime, Text, Enum
+
+import key_integrity
 
 
 def to_csv_with_types(df, filename):
@@ -35,12 +39,14 @@ def to_csv_with_types(df, filename):
     df.to_csv(p, index=False)
 
 
-def from_csv_with_types(filename, usecols=None, nrows=None):
+def from_csv_with_types(filename, usecols=None, nrows=None, chunksize=None):
     """
     Read df.dtypes from csv file and read df from csv file.
 
     If filename ends in .gz, Pandas will use gzip decompression.
     This is the complement of to_csv_with_types().
+
+    If chunksize is specified, an iterator of DataFrames is returned.
     """
 
     p = Path(filename)
@@ -52,7 +58,37 @@ def from_csv_with_types(filename, usecols=None, nrows=None):
     if dates and usecols:
         dates = list(set(dates) & set(usecols))
 
-    return pd.read_csv(p, parse_dates=dates, dtype=dtypes, usecols=usecols, nrows=nrows)
+    return pd.read_csv(p, parse_dates=dates, dtype=dtypes, usecols=usecols, nrows=nrows,
+                       chunksize=chunksize)
+
+
+def from_csv_by_group(filename, key, usecols=None, chunksize=1_000_000):
+    """
+    Read a csv file with types in chunks of about chunksize rows, without splitting a group.
+
+    All rows having the same value for the key column must be consecutive,
+    as are all the events for a game_id in event.csv.gz.
+
+    This bounds the memory required to process a large file one group at a time.
+    """
+    carry = None
+    for chunk in from_csv_with_types(filename, usecols=usecols, chunksize=chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if len(chunk) == 0:
+            # a file without rows
+            continue
+
+        # the last group may continue in the next chunk
+        is_last = (chunk[key] == chunk[key].iloc[-1]).to_numpy()
+        carry = chunk[is_last]
+        chunk = chunk[~is_last]
+
+        if len(chunk) > 0:
+            yield chunk.reset_index(drop=True)
+
+    if carry is not None and len(carry) > 0:
+        yield carry.reset_index(drop=True)
 
 
 def read_types(filename):
@@ -172,34 +208,164 @@ def get_dtype_range():
     return dict(zip(keys, data))
 
 
-def optimize_db_dtypes(df):
+def get_column_stats(df, max_values=None):
+    """Per column: min, max, number of non-null values, total and maximum length of strings,
+    and the set of distinct strings.
+
+    The set is None for a column having more than max_values distinct strings.
+
+    The stats for chunks of a file can be combined with add_column_stats() or combine_column_stats().
+    """
+    stats = {}
+    for col in df.columns:
+        s = df[col].dropna()
+        col_stats = {'count': len(s), 'min': np.nan, 'max': np.nan, 'total_len': 0, 'max_len': 0, 'values': None}
+        if pd.api.types.is_bool_dtype(s.dtype) or pd.api.types.is_datetime64_any_dtype(s.dtype):
+            pass
+        elif pd.api.types.is_numeric_dtype(s.dtype):
+            if len(s):
+                col_stats['min'], col_stats['max'] = s.min(), s.max()
+        else:
+            lengths = s.astype(str).str.len()
+            col_stats['total_len'] = int(lengths.sum())
+            col_stats['max_len'] = int(lengths.max()) if len(s) else 0
+            values = s.unique()
+            if max_values is None or len(values) <= max_values:
+                col_stats['values'] = set(values)
+        stats[col] = col_stats
+
+    return pd.DataFrame(stats).T
+
+
+def add_column_stats(stats, other, max_values=1000):
+    """Add the column stats of another chunk of the same file to stats, in place.
+
+    The set of distinct values of a column is dropped, and no longer collected, once it has
+    more than max_values of them, so the memory used does not grow with the number of distinct
+    values in the file.
+    """
+    stats['count'] += other['count']
+    stats['min'] = pd.concat([stats['min'], other['min']], axis=1).min(axis=1)
+    stats['max'] = pd.concat([stats['max'], other['max']], axis=1).max(axis=1)
+    stats['total_len'] += other['total_len']
+    stats['max_len'] = np.maximum(stats['max_len'], other['max_len'])
+
+    values = []
+    for a, b in zip(stats['values'], other['values']):
+        if isinstance(a, set) and isinstance(b, set):
+            a |= b
+            values.append(a if len(a) <= max_values else None)
+        else:
+            values.append(None)
+    stats['values'] = values
+
+    return stats
+
+
+def combine_column_stats(stats_list, max_values=1000):
+    """Combine the column stats of several chunks of the same file.
+
+    stats_list may be any iterable, such as a generator of the stats of each chunk as it is read,
+    as the stats are added to a running total.  Distinct values are only kept for columns
+    having at most max_values of them.
+    """
+    stats = None
+    for other in stats_list:
+        if stats is None:
+            stats = other.copy()
+            stats['values'] = [set(v) if isinstance(v, set) and len(v) <= max_values else None
+                               for v in stats['values']]
+        else:
+            stats = add_column_stats(stats, other, max_values)
+
+    return stats
+
+
+def get_int_db_dtype(min_value, max_value):
+    """Smallest SQL integer type for the range of values, or NUMERIC(20) for unsigned 64 bit integers."""
+    for sql_type, dtype in [(SmallInteger, np.int16), (Integer, np.int32), (BigInteger, np.int64)]:
+        info = np.iinfo(dtype)
+        if min_value >= info.min and max_value <= info.max:
+            return sql_type
+    return Numeric(20, 0)
+
+
+def optimize_db_dtypes(df, stats=None, max_enum_values=0, exclude=None):
     """
-    Choose smallest ANSI SQL Column Type for integer that fits the optimized DataFrame.
+    Choose the SQL Column Type for each column of the optimized DataFrame.
 
     Relies on:
-    from sqlalchemy.types import SmallInteger, Integer, BigInteger
+    from sqlalchemy.types import SmallInteger, Integer, BigInteger, Numeric, Float, Boolean, DateTime, Text, Enum
 
-    SQL Column Types are signed, so uint16 might not fit in smallinteger
-    TODO: below is safe but inefficient for uint16, UInt16, uint32 and UInt32
+    Parameters:
+        df (pd.DataFrame): the data, or an empty DataFrame having the data types of the data
+        stats (pd.DataFrame): column stats of the data, from get_column_stats(), if not computed from df
+        max_enum_values (int): strings having at most this many distinct values are a Postgres ENUM
+        exclude (list): column names which must not be ENUM, such as foreign key columns
+
+    An integer column uses the smallest of SMALLINT, INTEGER and BIGINT that holds its actual
+    min and max values.  SQL integer types are signed, so the range of the data type is used
+    only if there are no values, for example uint16 requires INTEGER.  Unsigned 64 bit integers
+    that do not fit in BIGINT are NUMERIC(20).
+
+    An ENUM is stored in 4 bytes, so it is only used if the strings are longer than 3 bytes on average,
+    as a short string is stored in 1 byte plus its length.  Its type is named after the column,
+    e.g. sky_condition_enum, so that tables having a column with the same name can be joined on it.
     """
-    small_int = {col: SmallInteger for col in df.select_dtypes(
-        include=[pd.Int8Dtype, np.int8, pd.UInt8Dtype, np.uint8,
-                 pd.Int16Dtype, np.int16]).columns}
+    if stats is None:
+        stats = get_column_stats(df)
+    exclude = exclude or []
+
+    dtypes = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        col_stats = stats.loc[col]
+        if pd.api.types.is_bool_dtype(dtype):
+            dtypes[col] = Boolean
+        elif pd.api.types.is_integer_dtype(dtype):
+            if col_stats['count'] > 0:
+                min_value, max_value = col_stats['min'], col_stats['max']
+            else:
+                info = np.iinfo(dtype.numpy_dtype if hasattr(dtype, 'numpy_dtype') else dtype)
+                min_value, max_value = info.min, info.max
+            dtypes[col] = get_int_db_dtype(int(min_value), int(max_value))
+        elif pd.api.types.is_float_dtype(dtype):
+            # Float(precision=53) is the SQL data type for double precision
+            dtypes[col] = Float(precision=24) if dtype == np.float32 else Float(precision=53)
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            dtypes[col] = DateTime
+        elif (isinstance(col_stats['values'], set) and 0 < len(col_stats['values']) <= max_enum_values and
+              col not in exclude and col_stats['total_len'] > 3 * col_stats['count']):
+            dtypes[col] = Enum(*sorted(col_stats['values']), name=f'{col}_enum')
+        else:
+            dtypes[col] = Text
+
+    return dtypes
 
-    integer = {col: Integer for col in df.select_dtypes(
-        include=[pd.UInt16Dtype, np.uint16, pd.Int32Dtype, np.int32]).columns}
 
-    big_int = {col: BigInteger for col in df.select_dtypes(
-        include=[pd.UInt32Dtype, np.uint32, pd.Int64Dtype, np.int64]).columns}
+def estimate_row_width(db_dtypes, stats):
+    """Estimate the bytes per row in Postgres: a 24 byte row header plus the width of each column.
 
-    # use double precision for unsigned 64 bit integers
-    # Float(precision=53) is the SQL data type for double precision
-    double = {col: Float(precision=53) for col in df.select_dtypes(
-        include=[np.uint64, pd.UInt64Dtype]).columns}
+    Text has a 1 byte header for values shorter than 127 bytes, and is estimated from the mean
+    length of the values.  Alignment padding and NULLs are ignored.
+    """
+    fixed = {SmallInteger: 2, Integer: 4, BigInteger: 8, Boolean: 1, DateTime: 8}
 
-    dtypes = {**small_int, **integer, **big_int, **double}
+    width = 24
+    for col, sql_type in db_dtypes.items():
+        if sql_type in fixed:
+            width += fixed[sql_type]
+        elif isinstance(sql_type, Float):
+            width += 4 if sql_type.precision == 24 else 8
+        elif isinstance(sql_type, Enum):
+            width += 4
+        elif isinstance(sql_type, Numeric):
+            width += 16
+        else:
+            count = stats.loc[col, 'count']
+            width += 1 + (stats.loc[col, 'total_len'] / count if count else 0)
 
-    return dtypes
+    return width
 
 
 def mem_usage(df):
@@ -232,10 +398,8 @@ def convert_camel_case(name):
 
 
 def is_unique(df, cols, ignore_null=False):
-    """Fast determination of multi-column uniqueness."""
-    if ignore_null:
-        df.dropna(subset=cols, inplace=True)
-    return not (df.duplicated(subset=cols)).any()
+    """Fast determination of multi-column uniqueness, see key_integrity.is_unique()."""
+    return key_integrity.is_unique(df, cols, ignore_null)
 
 
 def df_info(df):
@@ -259,29 +423,121 @@ def sum_stats_for_dups(df, pkey, stat_cols):
 
     The first value for a non-pkey non-stat column will be kept.
     """
-    # dups is true for all rows that are duplicates
-    dups = df.duplicated(subset=pkey, keep=False)
-    if len(dups) == 0:
-        return
+    return consolidate_dups(df, pkey, dict.fromkeys(stat_cols, 'sum'))
 
-    # get the duplicated rows
-    df_dups = df.loc[dups]
 
-    # for the duplicate rows, sum the stat columns only
-    df_summed = df_dups.groupby(pkey)[stat_cols].sum()
+def reduce_segments(s, positions, starts, how):
+    """Sum or max of the values of s at positions, for each segment of positions beginning at starts.
 
-    # often, setting the index to the primary key makes data processing easier
-    df.set_index(pkey, inplace=True)
+    Nulls are ignored: the sum of only nulls is 0 and the max of only nulls is null.
+    Returns the values and which are null, or None if none are.
+    """
+    values = s.array[positions]
+    na = np.asarray(values.isna())
+    dtype = getattr(s.dtype, 'numpy_dtype', s.dtype)
+    if how == 'sum':
+        data = values.to_numpy(dtype=np.float64 if dtype.kind == 'f' else np.int64, na_value=0)
+        return np.add.reduceat(data, starts), None
+    elif how == 'max':
+        lowest = -np.inf if dtype.kind == 'f' else np.iinfo(np.int64).min
+        data = values.to_numpy(dtype=np.float64 if dtype.kind == 'f' else np.int64, na_value=lowest)
+        result_na = np.logical_and.reduceat(na, starts)
+        return np.maximum.reduceat(data, starts), result_na if result_na.any() else None
+    raise ValueError(f'Unrecognized reducer: {how}')
+
+
+def consolidate_dups(df, pkey, reducers):
+    """Consolidate the rows having the same primary key into the first of them.
+
+    reducers maps a column to how the values of the rows are combined:
+      sum -- the sum
+      max -- the max, which is the OR of 0/1 flags
+      first -- the value of the first row, which is the default for columns not in reducers
+
+    Only the rows with duplicate keys are read, and the results are set in the first row of each,
+    by position.  df is not modified, as the caller may still be using it.
+    Returns df if there are no duplicate keys.
+    """
+    positions, starts = key_integrity.get_duplicate_groups(df, pkey)
+    if len(positions) == 0:
+        return df
+
+    # remove all but the first of each group of duplicated rows
+    first = positions[starts]
+    keep = np.ones(len(df), dtype=bool)
+    keep[positions] = False
+    keep[first] = True
+    out = df.take(np.flatnonzero(keep))
+    out.index = pd.RangeIndex(len(out))
+
+    # the positions of the first rows after the others were removed
+    out_first = (np.cumsum(keep) - 1)[first]
+
+    for col, how in reducers.items():
+        if how == 'first':
+            continue
+        result, result_na = reduce_segments(df[col], positions, starts, how)
+
+        # upcast the column if the result does not fit in it
+        dtype = getattr(df[col].dtype, 'numpy_dtype', df[col].dtype)
+        valid = result if result_na is None else result[~result_na]
+        if dtype.kind in 'iu' and len(valid) and \
+                (valid.min() < np.iinfo(dtype).min or valid.max() > np.iinfo(dtype).max):
+            out[col] = out[col].astype('Int64' if hasattr(out[col].dtype, 'numpy_dtype') else np.int64)
+            dtype = np.dtype(np.int64)
+
+        if result_na is not None:
+            result[result_na] = 0
+        result = pd.array(result.astype(dtype), dtype=out[col].dtype)
+        if result_na is not None:
+            result[result_na] = pd.NA
+        out.iloc[out_first, out.columns.get_loc(col)] = result
+
+    return out
+
+
+def segment_starts(df, keys):
+    """Row positions at which a new run of identical key values begins.
+
+    df must be grouped by keys, that is, all rows having the same key values
+    must be consecutive.  The rows need not be sorted.
+    """
+    change = np.zeros(len(df), dtype=bool)
+    if len(df) == 0:
+        return np.flatnonzero(change)
 
-    # remove all but one of each group of duplicated rows
-    df = df.loc[~df.index.duplicated(keep='first')].copy()
+    change[0] = True
+    for key in keys:
+        values = df[key].to_numpy()
+        change[1:] |= values[1:] != values[:-1]
 
-    # set the kept row (per group) equal to the summed row computed above
-    df.loc[df_summed.index, stat_cols] = df_summed
+    return np.flatnonzero(change)
 
-    df.reset_index(inplace=True)
 
-    return df
+def sum_segments(df, keys, sum_cols, first_cols=None):
+    """Sum columns over each run of consecutive rows having the same key values.
+
+    This is a single reduction pass using np.add.reduceat, which is much faster
+    than df.groupby(keys).sum() because no hashing or sorting is performed.
+
+    df must be grouped by keys (see segment_starts).  For columns in first_cols,
+    the value from the first row of each run is kept.
+
+    Bool and small integer columns are summed as int64 to avoid overflow.
+    """
+    first_cols = first_cols or []
+    starts = segment_starts(df, keys)
+
+    result = df[keys + first_cols].iloc[starts].reset_index(drop=True)
+    for col in sum_cols:
+        values = df[col].to_numpy()
+        if values.dtype.kind == 'O':
+            # nullable integer column
+            values = df[col].fillna(0).to_numpy(dtype=np.int64)
+        dtype = np.float64 if values.dtype.kind == 'f' else np.int64
+        result[col] = np.add.reduceat(values, starts, dtype=dtype)
+
+    return result
 
 
 def move_column_after(df, after_col, col):
@@ -292,6 +548,58 @@ def move_column_after(df, after_col, col):
     return df.reindex(cols, axis=1)
 
 
+# an inning of a line score: runs in parentheses if 10 or more, or x if the home team did not bat
+LINE_SCORE_INNING = re.compile(r'\((\d+)\)|(\d)|(x)')
+
+
+def parse_line_score(line_tx):
+    """Runs per inning of one line score, with -1 for x.  See parse_line_scores()."""
+    if LINE_SCORE_INNING.sub('', line_tx):
+        raise ValueError(f'Unrecognized line score: {line_tx}')
+    return [int(many or one) if not x else -1 for many, one, x in LINE_SCORE_INNING.findall(line_tx)]
+
+
+def parse_line_scores(line_tx):
+    """Runs per inning of each line score, for example 0102(11)0500 or 00300001x.
+
+    Returns a DataFrame with the index of line_tx and a UInt8 column per inning, numbered from 1.
+    An inning which was not played, or in which the home team did not bat (x), is null.
+
+    The line scores are converted to a matrix of bytes, one inning per byte.  The few line
+    scores having an inning of 10 or more runs are parsed one at a time.
+    """
+    line_tx = pd.Series(line_tx)
+    values = line_tx.fillna('').to_numpy(dtype=str)
+
+    # one row of bytes per line score, padded with 0
+    chars = values.astype('S')
+    width = chars.dtype.itemsize
+    b = chars.view(np.uint8).reshape(len(chars), width)
+
+    is_digit = (b >= ord('0')) & (b <= ord('9'))
+    runs = np.where(is_digit, b.astype(np.int16) - ord('0'), -1)
+    is_exception = ~(is_digit | (b == ord('x')) | (b == 0)).all(axis=1)
+    exceptions = np.flatnonzero(is_exception)
+
+    # the number of innings is the most of any line score, one per byte except for the exceptions
+    parsed = [parse_line_score(values[i]) for i in exceptions]
+    lengths = (b[~is_exception] != 0).sum(axis=1)
+    innings = max([int(lengths.max()) if len(lengths) else 0] + [len(inning_runs) for inning_runs in parsed])
+    if innings > width:
+        runs = np.pad(runs, ((0, 0), (0, innings - width)), constant_values=-1)
+    else:
+        runs = runs[:, :innings]
+    for i, inning_runs in zip(exceptions, parsed):
+        runs[i] = -1
+        runs[i, :len(inning_runs)] = inning_runs
+
+    # x, and the innings after the last, are null
+    na = runs < 0
+    runs = runs.clip(0).astype(np.uint8)
+    return pd.DataFrame({inning + 1: pd.arrays.IntegerArray(runs[:, inning], na[:, inning])
+                         for inning in range(innings)}, index=line_tx.index)
+
+
 def game_id_to_url(game_id):
     """Game ID to URL for Jupyter Notebooks"""
     dir = game_id[:3]
@@ -315,3 +623,96 @@ def simple_loess(x, y, df, frac=1 / 6, it=0):
     sns.lmplot has a loess option, but it uses poor and unchangeable defaults."""
     z = sm.nonparametric.lowess(df[y], df[x], frac=frac, it=it)
     return pd.DataFrame(data=z, columns=[x, y])
+
+
+def ols_normal_equations(X, y, weights, has_constant=True):
+    """Solve the weighted least squares normal equations for many weight vectors at once.
+
+    X (u x p) and y (u) are the rows of a regression.  weights (c x u) holds one row of
+    integer weights per replicate.  An integer weight of k is the same as repeating that row k times,
+    so each solution is identical to the OLS fit on the correspondingly resampled data.
+
+    Returns the coefficients (c x p) and the adjusted R^2 (c) as computed by statsmodels.
+    """
+    u, p = X.shape
+
+    # the upper triangle of each row's outer product, so that X'WX for every replicate
+    # is computed by a single matrix product
+    rows, cols = np.triu_indices(p)
+    xx = X[:, rows] * X[:, cols]
+
+    xtwx_triu = weights @ xx
+    xtwx = np.empty((len(weights), p, p))
+    xtwx[:, rows, cols] = xtwx_triu
+    xtwx[:, cols, rows] = xtwx_triu
+
+    xtwy = weights @ (X * y[:, None])
+    params = np.linalg.solve(xtwx, xtwy[:, :, None])[:, :, 0]
+
+    n = weights.sum(axis=1)
+    wy = weights @ y
+    wyy = weights @ (y * y)
+
+    # residual sum of squares from the normal equations: y'Wy - b'X'Wy
+    ssr = wyy - (params * xtwy).sum(axis=1)
+    if has_constant:
+        tss = wyy - wy ** 2 / n
+        r_squared = 1 - ssr / tss
+        r_squared_adj = 1 - (n - 1) / (n - p) * (1 - r_squared)
+    else:
+        r_squared = 1 - ssr / wyy
+        r_squared_adj = 1 - n / (n - p) * (1 - r_squared)
+
+    return params, r_squared_adj
+
+
+def bootstrap_ols_chunk(seed, size, n, X, y, freq, has_constant):
+    """Draw size bootstrap replicates and fit them.  Used by bootstrap_ols()."""
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(n, freq / n, size=size).astype(np.float64)
+    return ols_normal_equations(X, y, weights, has_constant)
+
+
+def bootstrap_ols(formula, data, n_replicates=500, random_state=None, chunk_size=50, n_jobs=1):
+    """Bootstrap the coefficients and adjusted R^2 of an OLS regression.
+
+    Replaces the loop:
+      idx = np.random.choice(range(len(data)), size=len(data), replace=True)
+      result = smf.ols(formula=formula, data=data.iloc[idx]).fit()
+
+    The design matrix is built once.  Identical rows are combined, as resampling
+    the rows of data is the same as drawing multinomial counts of the distinct rows.
+    Each replicate is then a weighted least squares fit, and all the replicates in a chunk
+    are solved at once with batched normal equations.
+
+    Chunks of replicates may be run in a process pool with n_jobs > 1.  The results
+    depend upon random_state only, not on n_jobs.
+
+    Returns a DataFrame with one row per replicate, having a column per coefficient
+    and an 'r_squared_adj' column.
+    """
+    y, X = dmatrices(formula, data, return_type='dataframe')
+    names = list(X.columns)
+    has_constant = 'Intercept' in names
+    n = len(X)
+
+    # half-inning stats are small integers, so there are far fewer distinct rows than rows
+    rows, freq = np.unique(np.column_stack([X.to_numpy(dtype=np.float64), y.to_numpy(dtype=np.float64)]),
+                           axis=0, return_counts=True)
+    X = rows[:, :-1]
+    y = rows[:, -1]
+
+    sizes = [min(chunk_size, n_replicates - start) for start in range(0, n_replicates, chunk_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    args = [(seed, size, n, X, y, freq, has_constant) for seed, size in zip(seeds, sizes)]
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(bootstrap_ols_chunk, *zip(*args)))
+    else:
+        results = [bootstrap_ols_chunk(*arg) for arg in args]
+
+    df = pd.DataFrame(np.concatenate([params for params, _ in results]), columns=names)
+    df['r_squared_adj'] = np.concatenate([r_squared_adj for _, r_squared_adj in results])
+
+    return df
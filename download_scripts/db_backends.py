@@ -0,0 +1,115 @@
+"""Embedded single file database backends for loading the wrangled data
+
+The Postgres loader is in postgres_load_data.py.  These backends need no database server,
+so the SQL queries can be run locally, for example in CI.
+"""
+
+__author__ = 'Stephen Diehl'
+
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from sqlalchemy.types import SmallInteger, Integer, BigInteger, Numeric, Float, Boolean, DateTime
+
+# SQL type names which all of the embedded databases accept
+SQL_TYPE_NAMES = {SmallInteger: 'SMALLINT', Integer: 'INTEGER', BigInteger: 'BIGINT',
+                  Boolean: 'BOOLEAN', DateTime: 'TIMESTAMP'}
+
+
+def get_sql_type_name(sql_type):
+    """SQL type name for a type chosen by optimize_db_dtypes().  Strings are TEXT."""
+    if sql_type in SQL_TYPE_NAMES:
+        return SQL_TYPE_NAMES[sql_type]
+    elif isinstance(sql_type, Float):
+        return 'REAL' if sql_type.precision == 24 else 'DOUBLE PRECISION'
+    elif isinstance(sql_type, Numeric):
+        return f'DECIMAL({sql_type.precision}, {sql_type.scale})'
+    else:
+        return 'TEXT'
+
+
+def get_create_table_sql(table, db_dtypes, pkey=None, uniques=None, fkeys=None):
+    """CREATE TABLE with the key constraints declared inline.
+
+    The embedded databases cannot add a primary or foreign key to an existing table.
+
+    uniques: list of (constraint name, columns)
+    fkeys: list of (constraint name, columns, referenced table, referenced columns)
+    """
+    lines = [f'{col} {get_sql_type_name(sql_type)}' for col, sql_type in db_dtypes.items()]
+    if pkey:
+        lines.append(f'PRIMARY KEY ({", ".join(pkey)})')
+    for name, columns in uniques or []:
+        lines.append(f'CONSTRAINT {name} UNIQUE ({", ".join(columns)})')
+    for name, columns, ref_table, ref_columns in fkeys or []:
+        lines.append(f'CONSTRAINT {name} FOREIGN KEY ({", ".join(columns)}) '
+                     f'REFERENCES {ref_table} ({", ".join(ref_columns)})')
+
+    columns_str = ',\n    '.join(lines)
+    return f'CREATE TABLE {table} (\n    {columns_str}\n)'
+
+
+class SqliteBackend:
+    """SQLite database file.  The database file is rebuilt from scratch.
+
+    Foreign keys are only enforced by SQLite if PRAGMA foreign_keys = ON, which is set on this connection.
+    """
+
+    def __init__(self, db_file):
+        Path(db_file).unlink(missing_ok=True)
+        self.con = sqlite3.connect(db_file)
+
+        # the file is rebuilt from the csv files if the load fails, so no journal is needed
+        self.con.execute('PRAGMA journal_mode = OFF')
+        self.con.execute('PRAGMA synchronous = OFF')
+        self.con.execute('PRAGMA foreign_keys = ON')
+
+    def create_table(self, table, db_dtypes, pkey=None, uniques=None, fkeys=None):
+        self.con.execute(get_create_table_sql(table, db_dtypes, pkey, uniques, fkeys))
+
+    def create_table_as(self, table, sql):
+        self.con.execute(f'CREATE TABLE {table} AS {sql}')
+
+    def insert(self, table, df):
+        # Python objects with missing values as None, which is what sqlite3 binds
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        params = ', '.join(['?'] * len(df.columns))
+        self.con.executemany(f'INSERT INTO {table} VALUES ({params})', rows)
+
+    def count(self, table):
+        return self.con.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    def close(self):
+        self.con.commit()
+        self.con.close()
+
+
+class DuckdbBackend(SqliteBackend):
+    """DuckDB database file: an embedded columnar analytic database.  The database file is rebuilt from scratch.
+
+    Each chunk is inserted by DuckDB scanning the DataFrame's numpy arrays in place, rather than
+    by converting the rows to Python objects.
+    """
+
+    def __init__(self, db_file):
+        # duckdb is only needed for this backend
+        import duckdb
+
+        Path(db_file).unlink(missing_ok=True)
+        self.con = duckdb.connect(str(db_file))
+
+    def insert(self, table, df):
+        self.con.register('chunk', df)
+        self.con.execute(f'INSERT INTO {table} SELECT * FROM chunk')
+        self.con.unregister('chunk')
+
+    def close(self):
+        self.con.close()
+
+
+# store timestamps as ISO 8601 text, which the SQLite date and time functions accept
+sqlite3.register_adapter(pd.Timestamp, str)
+
+BACKENDS = {'sqlite': SqliteBackend, 'duckdb': DuckdbBackend}
@@ -0,0 +1,320 @@
+"""Timing, Row Throughput and Peak Memory Instrumentation
+
+A stage is one run of a script, and a step is some work within it, for example
+collecting the cwdaily files.  Each is measured with a context manager:
+
+    with instrument.stage('retrosheet_collect', logger):
+        with instrument.step('collect cwdaily', logger) as s:
+            df = ...
+            s.rows_out = len(df)
+            s.add_written(filename)
+
+Each stage and step is logged and appended as one JSON line to the metrics file of the run:
+metrics/{stage}_{YYYYmmdd_HHMMSS}.jsonl, next to download.log.
+
+With --profile, the run (or the steps with a given name) is also profiled, and the reports are
+written to profiles/, see add_profile_args().  What to profile is passed to stage():
+
+    with instrument.stage('retrosheet_collect', logger, profile=instrument.get_profile(args)):
+"""
+
+__author__ = 'Stephen Diehl'
+
+import cProfile
+import collections
+import contextvars
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+METRICS_DIR = 'metrics'
+PROFILES_DIR = 'profiles'
+
+# the metrics file of the run and the lock for writing to it, the scripts may run concurrently in one process
+_run = {'file': None}
+_lock = threading.Lock()
+
+# what to profile, set by stage() for its with block, and the lock held while profiling: only one profiler
+# can run at a time.  It is a context variable, so the scripts run concurrently in one process each have
+# their own, and a thread started by a stage must be run in a copy of its context to see it.
+_profile = contextvars.ContextVar('profile', default=None)
+_profiling = threading.Lock()
+
+
+def get_peak_rss_mb():
+    """Peak resident memory of this process so far, in MB."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 2 ** 10
+
+
+def get_child_cpu():
+    """CPU seconds of the child processes which have finished, for example the Retrosheet parsers."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Step:
+    """Measurements of a stage or step.  The rows and bytes are set by the code being measured."""
+
+    def __init__(self, kind, name, fields):
+        self.kind = kind
+        self.name = name
+        self.fields = fields
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add_read(self, filename):
+        self.bytes_read += os.path.getsize(filename)
+
+    def add_written(self, filename):
+        self.bytes_written += os.path.getsize(filename)
+
+    def start(self):
+        self.started = datetime.now()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.child_cpu = get_child_cpu()
+
+    def finish(self):
+        """The record of the measurements.
+
+        cpu_s is for the whole process, so it includes other threads, such as background writes.
+        peak_rss_mb is the peak for the process up to the end of the step.
+        """
+        record = {'kind': self.kind, 'name': self.name,
+                  'start': self.started.isoformat(timespec='seconds'),
+                  'wall_s': round(time.perf_counter() - self.wall, 3),
+                  'cpu_s': round(time.process_time() - self.cpu, 3),
+                  'child_cpu_s': round(get_child_cpu() - self.child_cpu, 3),
+                  'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                  'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                  'peak_rss_mb': get_peak_rss_mb()}
+        record.update(self.fields)
+        return record
+
+
+def write_record(record):
+    with _lock:
+        if _run['file'] is not None:
+            with open(_run['file'], 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+def log_record(logger, record):
+    if logger is None:
+        return
+    rows = f', {record["rows_out"]:,d} rows' if record['rows_out'] is not None else ''
+    peak = f', peak RSS {record["peak_rss_mb"]:,.0f} MB' if record['peak_rss_mb'] is not None else ''
+    logger.info(f'{record["name"]}: {record["wall_s"]:.1f}s wall, {record["cpu_s"]:.1f}s cpu{rows}{peak}')
+
+
+@contextmanager
+def measure(kind, name, logger, fields):
+    """Measure the with block, then log and write its record.  ok is False if it raised an exception."""
+    s = Step(kind, name, fields)
+    settings = _profile.get() or {'target': None}
+    target = settings['target']
+    profiling = profile(name, fields, settings['interval'], settings['top'], logger) \
+        if target == name or (kind == 'stage' and target == 'run') else nullcontext()
+
+    s.start()
+    ok = False
+    try:
+        with profiling:
+            yield s
+        ok = True
+    finally:
+        record = s.finish()
+        record['ok'] = ok
+        log_record(logger, record)
+        write_record(record)
+
+
+@contextmanager
+def step(name, logger=None, **fields):
+    """Measure the work in the with block.  fields are added to the record, for example year=2019."""
+    with measure('step', name, logger, fields) as s:
+        yield s
+
+
+@contextmanager
+def stage(name, logger=None, metrics_dir=METRICS_DIR, profile=None, **fields):
+    """Measure a run of a script, and write the records of its steps to a new metrics file.
+
+    If a metrics file is already open, for example when the scripts are run in one process
+    by run_all_scripts.py --in-process, the records are written to it instead.
+
+    profile is what to profile in the with block, from get_profile().  It applies only to the
+    stage and steps in this context, so concurrent stages do not change each other's.
+    """
+    with _lock:
+        opened = _run['file'] is None
+        if opened:
+            Path(metrics_dir).mkdir(parents=True, exist_ok=True)
+            _run['file'] = Path(metrics_dir) / f'{name}_{datetime.now():%Y%m%d_%H%M%S}.jsonl'
+    token = _profile.set(profile) if profile is not None else None
+
+    try:
+        with measure('stage', name, logger, fields) as s:
+            yield s
+    finally:
+        if token is not None:
+            _profile.reset(token)
+        if opened:
+            with _lock:
+                _run['file'] = None
+
+
+def add_profile_args(parser):
+    """Add the --profile options to the parser of a script.  main() passes get_profile(args) to stage()."""
+    parser.add_argument("--profile", nargs='?', const='run', metavar='STEP',
+                        help="profile the run, or only the steps named STEP, for example --profile='create batting', "
+                             "and write the reports to profiles/")
+    parser.add_argument("--profile-interval", type=float, metavar='SECONDS',
+                        help="with --profile, also sample the stack of every thread each SECONDS, for example 0.01")
+    parser.add_argument("--profile-memory", type=int, metavar='N',
+                        help="with --profile, also report the N source lines which allocated the most memory")
+
+
+def get_profile(args):
+    """What to profile, from the --profile options, or None if nothing is.  See add_profile_args()."""
+    if args.profile is None:
+        return None
+    return {'target': args.profile, 'interval': args.profile_interval, 'top': args.profile_memory}
+
+
+class Sampler(threading.Thread):
+    """Count the stacks of all the other threads, sampled at a fixed interval.
+
+    Unlike cProfile, sampling includes the threads started by the profiled code, such as background writes.
+    """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f'{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, filename):
+        """The functions most often at the top of the stack, then the stacks in the folded format of flamegraph.pl"""
+        total = sum(self.stacks.values())
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+
+        with open(filename, 'w') as f:
+            f.write(f'{total} samples every {self.interval}s\n\n  samples      %  function\n')
+            for function, count in leaves.most_common(40):
+                f.write(f'{count:9d} {100 * count / total:6.1f}  {function}\n')
+            f.write('\n')
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def write_profile(profiler, filename):
+    """The functions sorted by cumulative time, then by their own time."""
+    with open(filename, 'w') as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats('cumulative').print_stats(50)
+        stats.sort_stats('tottime').print_stats(50)
+
+
+def write_memory(snapshot, top, filename):
+    """The source lines which allocated the most memory still held at the end, and the peak traced memory."""
+    _, peak = tracemalloc.get_traced_memory()
+    with open(filename, 'w') as f:
+        f.write(f'peak traced memory: {peak / 2 ** 20:,.1f} MB\n\n')
+        for stat in snapshot.statistics('lineno')[:top]:
+            f.write(f'{stat}\n')
+
+
+@contextmanager
+def profile(name, fields=None, interval=None, top=None, logger=None, profiles_dir=PROFILES_DIR):
+    """Profile the with block with cProfile, and optionally by sampling and with tracemalloc.
+
+    The reports are written to {profiles_dir}/{name}_{fields}_{YYYYmmdd_HHMMSS} with the suffixes:
+      .prof -- cProfile stats, which can be sorted with: python -m pstats file.prof
+      .txt -- the functions sorted by cumulative time and by their own time
+      _samples.txt -- if interval is given, the sampled stacks of all threads
+      _memory.txt -- if top is given, the top source lines by allocated memory
+
+    cProfile only measures the thread that enters the with block.  If another block is already
+    being profiled, for example by a concurrent step, this block is not profiled.
+    """
+    if not _profiling.acquire(blocking=False):
+        if logger is not None:
+            logger.warning(f'{name} is not profiled -- another profile is running')
+        yield
+        return
+
+    try:
+        parts = [name] + [str(value) for value in (fields or {}).values()] + [f'{datetime.now():%Y%m%d_%H%M%S}']
+        Path(profiles_dir).mkdir(parents=True, exist_ok=True)
+        stem = Path(profiles_dir) / '_'.join(parts).replace(' ', '_')
+
+        started_tracemalloc = top is not None and not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        sampler = Sampler(interval) if interval else None
+        if sampler is not None:
+            sampler.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            if top is not None:
+                # the snapshot is taken before the reports are written, and excludes the profilers' own memory
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [tracemalloc.Filter(False, module.__file__) for module in [cProfile, pstats, sys.modules[__name__]]])
+                write_memory(snapshot, top, f'{stem}_memory.txt')
+                if started_tracemalloc:
+                    tracemalloc.stop()
+
+            profiler.dump_stats(f'{stem}.prof')
+            write_profile(profiler, f'{stem}.txt')
+            if sampler is not None:
+                sampler.write(f'{stem}_samples.txt')
+            if logger is not None:
+                logger.info(f'{name} profile written to {stem}.txt')
+    finally:
+        _profiling.release()
@@ -0,0 +1,172 @@
+"""Multi-Column Key Integrity
+
+Primary key checks for large tables with string keys, such as event and player_game.
+
+The key columns are factorized to integer codes, which are combined into one int64 code per row,
+so that rows with the same key have the same code.  Whether the key is unique, and which rows
+are duplicates, is then found from the int64 codes: by counting them (np.bincount) if there are
+few possible codes, otherwise by sorting them.
+
+The wrangled tables are grouped by game, which is used to avoid most of the hashing and sorting:
+  * a string column such as game_id is in runs of the same value, so only the first value of
+    each run is factorized
+  * an integer column such as event_id is offset by its min rather than factorized
+  * the combined codes are then often increasing already, in which case there is nothing to sort
+
+The table is never modified or copied.  Only its key columns are read, one at a time, so it may
+be any table which returns a Series for table[col], such as a column_store.LazyTable.
+"""
+
+__author__ = 'Stephen Diehl'
+
+import numpy as np
+import pandas as pd
+
+# the combined codes are renumbered before they could overflow int64
+MAX_CODES = 2 ** 62
+
+# the rows sampled to decide whether a column is in runs of the same value
+RUN_SAMPLE = 10_000
+
+
+def factorize_runs(values):
+    """pd.factorize() of values which are mostly in runs of the same value, by factorizing the first of each run."""
+    starts = np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]))
+    codes, uniques = pd.factorize(values[starts])
+    return np.repeat(codes, np.diff(np.append(starts, len(values)))), uniques
+
+
+def factorize_column(s):
+    """Integer codes of the values from -1 for null up to n - 2, and n, the number of possible codes.
+
+    Unlike pd.factorize(), not all of the codes need be used.
+    """
+    if pd.api.types.is_integer_dtype(s.dtype) or pd.api.types.is_bool_dtype(s.dtype):
+        low, high = s.min(), s.max()
+        if pd.isna(low):
+            # no values, or all null
+            return np.full(len(s), -1, dtype=np.int64), 1
+        low, high = int(low), int(high)
+        if high - low < 2 ** 31:
+            # the values are made into the codes in place, so they must not be the column itself
+            values = s.to_numpy(dtype=np.int64, na_value=low - 1)
+            if getattr(s.dtype, 'numpy_dtype', s.dtype) == np.int64:
+                values = values.copy()
+            values -= low
+            return values, high - low + 2
+
+    values = s.to_numpy()
+    sample = values[:RUN_SAMPLE]
+    if values.dtype == object and (sample[1:] != sample[:-1]).sum() < len(sample) // 4:
+        codes, uniques = factorize_runs(values)
+    else:
+        codes, uniques = pd.factorize(values)
+    return codes, len(uniques) + 1
+
+
+def get_key_codes(df, cols):
+    """The int64 code of the key of each row, the number of possible codes, and which keys have a null.
+
+    The codes are from 0 up to the number of possible codes.  A null is a value of its own, so
+    keys with nulls in the same columns and the same other values have the same code.
+    """
+    key = None
+    size = 1
+    has_null = None
+    for col in cols:
+        codes, n = factorize_column(df[col])
+        null = codes < 0
+        if key is None:
+            key = codes.astype(np.int64, copy=False)
+            has_null = null
+        else:
+            if size * n > MAX_CODES:
+                key, uniques = pd.factorize(key)
+                size = len(uniques)
+
+            # the codes are combined in place, null is code -1 which becomes 0
+            key *= n
+            key += codes
+            has_null |= null
+        key += 1
+        size *= n
+
+    return key, size, has_null
+
+
+def is_unique(df, cols, ignore_null=False):
+    """Whether no two rows have the same values for cols.
+
+    If ignore_null, rows with a null value in any of cols are ignored.
+    """
+    key, size, has_null = get_key_codes(df, cols)
+    if ignore_null:
+        key = key[~has_null]
+    if len(key) < 2:
+        return True
+
+    # for a table grouped by key, the codes are usually increasing
+    if (key[1:] > key[:-1]).all():
+        return True
+
+    if size <= 4 * len(key):
+        return bool(np.bincount(key, minlength=size).max() <= 1)
+
+    key = np.sort(key)
+    return not bool((key[1:] == key[:-1]).any())
+
+
+def duplicated(df, cols, keep='first'):
+    """Boolean Series of the rows whose values for cols are the same as another row's.
+
+    The same as df.duplicated(subset=cols, keep=keep):
+      first -- all but the first row of each key are duplicates
+      last -- all but the last row of each key are duplicates
+      False -- all the rows of each key which has more than one row are duplicates
+    """
+    key, _, _ = get_key_codes(df, cols)
+    if (key[1:] > key[:-1]).all():
+        return pd.Series(np.zeros(len(key), dtype=bool), index=df.index)
+
+    # a stable sort keeps the rows with the same key in their original order
+    order = np.argsort(key, kind='stable')
+    same = key[order[1:]] == key[order[:-1]]
+
+    dups = np.zeros(len(key), dtype=bool)
+    if keep == 'first':
+        dups[1:] = same
+    elif keep == 'last':
+        dups[:-1] = same
+    elif keep is False:
+        dups[1:] = same
+        dups[:-1] |= same
+    else:
+        raise ValueError(f'keep must be first, last or False, not {keep}')
+
+    mask = np.empty(len(key), dtype=bool)
+    mask[order] = dups
+    return pd.Series(mask, index=df.index)
+
+
+def get_duplicate_groups(df, cols):
+    """The positions of the rows whose values for cols are not unique, grouped by key, and the start of each group.
+
+    The rows of each group are in their original order, so the first row of group i is
+    positions[starts[i]].  Both are empty if there are no duplicates.
+    """
+    key, _, _ = get_key_codes(df, cols)
+    if (key[1:] > key[:-1]).all():
+        return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    same = sorted_key[1:] == sorted_key[:-1]
+
+    in_group = np.zeros(len(key), dtype=bool)
+    in_group[1:] = same
+    in_group[:-1] |= same
+
+    positions = order[in_group]
+    group_key = sorted_key[in_group]
+    starts = np.flatnonzero(np.concatenate([[True], group_key[1:] != group_key[:-1]]))
+    return positions, starts
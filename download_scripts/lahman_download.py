@@ -51,12 +51,10 @@ def mk_dirs(data_dir):
 
 def download_data(raw_dir):
     """download and unzip Lahman zip file"""
-    os.chdir(raw_dir)
-
     # download most recent data dictionary (accurate for 2019)
     url = 'http://www.seanlahman.com/files/database/readme2017.txt'
-    dd_filename = '../readme2017.txt'
-    if not Path(dd_filename).is_file():
+    dd_filename = raw_dir.parent / 'readme2017.txt'
+    if not dd_filename.is_file():
         r = requests.get(url)
         r.raise_for_status()
         with open(dd_filename, 'wb') as f:
@@ -64,9 +62,9 @@ def download_data(raw_dir):
 
     # download most recent Lahman data
     # most recent data is not from www.seanlahman.com.  It is from chadwickbureau on github.
-    zip_filename = 'baseballdatabank-master.zip'
+    zip_filename = raw_dir / 'baseballdatabank-master.zip'
 
-    if not Path(zip_filename).is_file():
+    if not zip_filename.is_file():
         logger.info('Downloading Data ...')
 
         url = 'https://github.com/chadwickbureau/baseballdatabank/archive/master.zip'
@@ -77,32 +75,30 @@ def download_data(raw_dir):
 
         # unzip it
         with zipfile.ZipFile(zip_filename, "r") as zip_ref:
-            zip_ref.extractall('.')
+            zip_ref.extractall(raw_dir)
 
 
 def reorg_files(raw_dir):
     """move the unzipped files to the raw directory and remove the extract directory"""
-    os.chdir(raw_dir)
-
-    if not Path('People.csv').is_file():
+    if not (raw_dir / 'People.csv').is_file():
         unzip_dir = raw_dir / 'baseballdatabank-master' / 'core'
 
-        # move the unzipped csv files to the current working directory
+        # move the unzipped csv files to the raw directory
         for root, dirs, files in os.walk(unzip_dir):
             for file in files:
-                shutil.move(root + '/' + file, '.')
+                shutil.move(root + '/' + file, raw_dir)
 
         # rm the extract directory
-        shutil.rmtree('baseballdatabank-master')
+        shutil.rmtree(unzip_dir.parent)
 
-    msg = '\n'.join(os.listdir('.'))
+    msg = '\n'.join(os.listdir(raw_dir))
     logger.info(f'{raw_dir} contents:\n {msg}')
 
 
-def main():
+def main(argv=None):
     """Download and Unzip Lahman Data to {data_dir}/lahman/raw"""
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.log_level:
         fh = logging.FileHandler('download.log')
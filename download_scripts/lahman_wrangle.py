@@ -9,13 +9,13 @@ __author__ = 'Stephen Diehl'
 
 import pandas as pd
 
-import os
 import argparse
 from pathlib import Path
 import logging
 import sys
 
 import data_helper as dh
+import instrument
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -83,6 +83,8 @@ def get_parser():
     parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help="Set the logging level")
 
+    instrument.add_profile_args(parser)
+
     return parser
 
 
@@ -117,8 +119,7 @@ def wrangle_basic(p_raw, p_wrangled, filename):
         logger.info(f'Skipping wrangle of {filename} - already performed')
         return
 
-    os.chdir(p_raw)
-    df = pd.read_csv(filename)
+    df = pd.read_csv(p_raw / filename)
 
     df.rename(columns=get_fieldname_mapping(), inplace=True)
     df.columns = df.columns.str.lower()
@@ -130,7 +131,6 @@ def wrangle_basic(p_raw, p_wrangled, filename):
     logger.info(f'{filename}\n{msg}')
 
     # persist with optimized datatypes
-    os.chdir(p_wrangled)
     dh.to_csv_with_types(df, wrangled_file)
 
 
@@ -141,8 +141,7 @@ def wrangle_people(p_raw, p_wrangled):
         logger.info('Skipping wrangle of People.csv - already performed')
         return
 
-    os.chdir(p_raw)
-    people = pd.read_csv('People.csv', parse_dates=['debut', 'finalGame'])
+    people = pd.read_csv(p_raw / 'People.csv', parse_dates=['debut', 'finalGame'])
 
     people.rename(columns=get_fieldname_mapping(), inplace=True)
     people.columns = people.columns.str.lower()
@@ -157,8 +156,7 @@ def wrangle_people(p_raw, p_wrangled):
     logger.info('people\n{}'.format(msg))
 
     # persist as a csv file with data types
-    os.chdir(p_wrangled)
-    dh.to_csv_with_types(people, 'people.csv')
+    dh.to_csv_with_types(people, p_wrangled / 'people.csv')
 
 
 def wrangle_fielding(p_raw, p_wrangled):
@@ -168,8 +166,7 @@ def wrangle_fielding(p_raw, p_wrangled):
         logger.info('Skipping wrangle of Fielding.csv - already performed')
         return
 
-    os.chdir(p_raw)
-    fielding = pd.read_csv('Fielding.csv')
+    fielding = pd.read_csv(p_raw / 'Fielding.csv')
 
     fielding.rename(columns=get_fieldname_mapping(), inplace=True)
     fielding.columns = fielding.columns.str.lower()
@@ -187,14 +184,13 @@ def wrangle_fielding(p_raw, p_wrangled):
     logger.info('fielding\n{}'.format(msg))
 
     # persist
-    os.chdir(p_wrangled)
-    dh.to_csv_with_types(fielding, 'fielding.csv')
+    dh.to_csv_with_types(fielding, p_wrangled / 'fielding.csv')
 
 
-def main():
+def main(argv=None):
     """Wrangle the data"""
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.log_level:
         fh = logging.FileHandler('download.log')
@@ -214,18 +210,17 @@ def main():
     p_lahman_raw = Path(args.data_dir).joinpath('lahman/raw').resolve()
     p_lahman_wrangled = Path(args.data_dir).joinpath('lahman/wrangled').resolve()
 
-    wrangle_people(p_lahman_raw, p_lahman_wrangled)
-    wrangle_fielding(p_lahman_raw, p_lahman_wrangled)
-
-    # TODO add fieldname mappings to support other Lahman csv files
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'Batting.csv')
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'BattingPost.csv')
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'FieldingPost.csv')
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'Pitching.csv')
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'PitchingPost.csv')
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'Teams.csv')
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'Salaries.csv')
-    wrangle_basic(p_lahman_raw, p_lahman_wrangled, 'Parks.csv')
+    with instrument.stage('lahman_wrangle', logger, profile=instrument.get_profile(args)):
+        with instrument.step('wrangle People.csv', logger):
+            wrangle_people(p_lahman_raw, p_lahman_wrangled)
+        with instrument.step('wrangle Fielding.csv', logger):
+            wrangle_fielding(p_lahman_raw, p_lahman_wrangled)
+
+        # TODO add fieldname mappings to support other Lahman csv files
+        for filename in ['Batting.csv', 'BattingPost.csv', 'FieldingPost.csv', 'Pitching.csv',
+                         'PitchingPost.csv', 'Teams.csv', 'Salaries.csv', 'Parks.csv']:
+            with instrument.step(f'wrangle {filename}', logger):
+                wrangle_basic(p_lahman_raw, p_lahman_wrangled, filename)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""Compute Park Factors per team per year from {data_dir}/retrosheet/wrangled and persist them to park_factor.csv
+
+Park Factor (PF) is the average runs per game (both teams) in a team's home park,
+divided by the average runs per game in its games in other parks.
+"""
+
+__author__ = 'Stephen Diehl'
+
+import argparse
+from pathlib import Path
+import logging
+import sys
+
+import pandas as pd
+import numpy as np
+
+import data_helper as dh
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def get_parser():
+    """Args Description"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--data-dir", type=str, help="baseball data directory", default='../data')
+    parser.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level")
+    parser.add_argument("--rolling-years", type=int, nargs='*', default=[3],
+                        help="also compute multi-year park factors over these numbers of years")
+
+    return parser
+
+
+def compute_park_runs(team_game, game):
+    """Compute runs total and games at home and on the road per team per year.
+
+    This is the vectorized equivalent of the 03a_ParkFactor notebook functions:
+    create_tg_parks, create_home_parks, remove_games, compute_runs_scored,
+    compute_runs_allowed and compute_runs_total.
+
+    team_game requires: game_id, year, team_id, r
+    game requires: game_id, park_id
+
+    Each team's home park is the park in which it played the most games that year.
+    Games in which the team batting last was not at its home park (e.g. games in London)
+    are removed.  Runs total is the runs scored plus the runs allowed.
+
+    All keys are converted to integer codes, and the games and runs per (team, year, park)
+    are counted with np.bincount, rather than with MultiIndex groupby and join operations.
+    """
+    game_codes, game_ids = pd.factorize(team_game['game_id'])
+    ty_codes, ty_index = pd.factorize(pd.MultiIndex.from_arrays([team_game['team_id'], team_game['year']]))
+    park_codes, park_ids = pd.factorize(game.set_index('game_id')['park_id'].reindex(game_ids))
+    park_codes = park_codes[game_codes]
+    n_ty, n_park = len(ty_index), len(park_ids)
+
+    # runs total for a game is the same for both teams: runs scored + runs allowed
+    runs = team_game['r'].to_numpy(dtype=np.float64)
+    game_rt = np.bincount(game_codes, weights=runs)
+    rt = game_rt[game_codes]
+
+    # one integer key per (team, year, park)
+    key = ty_codes * n_park + park_codes
+
+    def count(keep):
+        games = np.bincount(key, weights=keep, minlength=n_ty * n_park).reshape(n_ty, n_park)
+        runs_total = np.bincount(key, weights=rt * keep, minlength=n_ty * n_park).reshape(n_ty, n_park)
+        return games, runs_total
+
+    # each team's home park is the park with the most games
+    games, _ = count(np.ones(len(key)))
+    home_park = games.argmax(axis=1)
+
+    # remove the games in which the team batting last is not at its home park
+    bat_last = team_game['bat_last'].to_numpy(dtype=bool)
+    away_from_home = bat_last & (park_codes != home_park[ty_codes])
+    removed = np.zeros(len(game_ids), dtype=bool)
+    removed[game_codes[away_from_home]] = True
+    keep = (~removed[game_codes]).astype(np.float64)
+
+    games, runs_total = count(keep)
+    rows = np.arange(n_ty)
+
+    park_runs = pd.DataFrame({
+        'team_id': ty_index.get_level_values(0),
+        'year': ty_index.get_level_values(1),
+        'park_id': park_ids[home_park],
+        'games_home': games[rows, home_park].astype(np.int64),
+        'rt_home': runs_total[rows, home_park].astype(np.int64),
+        'games_road': (games.sum(axis=1) - games[rows, home_park]).astype(np.int64),
+        'rt_road': (runs_total.sum(axis=1) - runs_total[rows, home_park]).astype(np.int64)})
+
+    return park_runs.sort_values(['team_id', 'year']).reset_index(drop=True)
+
+
+def sum_years(df, group_cols, sum_cols, years):
+    """Sum of sum_cols over the rows of the same group in the years y-n+1 through y, for each row.
+
+    The window is over years, not rows, so a gap of several years in a group is not bridged, and
+    the result does not depend upon the order of the rows.  Each group has at most one row per year.
+
+    The rows are sorted by group and year with one integer key per row, so that the first row of
+    each window is found with np.searchsorted, and the sums are differences of cumulative sums.
+    """
+    group_codes, _ = pd.factorize(pd.MultiIndex.from_arrays([df[col] for col in group_cols]))
+    year = df['year'].to_numpy(dtype=np.int64)
+    if not len(df):
+        return pd.DataFrame(0.0, columns=sum_cols, index=df.index)
+
+    # the years of a group are offset so that no window reaches the keys of the prior group
+    span = int(year.max() - year.min()) + 2 * years
+    key = group_codes.astype(np.int64) * span + (year - year.min() + years)
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    starts = np.searchsorted(key, key - (years - 1), side='left')
+
+    # cumulative sums with a leading 0, so the sum of sorted rows i through j is csum[j+1] - csum[i]
+    values = df[sum_cols].to_numpy(dtype=np.float64)[order]
+    csum = np.concatenate([np.zeros((1, len(sum_cols))), values.cumsum(axis=0)])
+
+    sums = np.empty_like(values)
+    sums[order] = csum[np.arange(1, len(df) + 1)] - csum[starts]
+    return pd.DataFrame(sums, columns=sum_cols, index=df.index)
+
+
+def compute_pf(park_runs, rolling_years=None):
+    """Compute the Park Factor per team per year, and optionally over several years.
+
+    pf_half is the Park Factor applied to a team's stats, as half its games are on the road.
+
+    For each number of years n in rolling_years, pf_{n}yr is computed from the runs and games
+    in the years y-n+1 through y in the same home park.  Years in which the team had another
+    home park, or did not play, are not replaced by earlier years.
+    """
+    pf = park_runs.copy()
+    pf['pf'] = (pf['rt_home'] / pf['games_home']) / (pf['rt_road'] / pf['games_road'])
+    pf['pf_half'] = (1.0 + pf['pf']) / 2.0
+
+    sum_cols = ['games_home', 'rt_home', 'games_road', 'rt_road']
+    for years in rolling_years or []:
+        sums = sum_years(pf, ['team_id', 'park_id'], sum_cols, years)
+        pf[f'pf_{years}yr'] = (sums['rt_home'] / sums['games_home']) / (sums['rt_road'] / sums['games_road'])
+
+    return pf
+
+
+def main():
+    """Compute and persist the park factors.
+    """
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.log_level:
+        fh = logging.FileHandler('download.log')
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        fh.setFormatter(formatter)
+        fh.setLevel(args.log_level)
+        logger.addHandler(fh)
+
+    if args.verbose:
+        # send INFO level logging to stdout
+        sh = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        sh.setFormatter(formatter)
+        sh.setLevel(logging.INFO)
+        logger.addHandler(sh)
+
+    data_dir = Path(args.data_dir)
+    p_retrosheet_wrangled = (data_dir / 'retrosheet/wrangled').resolve()
+
+    cols = ['game_id', 'year', 'bat_last', 'team_id', 'r']
+    team_game = dh.from_csv_with_types(p_retrosheet_wrangled / 'team_game.csv.gz', usecols=cols)
+
+    cols = ['game_id', 'park_id']
+    game = dh.from_csv_with_types(p_retrosheet_wrangled / 'game.csv.gz', usecols=cols)
+
+    park_runs = compute_park_runs(team_game, game)
+    pf = compute_pf(park_runs, args.rolling_years)
+
+    logger.info(f'Writing park factors for {len(pf):,d} team seasons')
+    dh.to_csv_with_types(pf, p_retrosheet_wrangled / 'park_factor.csv')
+
+    logger.info('Finished')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,10 +7,10 @@ __author__ = 'Stephen Diehl'
 import argparse
 import sys
 from pathlib import Path
-import os
-import glob
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import data_helper as dh
+import instrument
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,81 +30,94 @@ def get_parser():
     parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help="Set the logging level")
 
+    instrument.add_profile_args(parser)
+
     return parser
 
 
-def collect_parsed_files(parse_dir, collect_dir, parser, use_datatypes):
+def collect_parsed_files(parse_dir, collect_dir, parser, use_datatypes, writer=None, writes=None):
     """Collect all parsed files and optimize datatypes.
+
+    The collected DataFrame is persisted and returned.  If writer (an Executor) is given, the file
+    is written by the writer in the background, and the Future of the write is appended to writes.
     """
 
-    os.chdir(parse_dir)
     # read the augmented files, not the ones created by cwevent
     if parser == 'cwevent':
-        dailyfiles = glob.glob(f'{parser}*_plus.csv')
+        dailyfiles = sorted(parse_dir.glob(f'{parser}*_plus.csv'))
     else:
-        dailyfiles = glob.glob(f'{parser}*.csv')
-    dailyfiles.sort()
-
-    logger.info(f'Collecting {len(dailyfiles)} {parser} parsed csv files into single dataframe ...')
-
-    if use_datatypes:
-        # this can save gigabytes of RAM by using precomputed datatypes
-        logger.info('Using precomputed data types')
+        dailyfiles = sorted(parse_dir.glob(f'{parser}*.csv'))
+
+    with instrument.step(f'collect {parser}', logger) as s:
+        logger.info(f'Collecting {len(dailyfiles)} {parser} parsed csv files into single dataframe ...')
+        for f in dailyfiles:
+            s.add_read(f)
+
+        if use_datatypes:
+            # this can save gigabytes of RAM by using precomputed datatypes
+            logger.info('Using precomputed data types')
+            if parser == 'cwdaily':
+                filename = parse_dir.parent / 'player_game_types.csv'
+            elif parser == 'cwgame':
+                filename = parse_dir.parent / 'game_types.csv'
+            elif parser == 'cwevent':
+                filename = parse_dir.parent / 'event_types.csv'
+            else:
+                raise ValueError(f'Unrecognized parser: {parser}')
+
+            dates, dtypes = dh.read_types(filename)
+            dtypes = {key.upper(): value for key, value in dtypes.items()}
+
+            df = pd.concat((pd.read_csv(f, parse_dates=dates, dtype=dtypes) for f in dailyfiles),
+                           ignore_index=True, copy=False)
+            logger.info(f'Optimized Memory Usage:   {dh.mem_usage(df)}')
+        else:
+            # This could use twice the RAM required to hold the unoptimized DataFrame!
+            # cwgame parser will output the line score (line_tx) like: 001001001
+            # but without double quotes around it, so it gets interpreted as a number.
+            # Specify dtype for line score fields to get around this.
+            df = pd.concat((pd.read_csv(f, dtype={'AWAY_LINE_TX': str, 'HOME_LINE_TX': str})
+                            for f in dailyfiles), ignore_index=True, copy=False)
+
+            logger.info(f'Unoptimized Memory Usage: {dh.mem_usage(df)}')
+            logger.info('Optimizing Data Types to reduce memory ...')
+
+            # for cwdaily, optimize_df_dtypes reduces the size of the dataframe by a factor of 3
+            dh.optimize_df_dtypes(df)
+            logger.info(f'Optimized Memory Usage:   {dh.mem_usage(df)}')
+
+        # convert to lower case
+        df.columns = df.columns.str.lower()
+
+        # drop any column that is more than 99% null
+        filt = df.isna().mean() > 0.99
+        if filt.any():
+            drop_cols = df.columns[filt]
+            logger.warning(f'Cols > 99% missing being dropped: {" ".join(drop_cols)}')
+            df.drop(drop_cols, axis=1, inplace=True)
+
+        s.rows_out = len(df)
+
+        # persist optimized dataframe
+        # gzip chosen over xy because this runs on client computer and gzip is faster
+        logger.info('persisting dataframe using compression - this could take several minutes ...')
         if parser == 'cwdaily':
-            filename = '../player_game_types.csv'
+            filename = 'player_game.csv.gz'
         elif parser == 'cwgame':
-            filename = '../game_types.csv'
-        elif parser == 'cwevent':
-            filename = '../event_types.csv'
+            filename = 'game.csv.gz'
+        elif parser == 'cwevent':  # was wrangled in parser to save RAM, write to wrangled dir
+            filename = 'event.csv.gz'
         else:
             raise ValueError(f'Unrecognized parser: {parser}')
 
-        dates, dtypes = dh.read_types(filename)
-        dtypes = {key.upper(): value for key, value in dtypes.items()}
-
-        df = pd.concat((pd.read_csv(f, parse_dates=dates, dtype=dtypes) for f in dailyfiles),
-                       ignore_index=True, copy=False)
-        logger.info(f'Optimized Memory Usage:   {dh.mem_usage(df)}')
-    else:
-        # This could use twice the RAM required to hold the unoptimized DataFrame!
-        # cwgame parser will output the line score (line_tx) like: 001001001
-        # but without double quotes around it, so it gets interpreted as a number.
-        # Specify dtype for line score fields to get around this.
-        df = pd.concat((pd.read_csv(f, dtype={'AWAY_LINE_TX': str, 'HOME_LINE_TX': str})
-                        for f in dailyfiles), ignore_index=True, copy=False)
-
-        logger.info(f'Unoptimized Memory Usage: {dh.mem_usage(df)}')
-        logger.info('Optimizing Data Types to reduce memory ...')
-
-        # for cwdaily, optimize_df_dtypes reduces the size of the dataframe by a factor of 3
-        dh.optimize_df_dtypes(df)
-        logger.info(f'Optimized Memory Usage:   {dh.mem_usage(df)}')
-
-    # convert to lower case
-    df.columns = df.columns.str.lower()
-
-    # drop any column that is more than 99% null
-    filt = df.isna().mean() > 0.99
-    if filt.any():
-        drop_cols = df.columns[filt]
-        logger.warning(f'Cols > 99% missing being dropped: {" ".join(drop_cols)}')
-        df.drop(drop_cols, axis=1, inplace=True)
-
-    # persist optimized dataframe
-    # gzip chosen over xy because this runs on client computer and gzip is faster
-    logger.info('persisting dataframe using compression - this could take several minutes ...')
-    os.chdir(collect_dir)
-    if parser == 'cwdaily':
-        filename = 'player_game.csv.gz'
-    elif parser == 'cwgame':
-        filename = 'game.csv.gz'
-    elif parser == 'cwevent':  # was wrangled in parser to save RAM, write to wrangled dir
-        filename = 'event.csv.gz'
-    else:
-        raise ValueError(f'Unrecognized parser: {parser}')
+        if writer is None:
+            dh.to_csv_with_types(df, collect_dir / filename)
+            s.add_written(collect_dir / filename)
+            logger.info(f'{parser} data persisted')
+        else:
+            writes.append(writer.submit(dh.to_csv_with_types, df, collect_dir / filename))
 
-    dh.to_csv_with_types(df, filename)
-    logger.info(f'{parser} data persisted')
+    return df
 
 
 def augment_event_files(p_data_parsed):
@@ -123,63 +136,73 @@ def augment_event_files(p_data_parsed):
     many Gigs of RAM can be saved by collecting csv files that replace the value 'T'
     with the value True (and likewise 'F' with False).
     """
-    os.chdir(p_data_parsed)
     files = p_data_parsed.glob('cwevent????.csv')
     for file in sorted(files):
-        df = pd.read_csv(file)
-        logger.info(f'Creating Augmented Event File: {file.name.split(".")[0]}_plus.csv')
+        with instrument.step('augment cwevent', logger, year=int(file.stem[-4:])) as s:
+            df = pd.read_csv(file)
+            s.add_read(file)
+            s.rows_in = len(df)
+            logger.info(f'Creating Augmented Event File: {file.name.split(".")[0]}_plus.csv')
+
+            # change column names to lowercase
+            cols = [col.lower() for col in df.columns]
+            df.columns = cols
 
-        # change column names to lowercase
-        cols = [col.lower() for col in df.columns]
-        df.columns = cols
+            # prepare to remove _fl from flag fields
+            flag_fields = [col for col in df.columns if col.endswith('_fl')]
+            new_names = [col[:-3] for col in flag_fields]
 
-        # prepare to remove _fl from flag fields
-        flag_fields = [col for col in df.columns if col.endswith('_fl')]
-        new_names = [col[:-3] for col in flag_fields]
+            # convert 'T' to True/False
+            # a bool takes 8 times less memory than the object 'T'
+            df[new_names] = df[flag_fields].applymap(lambda s: s == 'T')
+            df.drop(columns=flag_fields, inplace=True)
 
-        # convert 'T' to True/False
-        # a bool takes 8 times less memory than the object 'T'
-        df[new_names] = df[flag_fields].applymap(lambda s: s == 'T')
-        df.drop(columns=flag_fields, inplace=True)
+            # use "better" names
+            names = {'event_outs_ct': 'outs', 'err_ct': 'e', 'event_runs_ct': 'r',
+                     'bat_home_id': 'home_half', 'pa_new': 'pa', 'bat_team_id': 'team_id',
+                     'fld_team_id': 'opponent_team_id'}
+            df = df.rename(columns=names)
 
-        # use "better" names
-        names = {'event_outs_ct': 'outs', 'err_ct': 'e', 'event_runs_ct': 'r',
-                 'bat_home_id': 'home_half', 'pa_new': 'pa', 'bat_team_id': 'team_id',
-                 'fld_team_id': 'opponent_team_id'}
-        df = df.rename(columns=names)
+            df['so'] = df['event_tx'].str.contains(r'^K')
+            df['sb'] = df['event_tx'].str.count('SB')  # counts multiple stolen bases on one play
+            df['cs'] = df['event_tx'].str.count('CS')  # counts multiple cs on one play
+            df['bk'] = df['event_tx'].str.contains('BK')
 
-        df['so'] = df['event_tx'].str.contains(r'^K')
-        df['sb'] = df['event_tx'].str.count('SB')  # counts multiple stolen bases on one play
-        df['cs'] = df['event_tx'].str.count('CS')  # counts multiple cs on one play
-        df['bk'] = df['event_tx'].str.contains('BK')
+            # 'I' not preceded by 'D' or 'B' or '/' and not followed by 'N'
+            df['ibb'] = df['event_tx'].str.contains(r'(?<![DB\/])I(?!N)')
 
-        # 'I' not preceded by 'D' or 'B' or '/' and not followed by 'N'
-        df['ibb'] = df['event_tx'].str.contains(r'(?<![DB\/])I(?!N)')
+            # 'W' not preceded by 'I' or 'D' and not followed by 'P'
+            df['bb'] = df['event_tx'].str.contains(r'(?<![ID])W(?!P)')
 
-        # 'W' not preceded by 'I' or 'D' and not followed by 'P'
-        df['bb'] = df['event_tx'].str.contains(r'(?<![ID])W(?!P)')
+            # by definition, bb includes ibb
+            df['bb'] |= df['ibb']
 
-        # by definition, bb includes ibb
-        df['bb'] |= df['ibb']
+            df['hbp'] = df['event_tx'].str.contains('HP')
 
-        df['hbp'] = df['event_tx'].str.contains('HP')
+            # batter my reach base on interference by pitcher or catcher or 1st baseman
+            df['xi'] = df['event_tx'].str.contains(r'C/E(?:1|2|3)')
 
-        # batter my reach base on interference by pitcher or catcher or 1st baseman
-        df['xi'] = df['event_tx'].str.contains(r'C/E(?:1|2|3)')
+            df['single'] = df['h_cd'] == 1
+            df['double'] = df['h_cd'] == 2
+            df['triple'] = df['h_cd'] == 3
+            df['hr'] = df['h_cd'] == 4
+            df['h'] = df['h_cd'] > 0
 
-        df['single'] = df['h_cd'] == 1
-        df['double'] = df['h_cd'] == 2
-        df['triple'] = df['h_cd'] == 3
-        df['hr'] = df['h_cd'] == 4
-        df['h'] = df['h_cd'] > 0
+            plus_file = p_data_parsed / f'{file.name.split(".")[0]}_plus.csv'
+            df.to_csv(plus_file, index=False)
+            s.rows_out = len(df)
+            s.add_written(plus_file)
 
-        df.to_csv(f'{file.name.split(".")[0]}_plus.csv', index=False)
 
+def main(argv=None, writes=None):
+    """Collect the CSV files.
 
-def main():
-    """Collect the CSV files."""
+    Returns the collected player_game and game DataFrames, by name, so that they can be wrangled
+    without being read back from disk.  If writes is a list, these files are written in the
+    background, and the Futures of the writes are appended to writes.
+    """
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.log_level:
         fh = logging.FileHandler('download.log')
@@ -204,23 +227,36 @@ def main():
     p_data_parsed.mkdir(parents=True, exist_ok=True)
     p_data_collected.mkdir(parents=True, exist_ok=True)
 
-    event_files = list(p_data_parsed.glob('cwevent*.csv'))
-    if event_files:
-        if p_data.joinpath('retrosheet', 'collected', 'event.csv.gz').exists():
-            logger.info('Skipping cwevent collection -- already performed')
+    with instrument.stage('retrosheet_collect', logger, profile=instrument.get_profile(args)):
+        event_files = list(p_data_parsed.glob('cwevent*.csv'))
+        if event_files:
+            if p_data.joinpath('retrosheet', 'collected', 'event.csv.gz').exists():
+                logger.info('Skipping cwevent collection -- already performed')
+            else:
+                augment_event_files(p_data_parsed)
+                collect_parsed_files(p_data_parsed, p_data_collected, 'cwevent', args.use_datatypes)
+
+        # event.csv.gz is copied by retrosheet_wrangle, so it is not written in the background
+        writer = ThreadPoolExecutor(max_workers=1) if writes is not None else None
+        collected = {}
+
+        if p_data.joinpath('retrosheet', 'collected', 'player_game.csv.gz').exists():
+            logger.info('Skipping cwdaily collection -- already performed')
         else:
-            augment_event_files(p_data_parsed)
-            collect_parsed_files(p_data_parsed, p_data_collected, 'cwevent', args.use_datatypes)
+            collected['player_game'] = collect_parsed_files(p_data_parsed, p_data_collected, 'cwdaily',
+                                                            args.use_datatypes, writer, writes)
 
-    if p_data.joinpath('retrosheet', 'collected', 'player_game.csv.gz').exists():
-        logger.info('Skipping cwdaily collection -- already performed')
-    else:
-        collect_parsed_files(p_data_parsed, p_data_collected, 'cwdaily', args.use_datatypes)
+        if p_data.joinpath('retrosheet', 'collected', 'game.csv.gz').exists():
+            logger.info('Skipping cwgame collection -- already performed')
+        else:
+            collected['game'] = collect_parsed_files(p_data_parsed, p_data_collected, 'cwgame',
+                                                     args.use_datatypes, writer, writes)
 
-    if p_data.joinpath('retrosheet', 'collected', 'game.csv.gz').exists():
-        logger.info('Skipping cwgame collection -- already performed')
-    else:
-        collect_parsed_files(p_data_parsed, p_data_collected, 'cwgame', args.use_datatypes)
+        if writer is not None:
+            # the pending writes continue after shutdown
+            writer.shutdown(wait=False)
+
+    return collected
 
 
 if __name__ == '__main__':
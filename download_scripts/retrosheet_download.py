@@ -48,13 +48,11 @@ def mk_dirs(data_dir):
 def download_data(raw_dir):
     """download and unzip retrosheet event files"""
 
-    os.chdir(raw_dir)
-
     # download most recent Retrosheet data
     # most recent data is from chadwickbureau on github.
-    zip_filename = 'retrosheet-master.zip'
+    zip_filename = raw_dir / 'retrosheet-master.zip'
 
-    if not Path(zip_filename).is_file():
+    if not zip_filename.is_file():
         logger.info('Downloading >200 MB of Data ...')
 
         url = 'https://github.com/chadwickbureau/retrosheet/archive/master.zip'
@@ -65,29 +63,27 @@ def download_data(raw_dir):
 
         # unzip it
         with zipfile.ZipFile(zip_filename, "r") as zip_ref:
-            zip_ref.extractall('.')
+            zip_ref.extractall(raw_dir)
 
 
 def reorg_files(raw_dir):
     """move the unzipped files to the raw directory and remove the extract directory"""
-    os.chdir(raw_dir)
-
     unzip_dir = raw_dir / 'retrosheet-master'
 
     if unzip_dir.exists():
         # move the subdirectories up one directory
         for dir in os.listdir(unzip_dir):
-            shutil.move(unzip_dir.joinpath(dir).as_posix(), '.')
+            shutil.move(unzip_dir.joinpath(dir).as_posix(), raw_dir.as_posix())
 
         # rm the extract directory
-        shutil.rmtree('retrosheet-master')
+        shutil.rmtree(unzip_dir)
 
 
-def main():
+def main(argv=None):
     """Download Retrosheet Event Files
     """
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.log_level:
         fh = logging.FileHandler('download.log')
@@ -8,10 +8,10 @@ import argparse
 import subprocess
 import sys
 from pathlib import Path
-import os
-import glob
 import logging
 
+import instrument
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -42,6 +42,8 @@ def get_parser():
     parser.add_argument("--cwevent-fields", type=str, help="cwevent field specification",
                         default='-f 0,2,3,8,9,10,14,29,36-42,44,45,51,96 -x 1,2,5,8,11,13,14,45,50,55')
 
+    instrument.add_profile_args(parser)
+
     return parser
 
 
@@ -61,49 +63,57 @@ def check_for_retrosheet_parsers():
 
 
 def parse_event_files(raw_dir, parse_dir, parser, fields, start_year, end_year):
-    """Parse raw Retrosheet data"""
-    os.chdir(raw_dir)
+    """Parse raw Retrosheet data
 
+    The parsers are run in raw_dir, as they read the TEAM{year} file from the current directory.
+    """
     for year in range(start_year, end_year + 1):
-        files = sorted(glob.glob(f'{year}*.EV*'))
-        first = True
+        with instrument.step(f'parse {parser}', logger, year=year) as s:
+            files = sorted(p.name for p in raw_dir.glob(f'{year}*.EV*'))
+            first = True
 
-        cmd = [parser]
-        cmd.extend(fields.split(' '))
+            cmd = [parser]
+            cmd.extend(fields.split(' '))
 
-        logger.info(f'{parser} parsing {len(files)} teams for {year} ...')
+            logger.info(f'{parser} parsing {len(files)} teams for {year} ...')
 
-        for file in files:
-            out = f'{parse_dir.as_posix()}/{parser}{year}.csv'
-            if first:
-                # print csv header using -n
-                cmd.append('-n')
-                cmd.extend(['-y', str(year)])
+            for file in files:
+                s.add_read(raw_dir / file)
+                out = f'{parse_dir.as_posix()}/{parser}{year}.csv'
+                if first:
+                    # print csv header using -n
+                    cmd.append('-n')
+                    cmd.extend(['-y', str(year)])
 
-                cmd_full = cmd + [file]
-                logger.debug(f'{" ".join(cmd_full)}')
+                    cmd_full = cmd + [file]
+                    logger.debug(f'{" ".join(cmd_full)}')
 
-                # overwrite existing file if it exists
-                with open(out, "w+") as outfile:
-                    result = subprocess.run(cmd_full, shell=False, stdout=outfile, stderr=subprocess.DEVNULL)
-                first = False
+                    # overwrite existing file if it exists
+                    with open(out, "w+") as outfile:
+                        result = subprocess.run(cmd_full, shell=False, stdout=outfile, stderr=subprocess.DEVNULL,
+                                                cwd=raw_dir)
+                    first = False
 
-                # don't print csv header for subsequent teams in the same year
-                cmd.remove('-n')
-            else:
-                cmd_full = cmd + [file]
-                logger.debug(f'{" ".join(cmd_full)}')
+                    # don't print csv header for subsequent teams in the same year
+                    cmd.remove('-n')
+                else:
+                    cmd_full = cmd + [file]
+                    logger.debug(f'{" ".join(cmd_full)}')
+
+                    # append to existing file
+                    with open(out, "a+") as outfile:
+                        result = subprocess.run(cmd_full, shell=False, stdout=outfile, stderr=subprocess.DEVNULL,
+                                                cwd=raw_dir)
 
-                # append to existing file
-                with open(out, "a+") as outfile:
-                    result = subprocess.run(cmd_full, shell=False, stdout=outfile, stderr=subprocess.DEVNULL)
+            if files:
+                s.add_written(out)
 
 
-def main():
+def main(argv=None):
     """Parse the data and organize the results.
     """
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.log_level:
         fh = logging.FileHandler('download.log')
@@ -128,36 +138,37 @@ def main():
         logger.warning('data consistency tests require end-year >= 2019')
         args.end_year = 2019
 
-    check_for_retrosheet_parsers()
+    with instrument.stage('retrosheet_parse', logger, profile=instrument.get_profile(args)):
+        check_for_retrosheet_parsers()
 
-    p_data = Path(args.data_dir).resolve()
+        p_data = Path(args.data_dir).resolve()
 
-    p_data_raw = p_data.joinpath('retrosheet/raw/event/regular')
-    p_data_parsed = p_data.joinpath('retrosheet/parsed')
-    p_data_collected = p_data.joinpath('retrosheet/collected')
+        p_data_raw = p_data.joinpath('retrosheet/raw/event/regular')
+        p_data_parsed = p_data.joinpath('retrosheet/parsed')
+        p_data_collected = p_data.joinpath('retrosheet/collected')
 
-    # create directories, if they do not exist
-    p_data_parsed.mkdir(parents=True, exist_ok=True)
-    p_data_collected.mkdir(parents=True, exist_ok=True)
+        # create directories, if they do not exist
+        p_data_parsed.mkdir(parents=True, exist_ok=True)
+        p_data_collected.mkdir(parents=True, exist_ok=True)
+
+        # this selection of fields appears to support most play-by-play analysis
+        if args.run_cwevent:
+            if (p_data_parsed / 'cwevent2019.csv').exists():
+                logger.info('Skipping cwevent parsing -- already performed')
+            else:
+                parse_event_files(p_data_raw, p_data_parsed, 'cwevent',
+                                  args.cwevent_fields, args.start_year, args.end_year)
+
+        # request all available fields for cwdaily and cwgame
+        if (p_data_parsed / 'cwdaily2019.csv').exists():
+            logger.info('Skipping cwdaily parser -- already performed')
+        else:
+            parse_event_files(p_data_raw, p_data_parsed, 'cwdaily', '-f 0-153', args.start_year, args.end_year)
 
-    # this selection of fields appears to support most play-by-play analysis
-    if args.run_cwevent:
-        if (p_data_parsed / 'cwevent2019.csv').exists():
-            logger.info('Skipping cwevent parsing -- already performed')
+        if (p_data_parsed / 'cwgame2019.csv').exists():
+            logger.info('Skipping cwgame parser -- already performed')
         else:
-            parse_event_files(p_data_raw, p_data_parsed, 'cwevent',
-                              args.cwevent_fields, args.start_year, args.end_year)
-
-    # request all available fields for cwdaily and cwgame
-    if (p_data_parsed / 'cwdaily2019.csv').exists():
-        logger.info('Skipping cwdaily parser -- already performed')
-    else:
-        parse_event_files(p_data_raw, p_data_parsed, 'cwdaily', '-f 0-153', args.start_year, args.end_year)
-
-    if (p_data_parsed / 'cwgame2019.csv').exists():
-        logger.info('Skipping cwgame parser -- already performed')
-    else:
-        parse_event_files(p_data_raw, p_data_parsed, 'cwgame', '-f 0-83 -x 0-94', args.start_year, args.end_year)
+            parse_event_files(p_data_raw, p_data_parsed, 'cwgame', '-f 0-83 -x 0-94', args.start_year, args.end_year)
 
 
 if __name__ == '__main__':
@@ -2,7 +2,7 @@
 
 """Wrangle Retrosheet Data from {data_dir}/retrosheet/raw to {data_dir}/retrosheet/wrangled
 
-Wrangles: player per game and team per game data
+Wrangles: player per game and team per game data, and their season rollups
 """
 
 __author__ = 'Stephen Diehl'
@@ -19,6 +19,9 @@ import pandas as pd
 import numpy as np
 
 import data_helper as dh
+import instrument
+import key_integrity
+import season_rollup
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -36,6 +39,8 @@ def get_parser():
     parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help="Set the logging level")
 
+    instrument.add_profile_args(parser)
+
     return parser
 
 
@@ -59,31 +64,27 @@ def get_player_game(p_retrosheet_collected):
     return player_game
 
 
+# b_g b_g_dh b_g_ph b_g_pr p_g p_gs p_cg p_sho p_gf p_w p_l p_sv f_p_g f_p_gs f_c_g f_c_gs ... f_rf_g f_rf_gs
+FLAG_FIELD = re.compile(r'^(b_g(_dh|_ph|_pr)?|p_(g|gs|cg|sho|gf|w|l|sv)|f_[a-z0-9]+_gs?)$')
+
+
 def clean_player_game(player_game):
     """Ensure Primary Key is Unique."""
 
     # Fix Duplicate Primary Key
     pkey = ['game_id', 'player_id']
     if not dh.is_unique(player_game, pkey):
-        # if pkey is dup, sum the stat rows for the dups
-        dups = player_game.duplicated(subset=pkey)
+        # if pkey is dup, consolidate the stat rows for the dups
+        dups = key_integrity.duplicated(player_game, pkey)
         df_dups = player_game.loc[dups, pkey]
-        logger.warning(f'Dup PKey Found - summing stats for:\n{df_dups.to_string()}')
-
-        # TODO flag fields should be ORed not summed
-        # this is not currently a problem with the single dup found
-        # data integrity tests verify that all flag fields are either 0 or 1
-        """Flag Fields (value is 0 or 1):
-        b_g b_g_dh b_g_ph b_g_pr p_g p_gs p_cg p_sho p_gf p_w p_l p_sv f_p_g f_p_gs f_c_g 
-        f_c_gs f_1b_g f_1b_gs f_2b_g f_2b_gs f_3b_g f_3b_gs f_ss_g f_ss_gs f_lf_g f_lf_gs 
-        f_cf_g f_cf_gs f_rf_g f_rf_gs     
-        """
+        logger.warning(f'Dup PKey Found - consolidating stats for:\n{df_dups.to_string()}')
 
         # player stat columns b_ for batter, p_ for pitcher, f_ for fielder
+        # flag fields (value is 0 or 1) are ORed, the other stats are summed
         stat_columns = [col for col in player_game.columns if re.search(r'^[bpf]_', col)]
-        stat_columns.remove('b_g')  # don't sum this column
+        reducers = {col: 'max' if FLAG_FIELD.search(col) else 'sum' for col in stat_columns}
 
-        player_game = dh.sum_stats_for_dups(player_game, pkey, stat_columns)
+        player_game = dh.consolidate_dups(player_game, pkey, reducers)
 
     return player_game
 
@@ -120,6 +121,8 @@ def create_batting(player_game, game_start, p_retrosheet_wrangled):
     logger.info('Writing and compressing batting.  This could take several minutes ...')
     dh.to_csv_with_types(batting, p_retrosheet_wrangled / 'batting.csv.gz')
 
+    return batting
+
 
 def create_pitching(player_game, game_start, p_retrosheet_wrangled):
     """Create pitching.csv for pitching attributes per player per game."""
@@ -155,6 +158,8 @@ def create_pitching(player_game, game_start, p_retrosheet_wrangled):
     logger.info('Writing and compressing pitching.  This could take several minutes ...')
     dh.to_csv_with_types(pitching, p_retrosheet_wrangled / 'pitching.csv.gz')
 
+    return pitching
+
 
 def create_fielding(player_game, game_start, p_retrosheet_wrangled):
     """Create fielding.csv for fielding attributes per player per game."""
@@ -217,6 +222,8 @@ def create_fielding(player_game, game_start, p_retrosheet_wrangled):
     logger.info('Writing and compressing fielding.  This could take several minutes ...')
     dh.to_csv_with_types(fielding, p_retrosheet_wrangled / 'fielding.csv.gz')
 
+    return fielding
+
 
 def wrangle_game(game, p_retrosheet_wrangled):
     """Tidy the Game Data
@@ -428,6 +435,102 @@ def wrangle_event(p_retrosheet_collected, p_retrosheet_wrangled):
     shutil.copyfile(source, destination)
 
 
+def get_event_stat_cols(event_dtypes):
+    """Event columns which can be summed over a half-inning or a game.
+
+    The set of cwevent fields can be changed on the retrosheet_parse.py command line,
+    so the stat columns are found from the event data types rather than hardcoded.
+    """
+    # columns which describe the state or identify the event rather than count something
+    non_additive = ['game_id', 'event_id', 'inn_ct', 'home_half', 'team_id', 'opponent_team_id',
+                    'away_score_ct', 'home_score_ct', 'bat_id', 'pit_id', 'event_tx', 'h_cd',
+                    'inn_runs_ct', 'start_bases_cd', 'end_bases_cd', 'fate_runs_ct', 'inn_end']
+
+    return [col for col, dtype in event_dtypes.items()
+            if col not in non_additive and
+            (dtype == 'bool' or re.search(r'^u?int\d+$', dtype, re.IGNORECASE))]
+
+
+def create_half_inning(game_start, p_retrosheet_wrangled):
+    """Create half_inning.csv with the event stats summed per half-inning.
+
+    Most play-by-play analysis (e.g. linear weights) starts by aggregating events
+    to the half-inning, which is about 30 times smaller than the event table.
+
+    cwevent writes the events of a half-inning consecutively, so the aggregation
+    is performed in one sorted-segment reduction pass rather than a groupby.
+    """
+    filename = p_retrosheet_wrangled / 'event.csv.gz'
+    if not filename.exists():
+        logger.info('Skipping half_inning -- no event data')
+        return None
+
+    _, dtypes = dh.read_types(p_retrosheet_wrangled / 'event_types.csv')
+    stat_cols = get_event_stat_cols(dtypes)
+
+    key = ['game_id', 'inn_ct', 'home_half']
+    fkey = ['team_id', 'opponent_team_id']
+
+    logger.info('Reading event.csv.gz ...')
+    event = dh.from_csv_with_types(filename, usecols=key + fkey + stat_cols)
+    logger.info(f'event loaded {len(event):,d} rows')
+
+    half_inning = dh.sum_segments(event, key, stat_cols, first_cols=fkey)
+
+    # should the events ever not be grouped by half-inning, sort them and reduce again
+    if not dh.is_unique(half_inning, key):
+        logger.warning('event not grouped by half-inning -- sorting events')
+        event = event.sort_values(key, kind='mergesort')
+        half_inning = dh.sum_segments(event, key, stat_cols, first_cols=fkey)
+
+    # add game_start.dt.year as many queries use year
+    half_inning = pd.merge(half_inning, game_start[['game_id', 'game_start']])
+    half_inning['year'] = half_inning['game_start'].dt.year.astype('int16')
+
+    dh.optimize_df_dtypes(half_inning, ignore=['year'])
+    logger.info('Writing and compressing half_inning.  This could take several minutes ...')
+    dh.to_csv_with_types(half_inning, p_retrosheet_wrangled / 'half_inning.csv.gz')
+
+    return half_inning
+
+
+def create_team_game_from_events(half_inning, p_retrosheet_wrangled):
+    """Create team_game_from_events.csv by rolling up half_inning per team per game.
+
+    The result has the same key and column names as team_game, so that play-by-play
+    stats can be compared with, or used in place of, the cwgame stats.
+
+    Errors, double plays, triple plays, passed balls, wild pitches and balks are
+    charged to the fielding team, as they are in team_game.
+    """
+    if half_inning is None:
+        return None
+
+    key = ['game_id', 'team_id']
+    stat_cols = [col for col in half_inning.columns
+                 if col not in ['game_id', 'inn_ct', 'home_half', 'team_id',
+                                'opponent_team_id', 'game_start', 'year']]
+
+    # each team bats in every other half-inning, so sort to make each team's half-innings consecutive
+    # half_inning is small, so this sort is cheap
+    half_inning = half_inning.sort_values(key, kind='mergesort')
+    team_game = dh.sum_segments(half_inning, key, stat_cols,
+                                first_cols=['opponent_team_id', 'game_start', 'year'])
+
+    # charge the fielding stats to the opponent
+    opp_cols = [col for col in ['e', 'dp', 'tp', 'pb', 'wp', 'bk'] if col in stat_cols]
+    opp = team_game[['game_id', 'opponent_team_id'] + opp_cols].rename(
+        columns={'opponent_team_id': 'team_id'})
+    team_game = pd.merge(team_game.drop(columns=opp_cols), opp, how='left', on=key)
+    team_game[opp_cols] = team_game[opp_cols].fillna(0)
+
+    dh.optimize_df_dtypes(team_game, ignore=['year'])
+    logger.info('Writing and compressing team_game_from_events ...')
+    dh.to_csv_with_types(team_game, p_retrosheet_wrangled / 'team_game_from_events.csv.gz')
+
+    return team_game
+
+
 def wrangle_parks(data_dir, retrosheet_wrangle):
     parks_filename = data_dir / 'retrosheet/raw/misc/parkcode.txt'
     parks = pd.read_csv(parks_filename, parse_dates=['START', 'END'])
@@ -451,11 +554,15 @@ def wrangle_teams(data_dir, retrosheet_wrangle):
     dh.to_csv_with_types(retro_teams, retrosheet_wrangle / 'teams.csv')
 
 
-def main():
+def main(argv=None, frames=None):
     """Wrangle the data.
+
+    frames may have the collected game and player_game DataFrames, as returned by
+    retrosheet_collect.main(), in which case they are not read from disk.
     """
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    frames = frames or {}
 
     if args.log_level:
         fh = logging.FileHandler('download.log')
@@ -476,24 +583,58 @@ def main():
     p_retrosheet_collected = (data_dir / 'retrosheet/collected').resolve()
     p_retrosheet_wrangled = (data_dir / 'retrosheet/wrangled').resolve()
 
-    # get collected data from parsers
-    game = get_game(p_retrosheet_collected)  # cwgame
-    game_start = wrangle_game(game, p_retrosheet_wrangled)
-
-    player_game = get_player_game(p_retrosheet_collected)  # cwdaily
-    player_game = clean_player_game(player_game)
-
-    create_batting(player_game, game_start, p_retrosheet_wrangled)
-    create_pitching(player_game, game_start, p_retrosheet_wrangled)
-    create_fielding(player_game, game_start, p_retrosheet_wrangled)
-
-    wrangle_event(p_retrosheet_collected, p_retrosheet_wrangled)  # cwevent
-
-    # parks.txt is included with the retrosheet data.  It is a csv file.
-    wrangle_parks(data_dir, p_retrosheet_wrangled)
-
-    # TEAM<YYYY> is included in the retrosheet data.  They are csv files.
-    wrangle_teams(data_dir, p_retrosheet_wrangled)
+    with instrument.stage('retrosheet_wrangle', logger, profile=instrument.get_profile(args)):
+        # get collected data from parsers
+        game = frames['game'] if 'game' in frames else get_game(p_retrosheet_collected)  # cwgame
+        game_start = wrangle_game(game, p_retrosheet_wrangled)
+
+        # the collected DataFrames may still be being written in the background, so they are not modified
+        if 'player_game' in frames:
+            player_game = frames['player_game']
+        else:
+            player_game = get_player_game(p_retrosheet_collected)  # cwdaily
+        player_game = clean_player_game(player_game)
+
+        # the season rollups per player, team and league are computed as each stat table is created
+        cols = ['team_id', 'year', 'team_league_id']
+        leagues = season_rollup.get_leagues(
+            dh.from_csv_with_types(p_retrosheet_wrangled / 'team_game.csv.gz', usecols=cols))
+
+        for name, create in [('batting', create_batting), ('pitching', create_pitching),
+                             ('fielding', create_fielding)]:
+            with instrument.step(f'create {name}', logger) as s:
+                s.rows_in = len(player_game)
+                df = create(player_game, game_start, p_retrosheet_wrangled)
+                s.rows_out = len(df)
+                s.add_written(p_retrosheet_wrangled / f'{name}.csv.gz')
+
+            with instrument.step(f'rollup {name}', logger) as s:
+                s.rows_in = len(df)
+                logger.info(f'Writing {name} season rollups ...')
+                season_rollup.create_rollups(df, name, leagues, p_retrosheet_wrangled)
+
+        wrangle_event(p_retrosheet_collected, p_retrosheet_wrangled)  # cwevent
+
+        # aggregate the play-by-play data once, so that analysis can start from the smaller tables
+        with instrument.step('create half_inning', logger) as s:
+            half_inning = create_half_inning(game_start, p_retrosheet_wrangled)
+            if half_inning is not None:
+                s.add_read(p_retrosheet_wrangled / 'event.csv.gz')
+                s.rows_out = len(half_inning)
+                s.add_written(p_retrosheet_wrangled / 'half_inning.csv.gz')
+
+        with instrument.step('create team_game_from_events', logger) as s:
+            team_game = create_team_game_from_events(half_inning, p_retrosheet_wrangled)
+            if team_game is not None:
+                s.rows_in = len(half_inning)
+                s.rows_out = len(team_game)
+                s.add_written(p_retrosheet_wrangled / 'team_game_from_events.csv.gz')
+
+        # parks.txt is included with the retrosheet data.  It is a csv file.
+        wrangle_parks(data_dir, p_retrosheet_wrangled)
+
+        # TEAM<YYYY> is included in the retrosheet data.  They are csv files.
+        wrangle_teams(data_dir, p_retrosheet_wrangled)
 
     logger.info('Finished')
 
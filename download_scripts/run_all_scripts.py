@@ -1,12 +1,36 @@
 #!/usr/bin/env python
 
-"""Run all scripts"""
+"""Run all scripts
+
+Each script is a stage which reads some data directories and writes others.  A stage is run
+as soon as the stages which write its inputs have finished, so the Lahman scripts run
+concurrently with the Retrosheet scripts.  A stage whose outputs are newer than its inputs is skipped.
+
+With --in-process, the scripts' main functions are called in this process rather than run as
+new processes, and the DataFrames collected by retrosheet_collect are passed directly to
+retrosheet_wrangle, while the collected files are written in the background.  The metrics
+of all the scripts are then written to one file in metrics/.
+"""
 
 __author__ = 'Stephen Diehl'
 
 import argparse
+import importlib
+import inspect
+import logging
+import os
 import sys
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from pathlib import Path
+
+import instrument
+
+# the output of concurrent stages is written one line at a time
+print_lock = threading.Lock()
 
 
 def get_parser():
@@ -20,51 +44,197 @@ def get_parser():
     parser.add_argument("--data-dir", type=str, help="baseball data directory", default='../data')
     parser.add_argument("--start-year", type=int, help="start year", default='1955')
     parser.add_argument("--end-year", type=int, help="end year", default='2019')
+    parser.add_argument("--in-process", action="store_true",
+                        help="call each script's main function in this process, rather than running it as a new process")
+    parser.add_argument("--force", action="store_true",
+                        help="run every stage, even if its outputs are newer than its inputs, "
+                             "for example after changing the start or end year")
 
     return parser
 
 
-def run_cmd(cmd):
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        sys.stdout.buffer.write(line)
-        sys.stdout.buffer.flush()
-
+def get_stages(args):
+    """Stages of the pipeline.
 
-def main():
-    parser = get_parser()
-    args = parser.parse_args()
+    Returns a dict of stage name => (command, input directories, output directories).
+    The directories are relative to the data directory.
+    """
     data_dir = f'--data-dir={args.data_dir}'
     start_year = f'--start-year={args.start_year}'
     end_year = f'--end-year={args.end_year}'
 
-    print('Running lahman_download:')
-    cmd = ['./lahman_download.py', '-v', '--log=INFO', data_dir]
-    run_cmd(cmd)
-
-    print('Running lahman_wrangle:')
-    cmd = ['./lahman_wrangle.py', '-v', '--log=INFO', data_dir]
-    run_cmd(cmd)
-
-    print('Running retrosheet_download:')
-    cmd = ['./retrosheet_download.py', '-v', '--log=INFO', data_dir]
-    run_cmd(cmd)
+    return {
+        'lahman_download': (['./lahman_download.py', '-v', '--log=INFO', data_dir],
+                            [], ['lahman/raw']),
+        'lahman_wrangle': (['./lahman_wrangle.py', '-v', '--log=INFO', data_dir],
+                           ['lahman/raw'], ['lahman/wrangled']),
+        'retrosheet_download': (['./retrosheet_download.py', '-v', '--log=INFO', data_dir],
+                                [], ['retrosheet/raw']),
+        'retrosheet_parse': (['./retrosheet_parse.py', '-v', '--log=INFO', '--run-cwevent',
+                              data_dir, start_year, end_year],
+                             ['retrosheet/raw'], ['retrosheet/parsed']),
+        'retrosheet_collect': (['./retrosheet_collect.py', '-v', '--log=INFO', '--use-datatypes', data_dir],
+                               ['retrosheet/parsed'], ['retrosheet/collected']),
+        'retrosheet_wrangle': (['./retrosheet_wrangle.py', '-v', '--log=INFO', data_dir],
+                               ['retrosheet/collected', 'retrosheet/raw'], ['retrosheet/wrangled']),
+        # the data tests have no outputs, so they are always run
+        'pytest': (['pytest', '-v', data_dir],
+                   ['lahman/wrangled', 'retrosheet/wrangled'], []),
+    }
+
+
+def get_dependencies(stages):
+    """A stage depends upon the stages which write its inputs."""
+    return {name: [other for other, (_, _, outputs) in stages.items() if set(inputs) & set(outputs)]
+            for name, (_, inputs, _) in stages.items()}
+
+
+def get_mtimes(p):
+    """Modification times of all of the files in the directory tree."""
+    mtimes = []
+    for root, _, files in os.walk(p):
+        mtimes.extend(os.stat(os.path.join(root, file)).st_mtime for file in files)
+    return mtimes
+
+
+def is_up_to_date(data_dir, inputs, outputs):
+    """True if every output directory has files and its oldest file is newer than the newest input file."""
+    if not outputs:
+        return False
+
+    output_mtimes = [get_mtimes(data_dir / output) for output in outputs]
+    if not all(output_mtimes):
+        return False
+
+    input_mtimes = [mtime for p in inputs for mtime in get_mtimes(data_dir / p)]
+    return max(input_mtimes, default=0) <= min(min(mtimes) for mtimes in output_mtimes)
+
+
+def run_cmd(name, cmd):
+    """Run the command, prefixing each line of its output with the stage name.  Returns the exit code."""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    prefix = f'{name}: '.encode()
+    for line in proc.stdout:
+        with print_lock:
+            sys.stdout.buffer.write(prefix + line)
+            sys.stdout.buffer.flush()
+    return proc.wait()
+
+
+def run_main(cmd, frames, writes):
+    """Call the main function of the script in this process.  Returns the exit code and the value main returned.
+
+    If main has a frames parameter, it is passed the DataFrames returned by the stages it depends upon.
+    If main has a writes parameter, it is passed the list of the Futures of the background writes.
+    """
+    if cmd[0] == 'pytest':
+        import pytest
+        return pytest.main(cmd[1:]), None
+
+    module = importlib.import_module(Path(cmd[0]).stem)
+    params = inspect.signature(module.main).parameters
+    kwargs = {}
+    if 'frames' in params:
+        kwargs['frames'] = frames
+    if 'writes' in params:
+        kwargs['writes'] = writes
+
+    try:
+        return 0, module.main(cmd[1:], **kwargs)
+    except Exception:
+        logging.getLogger(module.__name__).exception(f'{module.__name__} failed')
+        return 1, None
+
+
+def run_stage(name, cmd, data_dir, inputs, outputs, force=False, frames=None, writes=None):
+    """Run the stage unless it is up to date.  Returns its status, the seconds it ran and the value it returned.
+
+    If writes is a list, the stage is run in this process, see run_main().
+    """
+    if not force and is_up_to_date(data_dir, inputs, outputs):
+        return 'skipped', 0.0, None
+
+    with print_lock:
+        print(f'Running {name}:', flush=True)
+    start = time.perf_counter()
+    if writes is None:
+        code, value = run_cmd(name, cmd), None
+    else:
+        code, value = run_main(cmd, frames, writes)
+    return 'ok' if code == 0 else 'failed', time.perf_counter() - start, value
+
+
+def run_stages(stages, data_dir, force=False, in_process=False):
+    """Run each stage as soon as the stages it depends upon have finished.
+
+    If a stage fails, the stages which depend upon it are not run, but the other stages are.
+    Returns a dict of stage name => (status, seconds).
+
+    If in_process is True, the DataFrames returned by a stage are passed to the stages which depend
+    upon it.  Once all the stages have run, the background writes are waited upon.  If one fails,
+    the stage which started it has failed.
+    """
+    deps = get_dependencies(stages)
+    waiting = dict(stages)
+    results = {}
+    running = {}
+    returned = {}
+    writes = {name: [] for name in stages} if in_process else {}
+
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        while waiting or running:
+            for name in list(waiting):
+                if any(results.get(dep, ('',))[0] in ('failed', 'not run') for dep in deps[name]):
+                    waiting.pop(name)
+                    results[name] = ('not run', 0.0)
+                elif all(dep in results for dep in deps[name]):
+                    cmd, inputs, outputs = waiting.pop(name)
+                    frames = {key: df for dep in deps[name] for key, df in (returned.pop(dep, None) or {}).items()}
+                    future = executor.submit(run_stage, name, cmd, data_dir, inputs, outputs, force,
+                                             frames, writes.get(name))
+                    running[future] = name
+
+            if not running:
+                if waiting:
+                    raise ValueError(f'stages have circular dependencies: {" ".join(waiting)}')
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                status, seconds, returned[name] = future.result()
+                results[name] = (status, seconds)
+
+    for name, futures in writes.items():
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f'{name}: background write failed: {e!r}')
+                results[name] = ('failed', results[name][1])
+
+    return {name: results[name] for name in stages}
+
+
+def print_summary(results, seconds):
+    print('\nStage                 Status       Seconds')
+    for name, (status, stage_seconds) in results.items():
+        print(f'{name:<21} {status:<10} {stage_seconds:9.1f}')
+    print(f'{"total":<21} {"":<10} {seconds:9.1f}')
 
-    print('Running retrosheet_parse:')
-    cmd = ['./retrosheet_parse.py', '-v', '--log=INFO', '--run-cwevent', data_dir, start_year, end_year]
-    run_cmd(cmd)
 
-    print('Running retrosheet_collect:')
-    cmd = ['./retrosheet_collect.py', '-v', '--log=INFO', '--use-datatypes', data_dir]
-    run_cmd(cmd)
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
 
-    print('Running retrosheet_wrangle:')
-    cmd = ['./retrosheet_wrangle.py', '-v', '--log=INFO', data_dir]
-    run_cmd(cmd)
+    start = time.perf_counter()
+    with instrument.stage('run_all_scripts') if args.in_process else nullcontext():
+        results = run_stages(get_stages(args), Path(args.data_dir), args.force, args.in_process)
+    print_summary(results, time.perf_counter() - start)
 
-    print('Running pytest:')
-    cmd = ['pytest', '-v', data_dir]
-    run_cmd(cmd)
+    if any(status in ('failed', 'not run') for status, _ in results.values()):
+        print('Some scripts did not run successfully.')
+        sys.exit(1)
     print('All scripts have run.')
 
 
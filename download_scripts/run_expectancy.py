@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""Compute the Run Expectancy Matrix (RE24) per year and per league from {data_dir}/retrosheet/wrangled/event.csv.gz
+
+Results are cached per year in {data_dir}/retrosheet/re24, and a year is recomputed when its data changes
+"""
+
+__author__ = 'Stephen Diehl'
+
+import argparse
+from pathlib import Path
+import hashlib
+import json
+import logging
+import sys
+
+import pandas as pd
+import numpy as np
+
+import data_helper as dh
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def get_parser():
+    """Args Description"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--data-dir", type=str, help="baseball data directory", default='../data')
+    parser.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level")
+    parser.add_argument("--recompute", help="ignore the per year cache", action="store_true")
+
+    return parser
+
+
+def add_base_out_state(event):
+    """Add the base-out state at the start of each event and the runs scored from then to the end of the inning.
+
+    New columns:
+      outs_start: outs before the event (0, 1 or 2)
+      runs_roi: runs scored in the rest of the inning, including runs scored on the event
+      inn_outs: outs made in the half-inning, less than 3 if the half-inning is incomplete
+
+    start_bases_cd (from cwevent) is the base state before the event:
+    1 = runner on first, 2 = runner on second, 4 = runner on third, summed over the occupied bases.
+
+    cwevent does not report the outs before an event by default, so it is computed as the
+    cumulative sum of the outs made earlier in the same half-inning.
+
+    The events of each half-inning must be consecutive and in order, as they are in event.csv.gz.
+    No Python loop is used: running totals are computed over the whole table and the running total
+    at the start of each half-inning is subtracted.
+    """
+    starts = dh.segment_starts(event, ['game_id', 'inn_ct', 'home_half'])
+    lengths = np.diff(np.append(starts, len(event)))
+
+    outs = event['outs'].to_numpy(dtype=np.int64)
+    cum_outs = np.cumsum(outs)
+    outs_before_inning = np.repeat(cum_outs[starts] - outs[starts], lengths)
+    event['outs_start'] = (cum_outs - outs - outs_before_inning).astype('uint8')
+    event['inn_outs'] = np.repeat(np.add.reduceat(outs, starts), lengths).astype('uint8')
+
+    # runs to the end of the inning is a reverse cumulative sum within the half-inning
+    runs = event['r'].to_numpy(dtype=np.int64)
+    cum_runs = np.cumsum(runs)
+    runs_before_inning = np.repeat(cum_runs[starts] - runs[starts], lengths)
+    runs_inning = np.repeat(np.add.reduceat(runs, starts), lengths)
+    event['runs_roi'] = (runs_inning - (cum_runs - runs - runs_before_inning)).astype('uint8')
+
+    return event
+
+
+def get_home_league(teams):
+    """Map (team_id, year) to the league of the home team, which determines the rules of the game (e.g. DH)."""
+    return teams[['team_id', 'year', 'lg_id']].rename(columns={'team_id': 'home_team_id'})
+
+
+def compute_re24_counts(event, home_league):
+    """Count the plate appearances and sum the runs to the end of the inning per base-out state.
+
+    Counts rather than averages are returned, so that results for different
+    years and leagues can be combined exactly.
+
+    Only plate appearances in complete half-innings are used, and as is customary, the
+    bottom of the 9th and later innings are excluded as they are often cut short.
+    """
+    event = add_base_out_state(event)
+
+    filt = event['inn_outs'] == 3
+    filt &= ~((event['inn_ct'] >= 9) & (event['home_half'] == 1))
+    if 'pa' in event.columns:
+        filt &= event['pa']
+    event = event.loc[filt, ['game_id', 'start_bases_cd', 'outs_start', 'runs_roi']]
+
+    event = event.assign(home_team_id=event['game_id'].str[:3],
+                         year=event['game_id'].str[3:7].astype('int16'))
+    event = pd.merge(event, home_league, how='left', on=['home_team_id', 'year'])
+
+    counts = event.groupby(['year', 'lg_id', 'start_bases_cd', 'outs_start']).agg(
+        n=('runs_roi', 'size'), runs=('runs_roi', 'sum'))
+    counts = counts.reset_index().rename(columns={'start_bases_cd': 'bases', 'outs_start': 'outs'})
+
+    return counts
+
+
+def bases_label(bases):
+    """Base state code to label, for example 5 => '1_3'"""
+    return ('1' if bases & 1 else '_') + ('2' if bases & 2 else '_') + ('3' if bases & 4 else '_')
+
+
+def get_re24_matrix(re24, year, lg_id=None):
+    """Pivot the run expectancies for one year into the familiar 8 x 3 matrix.
+
+    If lg_id is None, both leagues are combined.
+    """
+    df = re24.query('year == @year')
+    if lg_id is not None:
+        df = df.query('lg_id == @lg_id')
+
+    df = df.groupby(['bases', 'outs'])[['n', 'runs']].sum()
+    df['re'] = df['runs'] / df['n']
+    matrix = df['re'].unstack('outs')
+    matrix.index = matrix.index.map(bases_label)
+
+    return matrix
+
+
+def get_year_of_rows(df):
+    """The year of each row, from the year column, or else from the game_id."""
+    if 'year' in df.columns:
+        return df['year'].to_numpy(dtype=np.int64)
+    return df['game_id'].str[3:7].astype('int16').to_numpy(dtype=np.int64)
+
+
+def add_year_hashes(sums, df):
+    """Add the count and the sum of the hashes of the rows of df per year to sums, a dict of year => [count, sum].
+
+    The sum does not depend upon the order of the rows, so the file may be read in any chunks.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    years = get_year_of_rows(df)
+    for year in np.unique(years):
+        is_year = years == year
+        year_sums = sums.setdefault(int(year), [0, 0])
+        year_sums[0] += int(is_year.sum())
+        year_sums[1] = (year_sums[1] + int(hashes[is_year].sum(dtype=np.uint64))) % 2 ** 64
+    return sums
+
+
+def get_year_digests(sums):
+    return {str(year): f'{count}:{total:016x}' for year, (count, total) in sums.items()}
+
+
+def get_file_stamp(p):
+    """Size and modification time of the file, which change when it is rewritten."""
+    stat = p.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def scan_events(p_event, usecols, count_func=None, years=None):
+    """Stream the events one group of games at a time.
+
+    Returns the digest of the events of each year, and if count_func is given, the count tables
+    of the years in years (all years if None) as a dict of year => list of DataFrames.
+    """
+    sums = {}
+    counts = {}
+    for chunk in dh.from_csv_by_group(p_event, 'game_id', usecols=usecols):
+        add_year_hashes(sums, chunk)
+        if count_func is None:
+            continue
+
+        chunk_years = chunk['game_id'].str[3:7].astype('int16')
+        if years is not None:
+            is_year = chunk_years.isin(years)
+            if not is_year.any():
+                continue
+            chunk = chunk[is_year].reset_index(drop=True)
+
+        for year, df in count_func(chunk).groupby('year'):
+            counts.setdefault(int(year), []).append(df)
+
+    return get_year_digests(sums), counts
+
+
+def compute_counts_by_year(p_event, usecols, count_func, p_cache, name, keys, values, inputs=None,
+                           recompute=False):
+    """Stream the events one group of games at a time and compute count tables per year.
+
+    count_func(event) must return a DataFrame of additive columns values (e.g. counts and sums)
+    per keys, where keys includes 'year'.  Each year's counts are persisted to
+    {p_cache}/{name}{year}.csv.
+
+    inputs is a DataFrame of the other data count_func uses, having a year or game_id column.
+    A year is recomputed only if its events or its rows of inputs have changed, as recorded by
+    the digest of each year in {p_cache}/{name}_manifest.json.  If the event file has not been
+    rewritten since the last run, its digests are not computed again.
+
+    The memory required does not depend upon the number of years of event data.
+
+    Returns the counts for all years, which is empty if there are no events.
+    """
+    p_cache.mkdir(parents=True, exist_ok=True)
+    p_manifest = p_cache / f'{name}_manifest.json'
+    manifest = json.loads(p_manifest.read_text()) if p_manifest.exists() and not recompute else {}
+
+    _, dtypes = dh.read_types(p_event.parent / 'event_types.csv')
+    missing = set(usecols) - set(dtypes)
+    if missing:
+        raise ValueError(f'event.csv.gz is missing cwevent fields: {" ".join(sorted(missing))}')
+    if 'pa' in dtypes:
+        usecols = usecols + ['pa']
+
+    input_digests = get_year_digests(add_year_hashes({}, inputs)) if inputs is not None else {}
+
+    def get_digest(year, event_digest):
+        key = json.dumps([usecols, event_digest, input_digests.get(year)])
+        return hashlib.md5(key.encode()).hexdigest()
+
+    # the event digests are computed while the counts are, unless some years may not need counting
+    stamp = get_file_stamp(p_event)
+    counts = None
+    if manifest.get('stamp') == stamp:
+        event_digests = manifest['events']
+    elif manifest.get('years'):
+        event_digests, _ = scan_events(p_event, usecols)
+    else:
+        event_digests, counts = scan_events(p_event, usecols, count_func)
+
+    digests = {year: get_digest(year, event_digest) for year, event_digest in event_digests.items()}
+    stale = {int(year) for year, digest in digests.items() if manifest.get('years', {}).get(year) != digest}
+    if counts is None:
+        counts = scan_events(p_event, usecols, count_func, stale)[1] if stale else {}
+
+    # merge the count tables for a year that spanned more than one chunk
+    for year in sorted(stale):
+        p_year = p_cache / f'{name}{year}.csv'
+        for p in [p_year, p_cache / f'{name}{year}_types.csv']:
+            p.unlink(missing_ok=True)
+        if year in counts:
+            df = pd.concat(counts[year]).groupby(keys, as_index=False).sum()
+            logger.info(f'Writing {name} for {year}')
+            dh.to_csv_with_types(df, p_year)
+
+    # the manifest is written last, so that if the run is interrupted, the years are counted again
+    p_manifest.write_text(json.dumps({'stamp': stamp, 'events': event_digests, 'years': digests}, indent=1))
+
+    files = [p_cache / f'{name}{year}.csv' for year in sorted(digests, key=int)]
+    files = [p for p in files if p.exists()]
+    if not files:
+        return pd.DataFrame(columns=keys + values)
+    return pd.concat((dh.from_csv_with_types(p) for p in files), ignore_index=True)
+
+
+def compute_re24(p_event, p_teams, p_re24, recompute=False):
+    """Compute the run expectancy per base-out state per year per league.
+
+    The counts per year are cached in p_re24.
+    """
+    home_league = get_home_league(dh.from_csv_with_types(p_teams))
+
+    usecols = ['game_id', 'inn_ct', 'home_half', 'outs', 'r', 'start_bases_cd']
+    re24 = compute_counts_by_year(p_event, usecols, lambda event: compute_re24_counts(event, home_league),
+                                  p_re24, 're24_counts', ['year', 'lg_id', 'bases', 'outs'], ['n', 'runs'],
+                                  home_league, recompute)
+
+    re24['re'] = re24['runs'] / re24['n']
+    dh.to_csv_with_types(re24, p_re24 / 're24.csv')
+
+    return re24
+
+
+def main():
+    """Compute the run expectancy matrices.
+    """
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.log_level:
+        fh = logging.FileHandler('download.log')
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        fh.setFormatter(formatter)
+        fh.setLevel(args.log_level)
+        logger.addHandler(fh)
+
+    if args.verbose:
+        # send INFO level logging to stdout
+        sh = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        sh.setFormatter(formatter)
+        sh.setLevel(logging.INFO)
+        logger.addHandler(sh)
+
+    data_dir = Path(args.data_dir)
+    p_retrosheet_wrangled = (data_dir / 'retrosheet/wrangled').resolve()
+    p_re24 = (data_dir / 'retrosheet/re24').resolve()
+
+    p_event = p_retrosheet_wrangled / 'event.csv.gz'
+    if not p_event.exists():
+        logger.warning('No event data -- run retrosheet_parse.py with --run-cwevent')
+        return
+
+    compute_re24(p_event, p_retrosheet_wrangled / 'teams.csv', p_re24, args.recompute)
+
+    logger.info('Finished')
+
+
+if __name__ == '__main__':
+    main()
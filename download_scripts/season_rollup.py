@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""Roll up the Retrosheet batting, pitching and fielding stats per season from {data_dir}/retrosheet/wrangled
+
+For each of batting, pitching and fielding, three rollups are persisted:
+  {stat}_player_season.csv -- per player per team per year (and per pos for fielding)
+  {stat}_team_season.csv -- per team per year (and per pos for fielding)
+  {stat}_league_season.csv -- per league per year (and per pos for fielding)
+
+retrosheet_wrangle.py runs this after creating batting, pitching and fielding.
+postgres_load_data.py maintains the same rollups as tables in the database.
+"""
+
+__author__ = 'Stephen Diehl'
+
+import argparse
+from pathlib import Path
+import logging
+import sys
+
+import pandas as pd
+
+import data_helper as dh
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# the player season key for each stat table
+ROLLUP_SOURCES = {
+    'batting': ['player_id', 'team_id', 'year'],
+    'pitching': ['player_id', 'team_id', 'year'],
+    'fielding': ['player_id', 'team_id', 'year', 'pos'],
+}
+
+ROLLUP_LEVELS = ['player_season', 'team_season', 'league_season']
+
+
+def get_parser():
+    """Args Description"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--data-dir", type=str, help="baseball data directory", default='../data')
+    parser.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level")
+
+    return parser
+
+
+def get_rollup_keys(name, level):
+    """The key of a rollup: the team season drops player_id, the league season replaces team_id with lg_id."""
+    keys = ROLLUP_SOURCES[name]
+    if level == 'player_season':
+        return keys
+    elif level == 'team_season':
+        return [key for key in keys if key != 'player_id']
+    else:
+        return ['lg_id'] + [key for key in keys if key not in ('player_id', 'team_id')]
+
+
+def get_stat_cols(name, columns):
+    """The columns which are summed: all except the keys and the game columns."""
+    return [col for col in columns if col not in ROLLUP_SOURCES[name] + ['game_id', 'game_start']]
+
+
+def get_leagues(team_game):
+    """Map (team_id, year) to lg_id, from the team_league_id of team_game."""
+    leagues = team_game[['team_id', 'year', 'team_league_id']].drop_duplicates()
+    return leagues.rename(columns={'team_league_id': 'lg_id'})
+
+
+def compute_rollup(df, name, level, leagues=None):
+    """Sum the stats per rollup key.  games is the number of distinct games.
+
+    leagues is required for the league season, see get_leagues().
+    """
+    keys = get_rollup_keys(name, level)
+    stat_cols = get_stat_cols(name, df.columns)
+
+    if 'lg_id' in keys:
+        df = pd.merge(df, leagues, on=['team_id', 'year'])
+
+    grouped = df.groupby(keys, observed=True)
+    rollup = grouped[stat_cols].sum()
+    rollup.insert(0, 'games', grouped['game_id'].nunique())
+    rollup = rollup.reset_index()
+
+    dh.optimize_df_dtypes(rollup, ignore=['year'])
+    return rollup
+
+
+def create_rollups(df, name, leagues, p_retrosheet_wrangled):
+    """Persist the player, team and league season rollups of one stat table."""
+    for level in ROLLUP_LEVELS:
+        rollup = compute_rollup(df, name, level, leagues)
+        logger.info(f'Writing {name}_{level} with {len(rollup):,d} rows')
+        dh.to_csv_with_types(rollup, p_retrosheet_wrangled / f'{name}_{level}.csv')
+
+
+def main():
+    """Compute and persist the season rollups.
+    """
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.log_level:
+        fh = logging.FileHandler('download.log')
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        fh.setFormatter(formatter)
+        fh.setLevel(args.log_level)
+        logger.addHandler(fh)
+
+    if args.verbose:
+        # send INFO level logging to stdout
+        sh = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        sh.setFormatter(formatter)
+        sh.setLevel(logging.INFO)
+        logger.addHandler(sh)
+
+    data_dir = Path(args.data_dir)
+    p_retrosheet_wrangled = (data_dir / 'retrosheet/wrangled').resolve()
+
+    cols = ['team_id', 'year', 'team_league_id']
+    leagues = get_leagues(dh.from_csv_with_types(p_retrosheet_wrangled / 'team_game.csv.gz', usecols=cols))
+
+    for name in ROLLUP_SOURCES:
+        df = dh.from_csv_with_types(p_retrosheet_wrangled / f'{name}.csv.gz')
+        create_rollups(df, name, leagues, p_retrosheet_wrangled)
+
+    logger.info('Finished')
+
+
+if __name__ == '__main__':
+    main()
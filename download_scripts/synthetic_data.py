@@ -0,0 +1,942 @@
+#!/usr/bin/env python
+
+"""Generate synthetic Retrosheet and Lahman data in {data_dir}, for benchmarking the pipeline offline
+
+The games are simulated plate appearance by plate appearance, with outcome rates close to the MLB averages,
+so the generated files are consistent with each other: the events sum to the player stats, which sum to
+the team stats per game, which sum to the Lahman season stats.
+
+Writes the files which the download and parse scripts would write, so that the collect, wrangle, load and
+test scripts can be run on them:
+  retrosheet/parsed/cwevent{year}.csv, cwdaily{year}.csv and cwgame{year}.csv
+  retrosheet/raw/event/regular/TEAM{year} and retrosheet/raw/misc/parkcode.txt
+  retrosheet/{event,player_game,game}_types.csv -- for retrosheet_collect.py --use-datatypes
+  lahman/raw/*.csv
+
+The cwdaily and cwgame columns are read from the data dictionaries in data/retrosheet.  The columns which
+are not in the data types files there are almost always null in the real data, so they are left empty.
+
+--scale multiplies the number of teams per season, for example --scale=10 generates 10 times the games
+of each season.  Use --start-year and --end-year to generate from one season up to the full history.
+"""
+
+__author__ = 'Stephen Diehl'
+
+import argparse
+import functools
+import logging
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# the data dictionaries of the Retrosheet parsers and the data types of the parsed files
+P_REPO_RETROSHEET = Path(__file__).resolve().parent.parent / 'data/retrosheet'
+
+# the columns written by cwevent with the default --cwevent-fields of retrosheet_parse.py
+CWEVENT_COLUMNS = ['GAME_ID', 'INN_CT', 'BAT_HOME_ID', 'AWAY_SCORE_CT', 'HOME_SCORE_CT', 'BAT_ID', 'PIT_ID',
+                   'EVENT_TX', 'AB_FL', 'H_CD', 'SH_FL', 'SF_FL', 'EVENT_OUTS_CT', 'DP_FL', 'TP_FL', 'WP_FL',
+                   'PB_FL', 'ERR_CT', 'EVENT_ID', 'BAT_TEAM_ID', 'FLD_TEAM_ID', 'INN_END_FL', 'INN_RUNS_CT',
+                   'PA_NEW_FL', 'START_BASES_CD', 'END_BASES_CD', 'BAT_SAFE_ERR_FL', 'EVENT_RUNS_CT',
+                   'FATE_RUNS_CT']
+
+# (first season, number of teams) of the MLB expansions since 1955
+TEAM_COUNTS = [(1998, 30), (1993, 28), (1977, 26), (1969, 24), (1962, 20), (1961, 18), (0, 16)]
+
+# a roster is 8 fielders (C, 1B, 2B, 3B, SS, LF, CF, RF), a DH, 4 bench players, 5 starters and 7 relievers
+DH_SLOT = 8
+BENCH = [9, 10, 11, 12]
+STARTERS = [13, 14, 15, 16, 17]
+RELIEVERS = [18, 19, 20, 21, 22, 23, 24]
+ROSTER_SIZE = 25
+
+# the bench player who replaces the fielder at pos 2 through 9 on his day off
+BACKUPS = [9, 10, 10, 11, 11, 12, 12, 12]
+
+# the fraction of the players on a roster who are replaced each season
+TURNOVER = 0.15
+
+MAX_INNINGS = 20
+
+# event codes: the plate appearance outcomes, then outcomes which depend upon the runners and outs
+K, FO, GO, BB, IBB, HBP, S, D, T, HR, E, SF, GDP, SH, SB, CS = range(16)
+PA_OUTCOMES = [K, FO, GO, BB, IBB, HBP, S, D, T, HR, E]
+PA_PROBS = [0.17, 0.26, 0.236, 0.075, 0.008, 0.009, 0.15, 0.045, 0.005, 0.03, 0.012]
+AB_CODES = [K, FO, GO, S, D, T, HR, E, GDP]
+
+# fielders of fly balls and ground balls, by position number
+FLY_FIELDERS, FLY_PROBS = [7, 8, 9, 4, 5, 6, 3, 2], [0.25, 0.3, 0.25, 0.05, 0.05, 0.05, 0.03, 0.02]
+GROUND_FIELDERS, GROUND_PROBS = [6, 4, 5, 3, 1], [0.3, 0.28, 0.22, 0.12, 0.08]
+
+POSITIONS = {1: 'p', 2: 'c', 3: '1b', 4: '2b', 5: '3b', 6: 'ss', 7: 'lf', 8: 'cf', 9: 'rf'}
+
+FIRST_NAMES = ['John', 'Mike', 'Dave', 'Bob', 'Jim', 'Tom', 'Bill', 'Joe', 'Steve', 'Chris', 'Mark', 'Paul',
+               'Rick', 'Jose', 'Luis', 'Juan', 'Carlos', 'Eddie', 'Frank', 'Gary', 'Larry', 'Ken', 'Ron',
+               'Tony', 'Matt', 'Ryan', 'Kevin', 'Jason', 'Brian', 'Scott']
+LAST_NAME_STARTS = ['Smi', 'John', 'Will', 'Brow', 'Jon', 'Gar', 'Mill', 'Dav', 'Rodr', 'Mart', 'Hern', 'Lop',
+                    'Gonz', 'And', 'Thom', 'Tayl', 'Moor', 'Jack', 'Lee', 'Per', 'Whit', 'Harr', 'Sanch',
+                    'Clar', 'Ram', 'Lew', 'Rob', 'Walk', 'Youn', 'All', 'King', 'Wrig', 'Scot', 'Torr', 'Hill',
+                    'Flor', 'Gre', 'Ad', 'Nels', 'Bak', 'Hall', 'Riv', 'Camp', 'Mitch', 'Cart', 'Ev', 'Ed']
+LAST_NAME_ENDS = ['th', 'son', 'er', 'ez', 'ley', 'ton', 's', 'man', 'ford', 'ins', 'ard', 'en', 'o']
+
+
+def get_parser():
+    """Args Description"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("--data-dir", type=str, help="synthetic data directory", default='../data_synthetic')
+    parser.add_argument("--start-year", type=int, help="start year", default='1974')
+    parser.add_argument("--end-year", type=int, help="end year", default='2019')
+    parser.add_argument("--scale", type=float, help="multiple of the number of teams per season", default=1.0)
+    parser.add_argument("--seed", type=int, help="random seed", default=0)
+    parser.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level")
+
+    return parser
+
+
+def get_team_count(year, scale=1.0):
+    """The number of MLB teams in the year, times scale.  It is even, so that every team plays every day."""
+    teams = next(count for first_year, count in TEAM_COUNTS if year >= first_year)
+    return max(2, 2 * round(teams * scale / 2))
+
+
+def get_games_per_team(year):
+    """154 game seasons until the 1961 expansion."""
+    return 154 if year < 1961 else 162
+
+
+def get_team_id(team):
+    """3 letter team id from the team number: AAA, AAB, ..."""
+    return ''.join(chr(ord('A') + team // 26 ** k % 26) for k in (2, 1, 0))
+
+
+def get_column_names(filename):
+    """Column names of a Chadwick data dictionary, one 'NAME = description' per line."""
+    with open(filename) as f:
+        return [line.split('=')[0].strip() for line in f if line.strip()]
+
+
+def get_types_columns(filename):
+    return pd.read_csv(filename)['index'].str.upper().tolist()
+
+
+class Registry:
+    """The players, indexed by player number, with their Retrosheet and Lahman ids."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.first = []
+        self.last = []
+        self.retro_id = []
+        self.lahman_id = []
+        self.birth_year = []
+        self.id_counts = {}
+
+    def add(self, n, year):
+        """Add n new players.  Returns their player numbers."""
+        start = len(self.retro_id)
+        firsts = self.rng.choice(FIRST_NAMES, n)
+        lasts = np.char.add(self.rng.choice(LAST_NAME_STARTS, n), self.rng.choice(LAST_NAME_ENDS, n))
+        for first, last in zip(firsts, lasts):
+            # Retrosheet ids are the first 4 letters of the last name, padded with '-', then the first initial
+            prefix = (last[:4].ljust(4, '-') + first[0]).lower()
+            count = self.id_counts.get(prefix, 0) + 1
+            self.id_counts[prefix] = count
+            self.first.append(first)
+            self.last.append(last)
+            self.retro_id.append(f'{prefix}{count:03d}')
+            self.lahman_id.append(f'{last[:5]}{first[:2]}{count:02d}'.lower())
+        self.birth_year.extend(year - self.rng.integers(21, 28, n))
+        return np.arange(start, start + n)
+
+    def get_ids(self):
+        return np.array(self.retro_id, dtype=object)
+
+    def get_names(self):
+        return np.char.add(np.char.add(np.array(self.first), ' '), np.array(self.last)).astype(object)
+
+
+def update_rosters(rosters, n_teams, year, registry, rng):
+    """Add the rosters of new teams, and replace some of the players on the existing rosters."""
+    if len(rosters) < n_teams:
+        new_teams = n_teams - len(rosters)
+        new = registry.add(new_teams * ROSTER_SIZE, year).reshape(new_teams, ROSTER_SIZE)
+        rosters = np.vstack([rosters, new]) if len(rosters) else new
+
+    replace = rng.random(rosters.shape) < TURNOVER
+    rosters[replace] = registry.add(replace.sum(), year)
+    return rosters
+
+
+def get_schedule(n_teams, year, rng):
+    """Every team plays one game a day, against a random opponent, with a day off after every 6 days.
+
+    Returns the day number, home team and away team of each game, and the date of each game.
+    """
+    n_days = get_games_per_team(year)
+    pairs = rng.permuted(np.tile(np.arange(n_teams), (n_days, 1)), axis=1)
+    day = np.repeat(np.arange(n_days), n_teams // 2)
+    dates = pd.Timestamp(year, 4, 1) + pd.to_timedelta(day + day // 6, unit='D')
+    return day, pairs[:, 0::2].ravel(), pairs[:, 1::2].ravel(), dates
+
+
+def get_lineups(rosters, orders, teams, use_dh, rng):
+    """The batting order (players and positions) of each team in each game.
+
+    In about half of the games, one fielder has the day off and is replaced by a bench player.
+    Without the DH, the pitcher bats in the DH's place, shown by player -1.
+    """
+    n = len(teams)
+    roster = rosters[teams]
+    players = roster[:, :DH_SLOT + 1].copy()
+    pos = np.tile(np.arange(2, 11), (n, 1))
+
+    rest = rng.integers(0, 2 * DH_SLOT, n)
+    rested = np.flatnonzero(rest < DH_SLOT)
+    players[rested, rest[rested]] = roster[rested, np.array(BACKUPS)[rest[rested]]]
+
+    players[~use_dh, DH_SLOT] = -1
+    pos[~use_dh, DH_SLOT] = 1
+
+    order = orders[teams]
+    return np.take_along_axis(players, order, axis=1), np.take_along_axis(pos, order, axis=1)
+
+
+class Season:
+    """The simulated games of one season.  Side 0 is the away team, side 1 is the home team."""
+
+    def __init__(self, year, rosters, orders, leagues, rng):
+        self.year = year
+        self.rng = rng
+        n_teams = len(orders)
+        self.day, home, away, self.dates = get_schedule(n_teams, year, rng)
+        self.teams = np.stack([away, home], axis=1)
+        n = len(home)
+
+        # the DH is used in AL parks from 1973
+        self.use_dh = (leagues[home] == 'AL') & (year >= 1973)
+
+        lineups = [get_lineups(rosters, orders, self.teams[:, side], self.use_dh, rng) for side in (0, 1)]
+        self.lineup = np.stack([players for players, _ in lineups], axis=1)
+        self.lineup_pos = np.stack([pos for _, pos in lineups], axis=1)
+
+        # 5 man rotations, and complete games are much more common in the earlier years
+        # a starter who goes the distance is relieved in extra innings, as pitch counts must fit in uint8
+        self.starter = rosters[self.teams, np.array(STARTERS)[self.day % 5][:, None]]
+        cg_rate = 0.25 if year < 1980 else 0.03
+        self.starter_inn = np.where(rng.random((n, 2)) < cg_rate, 9, rng.integers(5, 9, (n, 2)))
+        self.relievers = rng.permuted(rosters[self.teams][:, :, RELIEVERS], axis=2)
+
+        self.bat_slot = np.zeros((n, 2), dtype=np.int64)
+        self.score = np.zeros((n, 2), dtype=np.int64)
+        self.lob = np.zeros((n, 2), dtype=np.int64)
+
+        # runs per inning, -1 if not played
+        self.line = np.full((n, 2, MAX_INNINGS), -1, dtype=np.int64)
+        self.events = []
+
+    def get_pitcher(self, games, side, inning):
+        """The pitcher of the team in the inning: the starter, then a reliever per inning."""
+        starter_inn = self.starter_inn[games, side]
+        reliever = self.relievers[games, side, (inning - starter_inn - 1) % len(RELIEVERS)]
+        return np.where(inning <= starter_inn, self.starter[games, side], reliever)
+
+    def simulate(self):
+        """Simulate each inning of all the games until each game is over."""
+        active = np.ones(len(self.day), dtype=bool)
+        for inning in range(1, MAX_INNINGS + 1):
+            self.simulate_half_inning(np.flatnonzero(active), 0, inning)
+
+            # the home team does not bat in the 9th or later if it is ahead
+            home_ahead = (inning >= 9) & (self.score[:, 1] > self.score[:, 0])
+            self.simulate_half_inning(np.flatnonzero(active & ~home_ahead), 1, inning)
+
+            if inning >= 9:
+                active &= self.score[:, 0] == self.score[:, 1]
+            if not active.any():
+                break
+
+        self.events = {key: np.concatenate([part[key] for part in self.events]) for key in self.events[0]}
+
+    def simulate_half_inning(self, games, half, inning):
+        """Simulate the half inning of each game, one event per game at a time, until there are 3 outs.
+
+        The runners on 1st, 2nd and 3rd (r1, r2, r3) are player numbers, or -1 for an empty base.
+        """
+        rng = self.rng
+        n = len(games)
+        self.line[games, half, inning - 1] = 0
+        pitcher = self.get_pitcher(games, 1 - half, inning)
+
+        # the batting team's pitcher is the one who pitched in the previous half inning
+        bat_pitcher = self.get_pitcher(games, half, inning if half else max(inning - 1, 1))
+
+        outs = np.zeros(n, dtype=np.int64)
+        r1, r2, r3 = np.full(n, -1), np.full(n, -1), np.full(n, -1)
+        seq = 0
+        while True:
+            i = np.flatnonzero(outs < 3)
+            if not len(i):
+                break
+            g = games[i]
+            slot = self.bat_slot[g, half]
+            batter = self.lineup[g, half, slot]
+            batter = np.where(batter < 0, bat_pitcher[i], batter)
+            b1, b2, b3, o = r1[i], r2[i], r3[i], outs[i]
+            m = len(i)
+
+            code = rng.choice(PA_OUTCOMES, m, p=PA_PROBS)
+            u = rng.random(m)
+            code = np.where((code == GO) & (b1 >= 0) & (b3 < 0) & (o == 0) & (u < 0.1), SH, code)
+            code = np.where((code == GO) & (b1 >= 0) & (o < 2) & (u > 0.55), GDP, code)
+            code = np.where((code == FO) & (b3 >= 0) & (o < 2) & (u < 0.4), SF, code)
+
+            # runner on 1st with 2nd open may steal
+            steal = (b1 >= 0) & (b2 < 0)
+            v = rng.random(m)
+            code = np.where(steal & (v < 0.04), SB, np.where(steal & (v < 0.055), CS, code))
+
+            walk = np.isin(code, [BB, IBB, HBP])
+            single = np.isin(code, [S, E])
+            n1 = np.select([walk | single, np.isin(code, [D, T, HR, GDP, SH, SB, CS])], [batter, -1], b1)
+            n2 = np.select([walk, single | np.isin(code, [SH, SB]), code == D, np.isin(code, [T, HR])],
+                           [np.where(b1 >= 0, b1, b2), b1, batter, -1], b2)
+            n3 = np.select([walk, single | np.isin(code, [HR, SF]), code == D, code == SH, code == T],
+                           [np.where((b1 >= 0) & (b2 >= 0), b2, b3), -1, b1, b2, batter], b3)
+
+            # the runners who score
+            sc3 = np.where((walk & (b1 >= 0) & (b2 >= 0)) | single | np.isin(code, [D, T, HR, SF]), b3, -1)
+            sc2 = np.where(single | np.isin(code, [D, T, HR]), b2, -1)
+            sc1 = np.where(np.isin(code, [T, HR]), b1, -1)
+            scb = np.where(code == HR, batter, -1)
+            runs = (sc3 >= 0).astype(np.int64) + (sc2 >= 0) + (sc1 >= 0) + (scb >= 0)
+            event_outs = np.select([code == GDP, np.isin(code, [K, FO, GO, SF, SH, CS])], [2, 1], 0)
+
+            # the fielders who made the putouts, assists and errors, by position
+            fly = rng.choice(FLY_FIELDERS, m, p=FLY_PROBS)
+            ground = rng.choice(GROUND_FIELDERS, m, p=GROUND_PROBS)
+            po1 = np.select([code == K, np.isin(code, [FO, SF]), np.isin(code, [GO, SH]), code == GDP, code == CS],
+                            [2, fly, 3, 4, 6], 0)
+            a1 = np.select([(code == GO) & (ground != 3), code == GDP, code == SH, code == CS], [ground, 6, 1, 2], 0)
+
+            self.events.append({
+                'g': g, 'inning': np.full(m, inning), 'half': np.full(m, half), 'seq': np.full(m, seq),
+                'batter': batter, 'pitcher': pitcher[i], 'code': code, 'runner1': b1,
+                'start_bases': (b1 >= 0) + 2 * (b2 >= 0) + 4 * (b3 >= 0),
+                'end_bases': (n1 >= 0) + 2 * (n2 >= 0) + 4 * (n3 >= 0),
+                'outs': event_outs, 'runs': runs, 'sc1': sc1, 'sc2': sc2, 'sc3': sc3, 'scb': scb,
+                'po1': po1, 'po2': np.where(code == GDP, 3, 0), 'a1': a1, 'a2': np.where(code == GDP, 4, 0),
+                'e': np.where(code == E, ground, 0), 'loc': fly})
+
+            r1[i], r2[i], r3[i] = n1, n2, n3
+            outs[i] += event_outs
+            np.add.at(self.score, (g, half), runs)
+            np.add.at(self.line, (g, half, inning - 1), runs)
+            self.bat_slot[g, half] = np.where(np.isin(code, [SB, CS]), slot, (slot + 1) % 9)
+            seq += 1
+
+        self.lob[games, half] += (r1 >= 0).astype(np.int64) + (r2 >= 0) + (r3 >= 0)
+
+    def get_events(self):
+        """The events in game order, with the score before each event and the runs of each half inning."""
+        ev = pd.DataFrame(self.events)
+        ev = ev.sort_values(['g', 'inning', 'half', 'seq'], kind='mergesort', ignore_index=True)
+
+        ev['event_id'] = ev.groupby('g').cumcount() + 1
+        for side, name in enumerate(['away_score', 'home_score']):
+            runs = ev['runs'].where(ev['half'] == side, 0)
+            ev[name] = runs.groupby(ev['g']).cumsum() - runs
+
+        half_inning = ev.groupby(['g', 'inning', 'half'], sort=False)['runs']
+        ev['inn_runs'] = half_inning.transform('sum')
+        ev['fate_runs'] = ev['inn_runs'] - half_inning.cumsum()
+        ev['inn_end'] = ev['g'].ne(ev['g'].shift(-1)) | ev['inning'].ne(ev['inning'].shift(-1)) | \
+            ev['half'].ne(ev['half'].shift(-1))
+        ev['pa'] = ~ev['code'].isin([SB, CS])
+        ev['h_cd'] = ev['code'].map({S: 1, D: 2, T: 3, HR: 4}).fillna(0).astype(np.int64)
+        return ev
+
+
+def get_event_tx(ev):
+    """Retrosheet event text, which retrosheet_collect.py parses for the strikeouts, walks, stolen bases, etc."""
+    code = ev['code'].to_numpy()
+    loc, a1, po1, e = (ev[col].to_numpy().astype(str) for col in ['loc', 'a1', 'po1', 'e'])
+    a1 = np.where(ev['a1'] > 0, a1, '')
+    join = functools.partial(functools.reduce, np.char.add)
+
+    conditions = [code == c for c in [K, FO, GO, SF, GDP, SH, BB, IBB, HBP, S, D, T, HR, E, SB, CS]]
+    choices = ['K', join([loc, '/F']), join([a1, po1, '/G']), join([loc, '/SF.3-H']), '64(1)3/GDP', '13/SH',
+               'W', 'IW', 'HP', join(['S', loc]), join(['D', loc]), join(['T', loc]), join(['HR/F', loc]),
+               join(['E', e]), 'SB2', 'CS2(26)']
+    return np.select(conditions, choices, '')
+
+
+def make_cwevent(ev, season, ids, team_ids):
+    """The events as written by cwevent."""
+    def flag(values):
+        return np.where(values, 'T', 'F')
+
+    g = ev['g'].to_numpy()
+    half = ev['half'].to_numpy()
+    code = ev['code']
+
+    return pd.DataFrame({
+        'GAME_ID': season.game_id[g], 'INN_CT': ev['inning'], 'BAT_HOME_ID': half,
+        'AWAY_SCORE_CT': ev['away_score'], 'HOME_SCORE_CT': ev['home_score'],
+        'BAT_ID': ids[ev['batter']], 'PIT_ID': ids[ev['pitcher']], 'EVENT_TX': get_event_tx(ev),
+        'AB_FL': flag(code.isin(AB_CODES)), 'H_CD': ev['h_cd'], 'SH_FL': flag(code == SH), 'SF_FL': flag(code == SF),
+        'EVENT_OUTS_CT': ev['outs'], 'DP_FL': flag(code == GDP), 'TP_FL': 'F', 'WP_FL': 'F', 'PB_FL': 'F',
+        'ERR_CT': (code == E).astype(int), 'EVENT_ID': ev['event_id'],
+        'BAT_TEAM_ID': team_ids[season.teams[g, half]], 'FLD_TEAM_ID': team_ids[season.teams[g, 1 - half]],
+        'INN_END_FL': flag(ev['inn_end']), 'INN_RUNS_CT': ev['inn_runs'], 'PA_NEW_FL': flag(ev['pa']),
+        'START_BASES_CD': ev['start_bases'], 'END_BASES_CD': ev['end_bases'],
+        'BAT_SAFE_ERR_FL': flag(code == E), 'EVENT_RUNS_CT': ev['runs'], 'FATE_RUNS_CT': ev['fate_runs']},
+        columns=CWEVENT_COLUMNS)
+
+
+def sum_player_stats(df, side, player, stats):
+    """Sum the stat columns per player per game, for the team on side (0 away, 1 home)."""
+    df = df.assign(side=side, player=player)[['g', 'side', 'player'] + stats]
+    return df.groupby(['g', 'side', 'player']).sum()
+
+
+def get_decisions(season, ev):
+    """The winning, losing and saving pitchers, and the finishing pitcher of each team, by game.
+
+    The winning team's starter gets the win if his team led when he left, otherwise its finishing pitcher.
+    The losing team's starter gets the loss if his team trailed when he left, otherwise its finishing pitcher.
+    """
+    n = len(season.day)
+    fielding = ev.assign(side=1 - ev['half'])
+    finish = fielding.groupby(['g', 'side'])['pitcher'].last().unstack().reindex(range(n)).to_numpy()
+
+    runs = np.cumsum(np.maximum(season.line, 0), axis=2)
+    winner = np.where(season.score[:, 1] > season.score[:, 0], 1, 0)
+    decided = season.score[:, 0] != season.score[:, 1]
+    rows = np.arange(n)
+
+    def lead_when_starter_left(side):
+        inning = np.minimum(season.starter_inn[rows, side], MAX_INNINGS) - 1
+        return runs[rows, side, inning] - runs[rows, 1 - side, inning]
+
+    loser = 1 - winner
+    win_pit = np.where(lead_when_starter_left(winner) > 0, season.starter[rows, winner], finish[rows, winner])
+    lose_pit = np.where(lead_when_starter_left(loser) < 0, season.starter[rows, loser], finish[rows, loser])
+    margin = np.abs(season.score[:, 1] - season.score[:, 0])
+    save_pit = np.where((finish[rows, winner] != win_pit) & (finish[rows, winner] != season.starter[rows, winner])
+                        & (margin <= 3), finish[rows, winner], -1)
+
+    return {'winner': winner, 'decided': decided, 'win': np.where(decided, win_pit, -1),
+            'lose': np.where(decided, lose_pit, -1), 'save': np.where(decided, save_pit, -1), 'finish': finish}
+
+
+def make_player_game(season, ev, decisions):
+    """Stats per player per game (as in cwdaily), indexed by game, side and player number."""
+    code = ev['code']
+    pa = ev[ev['pa']]
+    pa_code = pa['code']
+    counts = pd.DataFrame({
+        'g': pa['g'], 'pa': 1, 'ab': pa_code.isin(AB_CODES), 'h': pa['h_cd'] > 0, 'tb': pa['h_cd'],
+        '2b': pa_code == D, '3b': pa_code == T, 'hr': pa_code == HR, 'hr4': (pa_code == HR) & (pa['start_bases'] == 7),
+        'bb': pa_code.isin([BB, IBB]), 'ibb': pa_code == IBB, 'so': pa_code == K, 'gdp': pa_code == GDP,
+        'hp': pa_code == HBP, 'sh': pa_code == SH, 'sf': pa_code == SF}).astype(np.int64)
+    stats = [col for col in counts.columns if col != 'g']
+
+    # batting
+    rbi = pa['runs'].where(~pa_code.isin([E, GDP]), 0)
+    parts = [sum_player_stats(counts.assign(rbi=rbi).add_prefix('b_').rename(columns={'b_g': 'g'}),
+                              pa['half'], pa['batter'], ['b_' + col for col in stats + ['rbi']])]
+
+    steals = ev[code.isin([SB, CS])]
+    parts.append(sum_player_stats(steals.assign(b_sb=steals['code'] == SB, b_cs=steals['code'] == CS),
+                                  steals['half'], steals['runner1'], ['b_sb', 'b_cs']))
+    scored = pd.concat([ev[['g', 'half', col]].rename(columns={col: 'runner'}) for col in ['sc1', 'sc2', 'sc3', 'scb']])
+    scored = scored[scored['runner'] >= 0]
+    parts.append(sum_player_stats(scored.assign(b_r=1), scored['half'], scored['runner'], ['b_r']))
+
+    # pitching
+    p_counts = counts.add_prefix('p_').rename(columns={'p_g': 'g', 'p_pa': 'p_tbf'})
+    p_counts['p_go'] = pa_code.isin([GO, GDP, SH])
+    p_counts['p_ao'] = pa_code.isin([FO, SF])
+    parts.append(sum_player_stats(p_counts, 1 - pa['half'], pa['pitcher'],
+                                  [col for col in p_counts.columns if col != 'g']))
+    parts.append(sum_player_stats(ev.assign(p_out=ev['outs'], p_r=ev['runs'], p_er=ev['runs'].where(code != E, 0)),
+                                  1 - ev['half'], ev['pitcher'], ['p_out', 'p_r', 'p_er']))
+
+    # fielding: the putouts, assists and errors of the fielder at each position, with pos 1 the pitcher
+    n = len(season.day)
+    pos_player = np.full((n, 2, 10), -1)
+    for slot in range(9):
+        pos = season.lineup_pos[:, :, slot]
+        rows, sides = np.nonzero(pos <= 9)
+        pos_player[rows, sides, pos[rows, sides]] = season.lineup[rows, sides, slot]
+
+    credits = []
+    for col, stat in [('po1', 'po'), ('po2', 'po'), ('a1', 'a'), ('a2', 'a'), ('e', 'e')]:
+        df = ev[ev[col] > 0]
+        side = 1 - df['half'].to_numpy()
+        player = np.where(df[col] == 1, df['pitcher'], pos_player[df['g'], side, df[col]])
+        credits.append(pd.DataFrame({'g': df['g'], 'side': side, 'player': player,
+                                     'col': 'f_' + df[col].map(POSITIONS) + '_' + stat}))
+    df = ev[code == GDP]
+    for pos in [6, 4, 3]:
+        credits.append(pd.DataFrame({'g': df['g'], 'side': 1 - df['half'], 'player': pos_player[df['g'], 1 - df['half'], pos],
+                                     'col': f'f_{POSITIONS[pos]}_dp'}))
+    credits = pd.concat(credits)
+    parts.append(credits.groupby(['g', 'side', 'player', 'col']).size().unstack(fill_value=0))
+
+    # appearances: every fielder plays the whole game, and is in the field for all of the opponent's outs
+    outs_fielded = ev.groupby(['g', 'half'])['outs'].sum().unstack(fill_value=0).reindex(range(n), fill_value=0)
+    rows, sides, slots = np.nonzero(season.lineup >= 0)
+    pos = season.lineup_pos[rows, sides, slots]
+    appear = pd.DataFrame({'g': rows, 'side': sides, 'player': season.lineup[rows, sides, slots], 'pos': pos,
+                           'outs': outs_fielded.to_numpy()[rows, 1 - sides]})
+    fielders = appear[appear['pos'] <= 9].copy()
+    for pos, name in POSITIONS.items():
+        at_pos = fielders['pos'] == pos
+        for stat in ['g', 'gs']:
+            fielders[f'f_{name}_{stat}'] = at_pos.astype(np.int64)
+        fielders[f'f_{name}_out'] = fielders['outs'].where(at_pos, 0)
+    f_cols = [col for col in fielders.columns if col.startswith('f_')]
+    parts.append(fielders.set_index(['g', 'side', 'player'])[f_cols])
+    dh = appear[appear['pos'] == 10]
+    parts.append(dh.assign(b_g_dh=1).set_index(['g', 'side', 'player'])[['b_g_dh']])
+
+    pitchers = ev.assign(side=1 - ev['half']).groupby(['g', 'side', 'pitcher'])['outs'].sum().reset_index()
+    g, side, player = pitchers['g'].to_numpy(), pitchers['side'].to_numpy(), pitchers['pitcher'].to_numpy()
+    starter = player == season.starter[g, side]
+    finish = player == decisions['finish'][g, side]
+    allowed = season.score[g, 1 - side]
+    pitchers = pd.DataFrame({
+        'g': g, 'side': side, 'player': player, 'p_g': 1, 'p_gs': starter, 'p_cg': starter & finish,
+        'p_sho': starter & finish & (allowed == 0), 'p_gf': finish & ~starter,
+        'p_w': player == decisions['win'][g], 'p_l': player == decisions['lose'][g],
+        'p_sv': player == decisions['save'][g], 'f_p_g': 1, 'f_p_gs': starter, 'f_p_out': pitchers['outs']})
+    parts.append(pitchers.set_index(['g', 'side', 'player']).astype(np.int64))
+
+    player_game = pd.concat(parts).groupby(level=[0, 1, 2]).sum()
+    player_game['b_g'] = 1
+    for name in POSITIONS.values():
+        if f'f_{name}_po' in player_game.columns:
+            player_game[f'f_{name}_tc'] = player_game[[f'f_{name}_{stat}' for stat in ['po', 'a', 'e']
+                                                       if f'f_{name}_{stat}' in player_game.columns]].sum(axis=1)
+    return player_game.fillna(0).astype(np.int64)
+
+
+def make_cwdaily(season, player_game, columns, types_columns, ids, team_ids, park_ids):
+    """The player stats per game as written by cwdaily."""
+    df = player_game.copy()
+    df.columns = df.columns.str.upper()
+    g, side, player = (df.index.get_level_values(level).to_numpy() for level in range(3))
+    df = df.reset_index(drop=True)
+
+    n = len(df)
+    rng = season.rng
+    game_dt = season.dates.strftime('%Y%m%d').astype(int).to_numpy()[g]
+
+    # the batting order slot of each player, and of the pitchers when there is no DH
+    slot = np.zeros(n, dtype=np.int64)
+    lineup = pd.DataFrame({'g': np.repeat(np.arange(len(season.day)), 18),
+                           'side': np.tile(np.repeat([0, 1], 9), len(season.day)),
+                           'player': season.lineup.reshape(-1), 'slot': np.tile(np.arange(1, 10), 2 * len(season.day))})
+    slots = pd.merge(pd.DataFrame({'g': g, 'side': side, 'player': player}), lineup, how='left')['slot']
+    slot = np.where(slots.notna(), slots.fillna(0), np.where(season.use_dh[g], 0, 9)).astype(np.int64)
+
+    df['GAME_ID'] = season.game_id[g]
+    df['GAME_DT'] = game_dt
+    df['GAME_CT'] = 0
+    df['APPEAR_DT'] = game_dt
+    df['TEAM_ID'] = team_ids[season.teams[g, side]]
+    df['PLAYER_ID'] = ids[player]
+    df['SLOT_CT'] = slot
+    df['SEQ_CT'] = 1
+    df['HOME_FL'] = side
+    df['OPPONENT_ID'] = team_ids[season.teams[g, 1 - side]]
+    df['PARK_ID'] = park_ids[season.teams[g, 1]]
+
+    # pitch counts were not recorded before 1988
+    pitched = df['P_TBF'].to_numpy() > 0
+    pitches = df['P_TBF'].to_numpy() * 3 + rng.binomial(df['P_TBF'].to_numpy() * 2, 0.4)
+    df['P_PITCH'] = np.where(pitched & (season.year >= 1988), pitches, np.nan)
+    df['P_STRIKE'] = np.round(df['P_PITCH'] * 0.63)
+
+    return fill_columns(df, columns, types_columns)
+
+
+def fill_columns(df, columns, types_columns):
+    """Put the columns in the order of the data dictionary.  Missing columns are 0 if they have a data type."""
+    typed = [col for col in columns if col in types_columns]
+    df = df.reindex(columns=typed, fill_value=0)
+    return df.reindex(columns=columns)
+
+
+def get_line_tx(line, innings):
+    """Line score of each game's innings, with runs over 9 in parentheses and x for a home half not played."""
+    def inning_tx(runs):
+        return 'x' if runs < 0 else str(runs) if runs < 10 else f'({runs})'
+
+    return [''.join(inning_tx(runs) for runs in row[:n]) for row, n in zip(line, innings)]
+
+
+def make_cwgame(season, ev, player_game, decisions, columns, types_columns, ids, names, team_ids, park_ids,
+                leagues, umpires):
+    """The games as written by cwgame."""
+    rng = season.rng
+    n = len(season.day)
+    df = {}
+
+    day_night = np.where(rng.random(n) < 0.65, 'N', 'D')
+    start_tm = np.where(day_night == 'N', rng.choice([705, 710, 735, 805], n), rng.choice([105, 110, 135, 405], n))
+
+    df['GAME_ID'] = season.game_id
+    df['GAME_DT'] = season.dates.strftime('%Y%m%d').astype(int)
+    df['GAME_CT'] = 0
+    df['GAME_DY'] = season.dates.day_name()
+    df['START_GAME_TM'] = start_tm
+    df['DH_FL'] = np.where(season.use_dh, 'T', 'F')
+    df['DAYNIGHT_PARK_CD'] = day_night
+    df['PARK_ID'] = park_ids[season.teams[:, 1]]
+    for i, col in enumerate(['BASE4_UMP_ID', 'BASE1_UMP_ID', 'BASE2_UMP_ID', 'BASE3_UMP_ID']):
+        df[col] = umpires[(season.day * 7 + season.teams[:, 1] * 4 + i) % len(umpires)]
+    df['ATTEND_PARK_CT'] = np.maximum(rng.normal(27000, 9000, n), 2000).astype(int)
+    df['SCORER_RECORD_ID'] = 'synthetic'
+    df['INPUTTER_RECORD_ID'] = 'synthetic'
+    df['TRANSLATOR_RECORD_ID'] = 'synthetic'
+    df['INPUT_RECORD_TS'] = season.dates.strftime('%Y/%m/%d 11:00:00 PM')
+    df['METHOD_RECORD_CD'] = 1
+    df['PITCHES_RECORD_CD'] = np.where(season.year >= 1988, 1, 0)
+    df['TEMP_PARK_CT'] = rng.integers(45, 96, n)
+    df['WIND_DIRECTION_PARK_CD'] = rng.integers(0, 9, n)
+    df['WIND_SPEED_PARK_CT'] = rng.integers(-1, 20, n)
+    df['FIELD_PARK_CD'] = rng.choice([0, 1, 2, 3, 4], n, p=[0.3, 0.01, 0.02, 0.07, 0.6])
+    df['PRECIP_PARK_CD'] = rng.choice([0, 1, 2, 3, 4], n, p=[0.3, 0.65, 0.02, 0.02, 0.01])
+    df['SKY_PARK_CD'] = np.where(day_night == 'N', 4, rng.choice([1, 2, 3, 5], n))
+    df['MINUTES_GAME_CT'] = np.maximum(rng.normal(165, 20, n), 100).astype(int)
+    df['INN_CT'] = (season.line[:, 0] >= 0).sum(axis=1)
+    df['OUTS_CT'] = ev.groupby('g')['outs'].sum().reindex(range(n), fill_value=0).to_numpy()
+
+    for col, key in [('WIN_PIT', 'win'), ('LOSE_PIT', 'lose'), ('SAVE_PIT', 'save')]:
+        pit = decisions[key]
+        df[f'{col}_ID'] = np.where(pit >= 0, ids[pit], '')
+        df[f'{col}_NAME_TX'] = np.where(pit >= 0, names[pit], '')
+    df['GWRBI_BAT_ID'] = ''
+
+    # per team stats, summed from the player stats
+    team = player_game.groupby(level=[0, 1]).sum()
+    hits = ev.assign(h=ev['h_cd'] > 0).groupby(['g', 'half'])['h'].sum().unstack(fill_value=0).reindex(range(n))
+    errors = ev.assign(e=ev['code'] == E).groupby(['g', 'half'])['e'].sum().unstack(fill_value=0).reindex(range(n))
+    pitcher_ct = player_game['p_g'].groupby(level=[0, 1]).sum()
+    line_tx = [get_line_tx(season.line[:, side], df['INN_CT']) for side in (0, 1)]
+
+    def f_cols(stat):
+        return [col for col in team.columns if col.startswith('f_') and col.endswith(f'_{stat}')]
+
+    for side, prefix in enumerate(['AWAY', 'HOME']):
+        t = team.xs(side, level=1).reindex(range(n), fill_value=0)
+        df[f'{prefix}_TEAM_ID'] = team_ids[season.teams[:, side]]
+        df[f'{prefix}_START_PIT_ID'] = ids[season.starter[:, side]]
+        df[f'{prefix}_FINISH_PIT_ID'] = ids[decisions['finish'][:, side]]
+        df[f'{prefix}_TEAM_LEAGUE_ID'] = leagues[season.teams[:, side]]
+        df[f'{prefix}_SCORE_CT'] = season.score[:, side]
+        df[f'{prefix}_HITS_CT'] = hits[side].to_numpy()
+        df[f'{prefix}_ERR_CT'] = errors[1 - side].to_numpy()
+        df[f'{prefix}_LOB_CT'] = season.lob[:, side]
+        df[f'{prefix}_LINE_TX'] = line_tx[side]
+        for stat in ['ab', '2b', '3b', 'hr', 'sh', 'sf', 'hp', 'bb', 'ibb', 'so', 'sb', 'cs', 'gdp', 'xi']:
+            df[f'{prefix}_{stat.upper()}_CT'] = t[f'b_{stat}'] if f'b_{stat}' in t.columns else 0
+        df[f'{prefix}_BI_CT'] = t['b_rbi']
+        df[f'{prefix}_PITCHER_CT'] = pitcher_ct.xs(side, level=1).reindex(range(n), fill_value=0).to_numpy()
+        df[f'{prefix}_ER_CT'] = t['p_er']
+        df[f'{prefix}_TER_CT'] = t['p_er']
+        df[f'{prefix}_PO_CT'] = t[f_cols('po')].sum(axis=1)
+        df[f'{prefix}_A_CT'] = t[f_cols('a')].sum(axis=1)
+        df[f'{prefix}_DP_CT'] = t[f_cols('dp')].sum(axis=1) // 3
+
+        for slot in range(9):
+            player = season.lineup[:, side, slot]
+            player = np.where(player < 0, season.starter[:, side], player)
+            df[f'{prefix}_LINEUP{slot + 1}_BAT_ID'] = ids[player]
+            df[f'{prefix}_LINEUP{slot + 1}_FLD_CD'] = season.lineup_pos[:, side, slot]
+            df[f'{prefix}_LINEUP{slot + 1}_BAT_NAME_TX'] = names[player]
+
+    return fill_columns(pd.DataFrame(df), columns, types_columns)
+
+
+def make_lahman_season(season, player_game, game, leagues, team_ids, park_ids, ids, registry):
+    """The Lahman batting, pitching, fielding, teams and salaries of the season."""
+    year = season.year
+    g, side, player = (player_game.index.get_level_values(level).to_numpy() for level in range(3))
+    team = season.teams[g, side]
+    season_stats = player_game.groupby([player, team]).sum()
+    season_stats.index.names = ['player', 'team']
+    season_stats = season_stats.reset_index()
+    lahman_ids = np.array(registry.lahman_id, dtype=object)
+
+    key = pd.DataFrame({'playerID': lahman_ids[season_stats['player']], 'yearID': year, 'stint': 1,
+                        'teamID': team_ids[season_stats['team']], 'lgID': leagues[season_stats['team']]})
+    s = season_stats
+
+    batting = pd.concat([key, pd.DataFrame({
+        'G': s['b_g'], 'AB': s['b_ab'], 'R': s['b_r'], 'H': s['b_h'], '2B': s['b_2b'], '3B': s['b_3b'],
+        'HR': s['b_hr'], 'RBI': s['b_rbi'], 'SB': s['b_sb'], 'CS': s['b_cs'], 'BB': s['b_bb'], 'SO': s['b_so'],
+        'IBB': s['b_ibb'], 'HBP': s['b_hp'], 'SH': s['b_sh'], 'SF': s['b_sf'], 'GIDP': s['b_gdp']})], axis=1)
+
+    p = s['p_g'] > 0
+    ip_outs = s.loc[p, 'p_out']
+    pitching = pd.concat([key[p], pd.DataFrame({
+        'W': s.loc[p, 'p_w'], 'L': s.loc[p, 'p_l'], 'G': s.loc[p, 'p_g'], 'GS': s.loc[p, 'p_gs'],
+        'CG': s.loc[p, 'p_cg'], 'SHO': s.loc[p, 'p_sho'], 'SV': s.loc[p, 'p_sv'], 'IPouts': ip_outs,
+        'H': s.loc[p, 'p_h'], 'ER': s.loc[p, 'p_er'], 'HR': s.loc[p, 'p_hr'], 'BB': s.loc[p, 'p_bb'],
+        'SO': s.loc[p, 'p_so'], 'BAOpp': (s.loc[p, 'p_h'] / s.loc[p, 'p_ab'].replace(0, np.nan)).round(3),
+        'ERA': (27 * s.loc[p, 'p_er'] / ip_outs.replace(0, np.nan)).round(2), 'IBB': s.loc[p, 'p_ibb'],
+        'WP': 0, 'HBP': s.loc[p, 'p_hp'], 'BK': 0, 'BFP': s.loc[p, 'p_tbf'], 'GF': s.loc[p, 'p_gf'],
+        'R': s.loc[p, 'p_r'], 'SH': s.loc[p, 'p_sh'], 'SF': s.loc[p, 'p_sf'], 'GIDP': s.loc[p, 'p_gdp']})], axis=1)
+
+    # Lahman combines the outfield positions as OF
+    dfs = []
+    for pos, name in POSITIONS.items():
+        lahman_pos = 'OF' if pos >= 7 else name.upper()
+        cols = {stat: s.get(f'f_{name}_{stat}', 0) for stat in ['g', 'gs', 'out', 'po', 'a', 'e', 'dp']}
+        df = pd.concat([key, pd.DataFrame({'POS': lahman_pos, 'G': cols['g'], 'GS': cols['gs'], 'InnOuts': cols['out'],
+                                           'PO': cols['po'], 'A': cols['a'], 'E': cols['e'], 'DP': cols['dp'],
+                                           'PB': 0 if pos == 2 else np.nan})], axis=1)
+        dfs.append(df[df['G'] > 0])
+    fielding = pd.concat(dfs).groupby(['playerID', 'yearID', 'stint', 'teamID', 'lgID', 'POS'], sort=False)
+    fielding = fielding.agg({'G': 'sum', 'GS': 'sum', 'InnOuts': 'sum', 'PO': 'sum', 'A': 'sum', 'E': 'sum',
+                             'DP': 'sum', 'PB': lambda pb: pb.sum(min_count=1)}).reset_index()
+    for col in ['WP', 'SB', 'CS', 'ZR']:
+        fielding[col] = np.nan
+
+    # team stats
+    t = season_stats.groupby('team').sum()
+    team_game = pd.DataFrame({'team': season.teams.ravel(), 'home': np.tile([0, 1], len(season.day)),
+                              'r': season.score.ravel(), 'ra': season.score[:, ::-1].ravel(),
+                              'attendance': np.repeat(game['ATTEND_PARK_CT'].to_numpy(), 2)})
+    team_game['w'] = team_game['r'] > team_game['ra']
+    team_game['l'] = team_game['r'] < team_game['ra']
+    team_game['attendance'] = team_game['attendance'].where(team_game['home'] == 1, 0)
+    tg = team_game.groupby('team').agg(G=('r', 'size'), Ghome=('home', 'sum'), W=('w', 'sum'), L=('l', 'sum'),
+                                       R=('r', 'sum'), RA=('ra', 'sum'), attendance=('attendance', 'sum'))
+    teams = pd.DataFrame({'yearID': year, 'lgID': leagues[tg.index], 'teamID': team_ids[tg.index],
+                          'franchID': team_ids[tg.index], 'divID': np.where(tg.index % 4 < 2, 'E', 'W')})
+    teams['Rank'] = tg['W'].groupby(teams['lgID'].to_numpy()).rank(ascending=False, method='first').astype(int).to_numpy()
+    for col in ['G', 'Ghome', 'W', 'L']:
+        teams[col] = tg[col].to_numpy()
+    league_winner = teams['Rank'] == 1
+    teams['DivWin'] = np.where(league_winner, 'Y', 'N') if year >= 1969 else np.nan
+    teams['WCWin'] = 'N' if year >= 1995 else np.nan
+    teams['LgWin'] = np.where(league_winner, 'Y', 'N')
+    ws_winner = teams.loc[league_winner, 'W'].idxmax() if league_winner.any() else None
+    teams['WSWin'] = np.where(teams.index == ws_winner, 'Y', 'N')
+    ip_outs = t['f_p_out'].to_numpy()
+    team_cols = {'R': tg['R'], 'AB': t['b_ab'], 'H': t['b_h'], '2B': t['b_2b'], '3B': t['b_3b'], 'HR': t['b_hr'],
+                 'BB': t['b_bb'], 'SO': t['b_so'], 'SB': t['b_sb'], 'CS': t['b_cs'], 'HBP': t['b_hp'],
+                 'SF': t['b_sf'], 'RA': tg['RA'], 'ER': t['p_er'], 'ERA': (27 * t['p_er'] / ip_outs).round(2),
+                 'CG': t['p_cg'], 'SHO': t['p_sho'], 'SV': t['p_sv'], 'IPouts': ip_outs, 'HA': t['p_h'],
+                 'HRA': t['p_hr'], 'BBA': t['p_bb'], 'SOA': t['p_so']}
+    for col, values in team_cols.items():
+        teams[col] = np.asarray(values)
+    e = t[[col for col in t.columns if col.startswith('f_') and col.endswith('_e')]].sum(axis=1).to_numpy()
+    tc = t[[col for col in t.columns if col.startswith('f_') and col.endswith('_tc')]].sum(axis=1).to_numpy()
+    teams['E'] = e
+    teams['DP'] = (t[[col for col in t.columns if col.startswith('f_') and col.endswith('_dp')]].sum(axis=1) // 3).to_numpy()
+    teams['FP'] = (1 - e / tc).round(3)
+    teams['name'] = 'Team ' + teams['teamID']
+    teams['park'] = 'Park ' + park_ids[tg.index]
+    teams['attendance'] = tg['attendance'].to_numpy()
+    teams['BPF'] = 100
+    teams['PPF'] = 100
+    teams['teamIDBR'] = teams['teamID']
+    teams['teamIDlahman45'] = teams['teamID']
+    teams['teamIDretro'] = teams['teamID']
+
+    # salaries are in Lahman from 1985
+    salaries = pd.DataFrame()
+    if year >= 1985:
+        salaries = key[['yearID', 'teamID', 'lgID', 'playerID']].copy()
+        salaries['salary'] = (np.exp(season.rng.normal(13.5 + (year - 1985) * 0.04, 1.0, len(key))) // 1000 * 1000)
+
+    return {'Batting': batting, 'Pitching': pitching, 'Fielding': fielding, 'Teams': teams, 'Salaries': salaries}
+
+
+def make_lahman_post(lahman, year, rng):
+    """World Series stats of the two league winners, from their season stats."""
+    teams = lahman['Teams']
+    ws_teams = teams.loc[teams['LgWin'] == 'Y', 'teamID']
+    n_games = rng.integers(4, 8)
+    post = {}
+    for name in ['Batting', 'Pitching', 'Fielding']:
+        df = lahman[name]
+        df = df[df['teamID'].isin(ws_teams)].drop(columns='stint')
+        stats = [col for col in df.columns if col not in ['playerID', 'yearID', 'teamID', 'lgID', 'POS', 'BAOpp', 'ERA']
+                 and df[col].notna().any()]
+        factor = n_games / 162
+        df[stats] = (df[stats].fillna(0) * factor + rng.random((len(df), len(stats)))).astype(int)
+        df = df[df['G'] > 0]
+        df.insert(1 if name == 'Batting' else 2, 'round', 'WS')
+        post[name + 'Post'] = df
+    return post
+
+
+def get_people(registry, appearances):
+    """People who played, with their debut and final game dates."""
+    players = appearances.groupby('player')['date'].agg(['min', 'max'])
+    idx = players.index.to_numpy()
+    rng = registry.rng
+    birth_year = np.array(registry.birth_year)[idx]
+    first, last = np.array(registry.first)[idx], np.array(registry.last)[idx]
+    return pd.DataFrame({
+        'playerID': np.array(registry.lahman_id)[idx], 'birthYear': birth_year,
+        'birthMonth': rng.integers(1, 13, len(idx)), 'birthDay': rng.integers(1, 29, len(idx)),
+        'birthCountry': 'USA', 'birthState': 'CA', 'birthCity': 'Los Angeles',
+        'deathYear': np.nan, 'deathMonth': np.nan, 'deathDay': np.nan,
+        'deathCountry': np.nan, 'deathState': np.nan, 'deathCity': np.nan,
+        'nameFirst': first, 'nameLast': last, 'nameGiven': first, 'weight': rng.integers(160, 250, len(idx)),
+        'height': rng.integers(68, 79, len(idx)), 'bats': rng.choice(['R', 'L', 'B'], len(idx), p=[.6, .3, .1]),
+        'throws': rng.choice(['R', 'L'], len(idx), p=[.7, .3]),
+        'debut': players['min'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'finalGame': players['max'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'retroID': np.array(registry.retro_id)[idx], 'bbrefID': np.array(registry.lahman_id)[idx]})
+
+
+def write_retrosheet_misc(p_raw, team_ids, park_ids, leagues, team_years):
+    """TEAM{year} files and parkcode.txt, as in the Retrosheet downloads."""
+    p_regular = p_raw / 'event/regular'
+    p_regular.mkdir(parents=True, exist_ok=True)
+    for year, n_teams in team_years.items():
+        with open(p_regular / f'TEAM{year}', 'w') as f:
+            for team in range(n_teams):
+                f.write(f'{team_ids[team]},{leagues[team]},City {team_ids[team]},Team {team_ids[team]}\n')
+
+    (p_raw / 'misc').mkdir(parents=True, exist_ok=True)
+    n_teams = max(team_years.values())
+    first_year = {team: min(year for year, n in team_years.items() if n > team) for team in range(n_teams)}
+    parks = pd.DataFrame({'PARKID': park_ids[:n_teams], 'NAME': [f'Park {park}' for park in park_ids[:n_teams]],
+                          'AKA': '', 'CITY': [f'City {team}' for team in team_ids[:n_teams]], 'STATE': 'CA',
+                          'START': [f'04/01/{first_year[team]}' for team in range(n_teams)], 'END': '',
+                          'LEAGUE': leagues[:n_teams], 'NOTES': ''})
+    parks.to_csv(p_raw / 'misc/parkcode.txt', index=False)
+
+
+def generate_season(year, scale, rosters, orders, registry, leagues, team_ids, park_ids, umpires, dictionaries, rng):
+    """Simulate one season and write its cwevent, cwdaily and cwgame files.  Returns its Lahman data."""
+    n_teams = get_team_count(year, scale)
+    season = Season(year, rosters, orders, leagues[:n_teams], rng)
+    season.game_id = (team_ids[season.teams[:, 1]] + season.dates.strftime('%Y%m%d').to_numpy().astype(object) + '0')
+    season.simulate()
+    ev = season.get_events()
+    ids, names = registry.get_ids(), registry.get_names()
+
+    p_parsed = dictionaries['p_parsed']
+    make_cwevent(ev, season, ids, team_ids).to_csv(p_parsed / f'cwevent{year}.csv', index=False)
+
+    decisions = get_decisions(season, ev)
+    player_game = make_player_game(season, ev, decisions)
+    columns, types_columns = dictionaries['cwdaily']
+    cwdaily = make_cwdaily(season, player_game, columns, types_columns, ids, team_ids, park_ids)
+    cwdaily.to_csv(p_parsed / f'cwdaily{year}.csv', index=False)
+
+    columns, types_columns = dictionaries['cwgame']
+    cwgame = make_cwgame(season, ev, player_game, decisions, columns, types_columns, ids, names, team_ids,
+                         park_ids, leagues, umpires)
+    cwgame.to_csv(p_parsed / f'cwgame{year}.csv', index=False)
+
+    logger.info(f'{year}: {len(season.day):,d} games, {len(ev):,d} events, {len(cwdaily):,d} player games')
+
+    lahman = make_lahman_season(season, player_game, cwgame, leagues, team_ids, park_ids, ids, registry)
+    lahman.update(make_lahman_post(lahman, year, rng))
+    g = player_game.index.get_level_values(0).to_numpy()
+    lahman['appearances'] = pd.DataFrame({'player': player_game.index.get_level_values(2).to_numpy(),
+                                          'date': season.dates[g]}).groupby('player')['date'].agg(['min', 'max'])
+    return lahman
+
+
+def main(argv=None):
+    """Generate the synthetic data.
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.log_level:
+        fh = logging.FileHandler('download.log')
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        fh.setFormatter(formatter)
+        fh.setLevel(args.log_level)
+        logger.addHandler(fh)
+
+    if args.verbose:
+        # send INFO level logging to stdout
+        sh = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        sh.setFormatter(formatter)
+        sh.setLevel(logging.INFO)
+        logger.addHandler(sh)
+
+    p_data = Path(args.data_dir).resolve()
+    p_retrosheet = p_data / 'retrosheet'
+    p_parsed = p_retrosheet / 'parsed'
+    p_lahman_raw = p_data / 'lahman/raw'
+    # the directories made by the download scripts
+    for p in [p_parsed, p_retrosheet / 'wrangled', p_lahman_raw, p_data / 'lahman/wrangled']:
+        p.mkdir(parents=True, exist_ok=True)
+
+    # the data types of the parsed files, for retrosheet_collect.py --use-datatypes
+    for filename in ['event_types.csv', 'player_game_types.csv', 'game_types.csv']:
+        if (P_REPO_RETROSHEET / filename).resolve() != (p_retrosheet / filename).resolve():
+            shutil.copyfile(P_REPO_RETROSHEET / filename, p_retrosheet / filename)
+
+    dictionaries = {
+        'p_parsed': p_parsed,
+        'cwdaily': (get_column_names(P_REPO_RETROSHEET / 'cwdaily_datadictionary.txt'),
+                    get_types_columns(P_REPO_RETROSHEET / 'player_game_types.csv')),
+        'cwgame': (get_column_names(P_REPO_RETROSHEET / 'cwgame_datadictionary.txt'),
+                   get_types_columns(P_REPO_RETROSHEET / 'game_types.csv'))}
+
+    rng = np.random.default_rng(args.seed)
+    registry = Registry(rng)
+    years = range(args.start_year, args.end_year + 1)
+    team_years = {year: get_team_count(year, args.scale) for year in years}
+    n_teams = max(team_years.values())
+    team_ids = np.array([get_team_id(team) for team in range(n_teams)], dtype=object)
+    park_ids = np.array([f'{team_id}01' for team_id in team_ids], dtype=object)
+    leagues = np.where(np.arange(n_teams) % 2 == 0, 'AL', 'NL').astype(object)
+    umpires = np.array([f'ump{i:04d}' for i in range(max(4, n_teams * 3))], dtype=object)
+
+    # the raw files are written first, so that run_all_scripts.py finds the parsed files up to date
+    write_retrosheet_misc(p_retrosheet / 'raw', team_ids, park_ids, leagues, team_years)
+
+    rosters = np.empty((0, ROSTER_SIZE), dtype=np.int64)
+    lahman = []
+    for year in years:
+        rosters = update_rosters(rosters, team_years[year], year, registry, rng)
+        orders = rng.permuted(np.tile(np.arange(9), (team_years[year], 1)), axis=1)
+        lahman.append(generate_season(year, args.scale, rosters, orders, registry, leagues, team_ids, park_ids,
+                                      umpires, dictionaries, rng))
+
+    for name in ['Batting', 'Pitching', 'Fielding', 'Teams', 'Salaries', 'BattingPost', 'PitchingPost',
+                 'FieldingPost']:
+        pd.concat([season[name] for season in lahman]).to_csv(p_lahman_raw / f'{name}.csv', index=False)
+
+    appearances = pd.concat([season['appearances'] for season in lahman])
+    appearances = pd.concat([appearances['min'].rename('date'), appearances['max'].rename('date')]).reset_index()
+    get_people(registry, appearances).to_csv(p_lahman_raw / 'People.csv', index=False)
+
+    parks = pd.DataFrame({'park.key': park_ids, 'park.name': 'Park ' + park_ids, 'park.alias': np.nan,
+                          'city': 'City ' + team_ids, 'state': 'CA', 'country': 'US'})
+    parks.to_csv(p_lahman_raw / 'Parks.csv', index=False)
+
+    logger.info('Finished')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 __author__ = 'Stephen Diehl'
 
 import zipfile
-import re
 import pandas as pd
 import numpy as np
 from .. import data_helper as dh
@@ -114,11 +113,12 @@ def test_lahman_parks_pkey(data_dir):
 
 def test_game_id(team_game):
     """Verify 1st 3 characters of game_id are the team batting last."""
-    filt = team_game['bat_last'] == False
-    team_game['home_team_id'] = team_game['team_id']
-    team_game.loc[filt, 'home_team_id'] = team_game.loc[filt, 'opponent_team_id']
+    tg = team_game[['game_id', 'team_id', 'opponent_team_id', 'bat_last']]
+    filt = tg['bat_last'] == False
+    tg['home_team_id'] = tg['team_id']
+    tg.loc[filt, 'home_team_id'] = tg.loc[filt, 'opponent_team_id']
 
-    assert (team_game['game_id'].str[:3] == team_game['home_team_id']).all()
+    assert (tg['game_id'].str[:3] == tg['home_team_id']).all()
 
 
 def test_batting_flags(batting):
@@ -194,46 +194,30 @@ def test_game_pkey(game):
     assert dh.is_unique(game, ['game_id'])
 
 
-def test_lahman_retro_batting_data(batting, lahman_batting):
+def test_lahman_retro_batting_data(validator):
     """Compare Aggregated Lahman batting data to Aggregated Retrosheet batting data"""
-    # columns in common -- these are the columns to compare
-    b_cols = set(batting.columns) & set(lahman_batting.columns)
-    b_cols -= {'player_id', 'team_id', 'year'}
+    result = validator.run('lahman_retro_batting')
 
     # there are 17 columns in common
-    assert len(b_cols) == 17
+    assert len(result['cols']) == 17
 
-    l_batting = lahman_batting[b_cols]
-    r_batting = batting[b_cols]
-
-    l_sums = l_batting.agg('sum').astype(int)
-    l_sums.sort_index(inplace=True)
-
-    r_sums = r_batting.agg('sum').astype(int)
-    r_sums.sort_index(inplace=True)
+    l_sums = pd.Series(result['lahman']).sort_index()
+    r_sums = pd.Series(result['retro']).sort_index()
 
     # verify all 17 batting attributes
     # are within plus/minus 0.01% of each other when summed
     assert (np.abs(1.0 - (l_sums / r_sums)) < .0001).all()
 
 
-def test_lahman_retro_pitching_data(pitching, lahman_pitching):
+def test_lahman_retro_pitching_data(validator):
     """Compare Aggregated Lahman pitching data to Aggregated Retrosheet pitching data"""
-    # columns in common -- these are the columns to compare
-    p_cols = set(lahman_pitching.columns) & set(pitching.columns)
-    p_cols -= {'player_id', 'team_id', 'year'}
+    result = validator.run('lahman_retro_pitching')
 
     # there are 21 columns in common
-    assert len(p_cols) == 21
-
-    l_pitching = lahman_pitching[p_cols]
-    r_pitching = pitching[p_cols]
+    assert len(result['cols']) == 21
 
-    l_sums = l_pitching.agg('sum').astype(int)
-    l_sums.sort_index(inplace=True)
-
-    r_sums = r_pitching.agg('sum').astype(int)
-    r_sums.sort_index(inplace=True)
+    l_sums = pd.Series(result['lahman']).sort_index()
+    r_sums = pd.Series(result['retro']).sort_index()
 
     # verify all values are within plus/minus 0.06% of each other
     assert (np.abs(1.0 - (l_sums / r_sums)) < .0006).all()
@@ -260,7 +244,7 @@ def test_lahman_retro_fielding_data(fielding, lahman_fielding):
     # there are 7 fielding attributes and 7 fielding positions in Lahman
     assert l_sums.shape == (7, 7)
 
-    r_sums = fielding.groupby('pos')[f_cols].agg('sum').astype('int')
+    r_sums = fielding[['pos'] + f_cols].groupby('pos')[f_cols].agg('sum').astype('int')
 
     # Lahman uses OF for sum of LF, CF, RF
     r_sums.loc['OF'] = r_sums.loc['LF'] + r_sums.loc['CF'] + r_sums.loc['RF']
@@ -275,7 +259,7 @@ def test_lahman_retro_fielding_data(fielding, lahman_fielding):
     assert l_sums.columns.equals(r_sums.columns)
 
     filt = fielding['pos'].isin(['LF', 'CF', 'RF'])
-    r_of = fielding[filt]
+    r_of = fielding[['player_id', 'game_id']][filt]
 
     # account for outfielders who played more than 1 outfield position in the same game
     total_dups = r_of.duplicated(subset=['player_id', 'game_id'], keep=False).sum()
@@ -288,88 +272,79 @@ def test_lahman_retro_fielding_data(fielding, lahman_fielding):
     assert (np.abs(1.0 - rel_accuarcy) < 0.008).all().all()
 
 
-def test_batting_team_game_data(batting, team_game):
+def test_batting_team_game_data(validator):
     """Verify Retrosheet batting aggregated by (game_id, team_id)
     is the same as team_game batting stats."""
-    exclude = ['game_id', 'team_id', 'player_id', 'game_start', 'year']
-    cols = set(batting.columns) & set(team_game.columns) - set(exclude)
+    result = validator.run('batting_team_game')
+
+    assert len(result['cols']) == 17
+
+    # the same (game_id, team_id) rows, values and dtypes
+    assert result['missing'] == 0
+    assert result['mismatches'] == 0
+    assert result['dtype_mismatches'] == 0
+
+
+def test_batting_season_rollups(data_dir, team_game):
+    """Verify the Retrosheet batting team season rollup is the same as
+    team_game aggregated by (team_id, year)."""
+    p_wrangled = data_dir / 'retrosheet' / 'wrangled'
+    player_season = dh.from_csv_with_types(p_wrangled / 'batting_player_season.csv')
+    assert dh.is_unique(player_season, ['player_id', 'team_id', 'year'])
+
+    team_season = dh.from_csv_with_types(p_wrangled / 'batting_team_season.csv')
+    team_season = team_season.query('1974 <= year <= 2019')
+
+    pkey = ['team_id', 'year']
+    cols = set(team_season.columns) & set(team_game.columns) - set(pkey)
     cols = list(cols)
 
     assert len(cols) == 17
 
-    b = batting[['game_id', 'team_id'] + cols].groupby(['game_id', 'team_id']).agg('sum')
-    b = b.reset_index().sort_index()
+    ts = team_season.set_index(pkey).sort_index()
+    team_game = team_game[pkey + cols + ['game_id']]
+    tg = team_game.groupby(pkey)[cols].sum().sort_index()
+    assert (ts[cols].values == tg.values).all()
 
-    tg = team_game[['game_id', 'team_id'] + cols].sort_values(
-        ['game_id', 'team_id']).reset_index(drop=True)
+    # each team plays in each of its games
+    assert (ts['games'] == team_game.groupby(pkey)['game_id'].nunique().sort_index()).all()
 
-    assert b.equals(tg)
 
-
-def test_pitching_team_game_data(pitching, team_game):
+def test_pitching_team_game_data(validator):
     """Verify Retrosheet batting aggregated by (game_id, team_id)
     is the same as team_game pitching stats
 
     This shows that the two Retrosheet parsers are consistent with one another."""
-    cols = ['wp', 'bk', 'er']
-
-    p = pitching[['game_id', 'team_id'] + cols].groupby(['game_id', 'team_id']).agg('sum')
-    p = p.reset_index().sort_index()
+    result = validator.run('pitching_team_game')
 
-    tg = team_game[['game_id', 'team_id'] + cols].sort_values(
-        ['game_id', 'team_id']).reset_index(drop=True)
+    assert result['missing'] == 0
+    assert result['mismatches'] == 0
+    assert result['dtype_mismatches'] == 0
 
-    assert p.equals(tg)
 
-
-def test_fielding_team_game_data(fielding, team_game):
+def test_fielding_team_game_data(validator):
     """Verify Retrosheet fielding aggregated by (game_id, team_id)
     is the same a team_game fielding stats
 
     This shows that the two Retrosheet parsers are consistent with one another."""
-    cols = ['a', 'e', 'po', 'pb']
-
-    f = fielding[['game_id', 'team_id'] + cols].groupby(['game_id', 'team_id']).agg('sum')
-    f = f.reset_index().sort_index()
-
-    tg = team_game[['game_id', 'team_id'] + cols].sort_values(
-        ['game_id', 'team_id']).reset_index(drop=True)
+    result = validator.run('fielding_team_game')
 
-    assert f.equals(tg)
+    assert result['missing'] == 0
+    assert result['mismatches'] == 0
+    assert result['dtype_mismatches'] == 0
 
 
-def test_batting_lahman_game_data(batting, lahman_teams):
+def test_batting_lahman_game_data(validator):
     """Verify Retrosheet batting aggregated by (year, team_id_lahman)
     is the same as Lahman_teams.
 
     This shows that Retrosheet batting and Lahman Teams are consistent with each other."""
-    # Add team_id_lahman
-    retro_batting = pd.merge(batting, lahman_teams[['team_id', 'year', 'team_id_retro']],
-                             left_on=['year', 'team_id'],
-                             right_on=['year', 'team_id_retro'],
-                             how='inner', suffixes=['_retrosheet', '_lahman'])
-
-    # team_id_retro is now the same as team_id_retrosheet
-    retro_batting.drop('team_id_retro', axis=1, inplace=True)
-
-    pkey = ['year', 'team_id']
-    compare_cols = set(lahman_teams.columns) & set(retro_batting.columns) - set(pkey)
-    compare_cols -= {'g'}  # cannot sum g by player per team to get g per team
-    compare_cols -= {'sb', 'cs'}  # these stats are close, but don't tie out as well as others
-    compare_cols = list(compare_cols)
-
-    assert len(compare_cols) == 10
+    result = validator.run('batting_lahman_teams')
 
-    retro_batting_sums = retro_batting.groupby(['year', 'team_id_lahman'])[compare_cols].sum().astype('int')
-    retro_batting_sums.sort_index(inplace=True)
-
-    year_min, year_max = retro_batting['year'].aggregate(['min', 'max'])
-    year_filt = (lahman_teams['year'] >= year_min) & (lahman_teams['year'] <= year_max)
-    l_teams = lahman_teams.loc[year_filt, pkey + compare_cols]
-    l_teams = l_teams.set_index(pkey).sort_index()
+    assert len(result['cols']) == 10
 
     # verify all 12880 values are within 0.5% of each other
-    assert np.abs(1.0 - (l_teams / retro_batting_sums)).max().max() < 0.005
+    assert result['max_rel_diff'] < 0.005
 
 
 def test_attendance_values(game):
@@ -458,7 +433,7 @@ def test_retro_lahman_fielding_players(fielding, lahman_people, lahman_fielding)
     assert len(l_fielders - r_fielders) == 0
 
     missing_fielder = f'{(r_fielders - l_fielders).pop()}'
-    missing = fielding.query(f'player_id == "{missing_fielder}"')
+    missing = fielding[['player_id', 'tc', 'inn_outs']].query(f'player_id == "{missing_fielder}"')
 
     # The missing fielder had zero fielding total chances.
     assert missing['tc'].sum() == 0
@@ -630,36 +605,17 @@ def test_lahman_fielding_teams(lahman_fielding, lahman_teams):
     assert ((f[cols] - t[cols]).max() <= 2).all()
 
 
-def test_event(event, team_game):
+def test_event(validator):
     """Verify play-by-play data aggregated per team per game matches team_game data
 
     About 10 fields were added to cwevent output by custom parsing of event_tx.
     These 10 fields are included in this test."""
+    result = validator.run('event_team_game')
 
-    key = ['game_id', 'team_id', 'opponent_team_id']
-    compare_cols = set(team_game.columns) & set(event.columns) - set(key)
-    compare_cols = list(compare_cols)
-    assert len(compare_cols) == 21
-
-    event_team_game = event[key + compare_cols].groupby(key).agg('sum')
-
-    # e, dp, tp, pb, wp, and bk should be charged to the opponent when
-    # aggregating values to compare with team_game
-    opp_cols = ['e', 'dp', 'tp', 'pb', 'wp', 'bk']
-    tmp = event_team_game.reset_index()
-    opp = event_team_game.sort_values(['game_id', 'opponent_team_id']).reset_index()
-
-    # swap column values
-    tmp[opp_cols] = opp[opp_cols]
-    event_team_game = tmp
+    assert len(result['cols']) == 21
 
-    tg = team_game.set_index(['game_id', 'team_id']).sort_index()
-    etg = event_team_game.set_index(['game_id', 'team_id']).sort_index()
-
-    diff = tg[compare_cols] - etg[compare_cols]
-
-    assert diff.max().max() == 0
-    assert diff.min().min() == 0
+    assert result['max_diff'] == 0
+    assert result['min_diff'] == 0
 
 
 def test_event_pkey(event):
@@ -669,20 +625,28 @@ def test_event_pkey(event):
 
 def test_line_score(team_game):
     """Verify line score total is run total."""
+    # example: 0102(11)0500
+    runs = dh.parse_line_scores(team_game['line_tx']).sum(axis=1)
+    assert (runs == team_game['r']).all()
 
-    def line_score_to_runs(row):
-        line_score = row['line_tx']
 
-        # example: 0102(11)0500
-        # capture all digits having
-        # positive lookbehind = (
-        # positive lookahead = )
-        # OR capture one digit at a time
-        runs = 0
-        for value in re.findall(r'(?<=\()\d+(?=\))|\d', line_score):
-            runs += int(value)
+def test_team_game_from_events(team_game_from_events, team_game):
+    """Verify the half_inning rollup per team per game matches team_game data.
 
-        return runs
+    This is the same comparison as test_event, starting from the precomputed rollup."""
+    key = ['game_id', 'team_id']
+    exclude = ['opponent_team_id', 'game_start', 'year']
+    compare_cols = set(team_game.columns) & set(team_game_from_events.columns) - set(key + exclude)
+    compare_cols = list(compare_cols)
+    assert len(compare_cols) == 21
 
-    runs = team_game.apply(line_score_to_runs, axis=1)
-    assert (runs == team_game['r']).all()
+    tg = team_game[key + compare_cols].set_index(key).sort_index()
+    etg = team_game_from_events[key + compare_cols].set_index(key).sort_index()
+
+    # the rollup is only available for years having event data
+    tg = tg.loc[etg.index]
+
+    diff = tg[compare_cols] - etg[compare_cols]
+
+    assert diff.max().max() == 0
+    assert diff.min().min() == 0
@@ -1,6 +1,8 @@
 import os
 import sys
 import pandas as pd
+import numpy as np
+import pytest
 
 __author__ = 'Stephen Diehl'
 
@@ -52,6 +54,51 @@ def test_rw_with_types(data_dir):
     os.remove(data_dir / 'tmp_types.csv')
 
 
+def test_optimize_db_dtypes():
+    from sqlalchemy.types import SmallInteger, Integer, BigInteger, Numeric, Boolean, Text, Enum
+
+    df = pd.DataFrame({'a': np.array([0, 300], dtype=np.uint16),
+                       'b': np.array([0, 40000], dtype=np.uint16),
+                       'c': pd.array([None, 2 ** 40], dtype='UInt64'),
+                       'd': np.array([0, 2 ** 64 - 1], dtype=np.uint64),
+                       'e': [True, False],
+                       'sky': ['sunny', 'overcast'],
+                       'pos': ['SS', 'C']})
+
+    # the SQL type depends upon the values, not just the data type
+    db_dtypes = dh.optimize_db_dtypes(df, max_enum_values=10)
+    assert db_dtypes['a'] == SmallInteger
+    assert db_dtypes['b'] == Integer
+    assert db_dtypes['c'] == BigInteger
+    assert isinstance(db_dtypes['d'], Numeric)
+    assert db_dtypes['e'] == Boolean
+    assert isinstance(db_dtypes['sky'], Enum) and db_dtypes['sky'].enums == ['overcast', 'sunny']
+    # short strings are smaller than an enum
+    assert db_dtypes['pos'] == Text
+
+    # without values, the range of the data type is used
+    assert dh.optimize_db_dtypes(df.iloc[:0])['a'] == Integer
+
+    # stats can be computed per chunk and combined
+    stats = dh.combine_column_stats([dh.get_column_stats(df.iloc[:1]), dh.get_column_stats(df.iloc[1:])])
+    combined = dh.optimize_db_dtypes(df, stats, max_enum_values=10)
+    assert {col: repr(sql_type) for col, sql_type in combined.items()} == \
+        {col: repr(sql_type) for col, sql_type in db_dtypes.items()}
+    assert dh.estimate_row_width(db_dtypes, stats) < dh.estimate_row_width(dh.optimize_db_dtypes(df.iloc[:0]), stats)
+
+    # distinct values are added chunk by chunk, and dropped for good once there are too many
+    chunks = [pd.DataFrame({'sky': ['sunny', 'overcast'], 'id': ['a', 'b']}),
+              pd.DataFrame({'sky': ['sunny'], 'id': ['c']}),
+              pd.DataFrame({'sky': ['dome'], 'id': ['d']})]
+    stats = dh.get_column_stats(chunks[0], max_values=2)
+    for chunk in chunks[1:]:
+        stats = dh.add_column_stats(stats, dh.get_column_stats(chunk, max_values=2), max_values=3)
+    assert stats.loc['sky', 'values'] == {'sunny', 'overcast', 'dome'}
+    assert not isinstance(stats.loc['id', 'values'], set)
+    assert stats.loc['id', 'count'] == 4
+    assert not isinstance(dh.get_column_stats(chunks[0], max_values=1).loc['sky', 'values'], set)
+
+
 def test_sum_stats_for_dups():
     data = {'pkey1': [1, 2, 3, 3, 4, 5, 5, 5],
             'pkey2': [2, 3, 4, 4, 5, 6, 6, 6],
@@ -70,3 +117,726 @@ def test_sum_stats_for_dups():
     df_chk = pd.DataFrame(chk)
 
     assert df.equals(df_chk)
+
+
+def test_consolidate_dups():
+    from .. import key_integrity
+
+    df = pd.DataFrame({'game_id': ['g1', 'g2', 'g1', 'g3', 'g2', 'g1'],
+                       'player_id': ['a', 'b', 'a', 'c', 'b', 'a'],
+                       'b_h': np.array([1, 2, 3, 4, 250, 5], dtype=np.uint8),
+                       'p_g': np.array([1, 0, 1, 1, 1, 0], dtype=np.uint8),
+                       'p_pitch': pd.array([None, 10, None, 5, None, None], dtype='UInt8'),
+                       'misc': ['x1', 'y1', 'x2', 'z', 'y2', 'x3']})
+    df_orig = df.copy()
+
+    positions, starts = key_integrity.get_duplicate_groups(df, ['game_id', 'player_id'])
+    assert positions.tolist() == [0, 2, 5, 1, 4]
+    assert starts.tolist() == [0, 3]
+
+    reducers = {'b_h': 'sum', 'p_g': 'max', 'p_pitch': 'max'}
+    out = dh.consolidate_dups(df, ['game_id', 'player_id'], reducers)
+    assert out['game_id'].tolist() == ['g1', 'g2', 'g3']
+    assert out['misc'].tolist() == ['x1', 'y1', 'z']
+    assert out['p_g'].tolist() == [1, 1, 1]
+    assert out['p_pitch'].isna().tolist() == [True, False, False]
+    assert out['p_pitch'].dtype == 'UInt8' and out['p_g'].dtype == np.uint8
+
+    # 2 + 250 does not fit in uint8
+    assert out['b_h'].tolist() == [9, 252, 4]
+    out = dh.consolidate_dups(df.assign(b_h=df['b_h'] + np.uint8(5)), ['game_id', 'player_id'], reducers)
+    assert out['b_h'].tolist() == [24, 262, 9]
+    assert out.index.equals(pd.RangeIndex(3))
+
+    # the input is not modified, and is returned if there are no duplicates
+    assert df.equals(df_orig)
+    assert dh.consolidate_dups(df, ['game_id', 'misc'], reducers) is df
+
+
+def test_sum_segments():
+    data = {'key1': ['a', 'a', 'a', 'b', 'b', 'a'],
+            'key2': [1, 1, 2, 2, 2, 2],
+            'name': ['x', 'y', 'z', 'u', 'v', 'w'],
+            'stat1': np.array([200, 100, 1, 2, 3, 4], dtype='uint8'),
+            'stat2': [True, True, False, True, True, True]}
+    df = pd.DataFrame(data)
+
+    df = dh.sum_segments(df, ['key1', 'key2'], ['stat1', 'stat2'], first_cols=['name'])
+
+    # runs of consecutive keys are reduced, a repeated key after a different key starts a new run
+    chk = {'key1': ['a', 'a', 'b', 'a'],
+           'key2': [1, 2, 2, 2],
+           'name': ['x', 'z', 'u', 'w'],
+           'stat1': [300, 1, 5, 4],
+           'stat2': [2, 0, 2, 1]}
+    df_chk = pd.DataFrame(chk)
+
+    assert df.equals(df_chk)
+
+
+def test_add_base_out_state():
+    from .. import run_expectancy as re24
+
+    # two half-innings: 3 events then 4 events
+    data = {'game_id': ['BOS201904010'] * 7,
+            'inn_ct': [1, 1, 1, 1, 1, 1, 1],
+            'home_half': [0, 0, 0, 1, 1, 1, 1],
+            'outs': [1, 1, 1, 0, 0, 2, 1],
+            'r': [0, 0, 0, 0, 1, 1, 0]}
+    event = pd.DataFrame(data)
+
+    event = re24.add_base_out_state(event)
+
+    assert event['outs_start'].tolist() == [0, 1, 2, 0, 0, 0, 2]
+    assert event['inn_outs'].tolist() == [3, 3, 3, 3, 3, 3, 3]
+    assert event['runs_roi'].tolist() == [0, 0, 0, 2, 2, 1, 0]
+
+
+def test_compute_counts_by_year(tmp_path):
+    from .. import run_expectancy as re24
+
+    event = pd.DataFrame({'game_id': ['BOS201904010', 'BOS201904010', 'NYA201904020', 'BOS202004010'],
+                          'r': np.array([1, 0, 2, 3], dtype=np.uint8)})
+    inputs = pd.DataFrame({'year': [2019, 2020], 'lg_id': ['AL', 'AL']})
+    p_event = tmp_path / 'event.csv.gz'
+    dh.to_csv_with_types(event, p_event)
+
+    counted = []
+
+    def count_func(df):
+        counted.extend(sorted(df['game_id'].str[3:7].astype(int).unique()))
+        df = df.assign(year=df['game_id'].str[3:7].astype('int16'))
+        return df.groupby('year', as_index=False).agg(n=('r', 'size'), runs=('r', 'sum'))
+
+    def compute():
+        counted.clear()
+        return re24.compute_counts_by_year(p_event, ['game_id', 'r'], count_func, tmp_path / 'cache', 'counts',
+                                           ['year'], ['n', 'runs'], inputs)
+
+    counts = compute()
+    assert counts[['year', 'n', 'runs']].values.tolist() == [[2019, 3, 3], [2020, 1, 3]]
+    assert counted == [2019, 2020]
+
+    # nothing has changed, so nothing is counted
+    assert compute().equals(counts)
+    assert counted == []
+
+    # only the year whose inputs changed is counted
+    inputs.loc[1, 'lg_id'] = 'NL'
+    assert compute().equals(counts)
+    assert counted == [2020]
+
+    # only the year whose events changed is counted, even if the file is the same size
+    event.loc[0, 'r'] = 4
+    dh.to_csv_with_types(event, p_event)
+    assert compute()['runs'].tolist() == [6, 3]
+    assert counted == [2019]
+
+    # no events
+    dh.to_csv_with_types(event.iloc[:0], p_event)
+    counts = compute()
+    assert counts.empty and counts.columns.tolist() == ['year', 'n', 'runs']
+
+
+def test_smooth_we():
+    from .. import win_expectancy as we
+
+    # two base-out states for the same inning, half and score
+    data = {'year': [2018, 2019, 2019],
+            'inning': [9, 9, 9],
+            'home_half': [1, 1, 1],
+            'outs': [2, 2, 0],
+            'bases': [0, 0, 7],
+            'score_diff': [-1, -1, -1],
+            'n': [10, 10, 20],
+            'wins': [1, 1, 8]}
+    counts = pd.DataFrame(data)
+
+    table = we.smooth_we(counts, prior_weight=10.0)
+
+    # years are combined and each state is shrunk toward 10 / 40 wins
+    assert table['outs'].tolist() == [0, 2]
+    assert table['n'].tolist() == [20, 20]
+    assert np.allclose(table['we'], [(8 + 2.5) / 30, (2 + 2.5) / 30])
+
+
+def test_ols_normal_equations():
+    import statsmodels.formula.api as smf
+    from patsy import dmatrices
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'single': rng.poisson(0.7, 200), 'hr': rng.poisson(0.1, 200)})
+    df['r'] = (0.5 * df['single'] + 1.4 * df['hr'] + rng.normal(0, 0.3, 200)).round()
+    formula = 'r ~ single + hr'
+
+    # a weight of k is the same as resampling that row k times
+    idx = rng.choice(len(df), size=len(df), replace=True)
+    weights = np.bincount(idx, minlength=len(df))[None, :].astype(float)
+
+    y, X = dmatrices(formula, df, return_type='dataframe')
+    params, r_squared_adj = dh.ols_normal_equations(X.to_numpy(), y.to_numpy()[:, 0], weights)
+
+    result = smf.ols(formula=formula, data=df.iloc[idx]).fit()
+    assert np.allclose(params[0], result.params)
+    assert np.isclose(r_squared_adj[0], result.rsquared_adj)
+
+    boot = dh.bootstrap_ols(formula, df, n_replicates=20, random_state=100, chunk_size=8)
+    assert list(boot.columns) == ['Intercept', 'single', 'hr', 'r_squared_adj']
+    assert len(boot) == 20
+
+    # the results depend upon random_state only
+    boot_jobs = dh.bootstrap_ols(formula, df, n_replicates=20, random_state=100, chunk_size=8, n_jobs=2)
+    pd.testing.assert_frame_equal(boot, boot_jobs)
+
+    # the bootstrap is centered on the full data fit
+    boot = dh.bootstrap_ols(formula, df, n_replicates=400, random_state=100)
+    result = smf.ols(formula=formula, data=df).fit()
+    assert np.allclose(boot[result.params.index].mean(), result.params, atol=0.02)
+
+
+def test_compute_park_runs():
+    from .. import park_factor as pf
+
+    # the team batting last is listed first, AAA3 is a home game for AAA played in London
+    data = {'game_id': ['AAA1', 'AAA1', 'AAA2', 'AAA2', 'BBB1', 'BBB1', 'BBB2', 'BBB2', 'AAA3', 'AAA3'],
+            'year': [2019] * 10,
+            'bat_last': [True, False] * 5,
+            'team_id': ['AAA', 'BBB', 'AAA', 'CCC', 'BBB', 'AAA', 'BBB', 'CCC', 'AAA', 'BBB'],
+            'r': [5, 3, 2, 2, 1, 2, 4, 0, 9, 9]}
+    team_game = pd.DataFrame(data)
+    game = pd.DataFrame({'game_id': ['AAA1', 'AAA2', 'BBB1', 'BBB2', 'AAA3'],
+                         'park_id': ['PKA', 'PKA', 'PKB', 'PKB', 'LON']})
+
+    park_runs = pf.compute_park_runs(team_game, game)
+
+    # the London game is removed
+    assert park_runs['team_id'].tolist() == ['AAA', 'BBB', 'CCC']
+    assert park_runs['park_id'].tolist() == ['PKA', 'PKB', 'PKA']
+    assert park_runs['games_home'].tolist() == [2, 2, 1]
+    assert park_runs['rt_home'].tolist() == [12, 7, 4]
+    assert park_runs['games_road'].tolist() == [1, 1, 1]
+    assert park_runs['rt_road'].tolist() == [3, 8, 4]
+
+    park_factor = pf.compute_pf(park_runs, rolling_years=[3])
+    assert np.allclose(park_factor['pf'], [2.0, 0.4375, 1.0])
+    assert np.allclose(park_factor['pf_3yr'], park_factor['pf'])
+
+
+def test_compute_pf():
+    from .. import park_factor as pf
+
+    # AAA played in PKA in 2010, 2011 and 2015, and in PKX in 2012, the rows are not in year order
+    park_runs = pd.DataFrame({'team_id': ['AAA', 'AAA', 'AAA', 'AAA', 'BBB', 'BBB'],
+                              'year': [2015, 2010, 2012, 2011, 2011, 2012],
+                              'park_id': ['PKA', 'PKA', 'PKX', 'PKA', 'PKB', 'PKB'],
+                              'games_home': [10, 10, 10, 10, 10, 10],
+                              'rt_home': [150, 80, 50, 120, 90, 110],
+                              'games_road': [10, 10, 10, 10, 10, 10],
+                              'rt_road': [100, 100, 100, 100, 100, 100]})
+
+    park_factor = pf.compute_pf(park_runs, rolling_years=[1, 3])
+    assert np.allclose(park_factor['pf'], [1.5, 0.8, 0.5, 1.2, 0.9, 1.1])
+    assert np.allclose(park_factor['pf_1yr'], park_factor['pf'])
+
+    # 2015 is more than 3 years after 2011, so its 3 year park factor is for 2015 only
+    assert np.allclose(park_factor['pf_3yr'], [1.5, 0.8, 0.5, 1.0, 0.9, 1.0])
+    assert park_factor.index.equals(park_runs.index)
+
+    # the result is the same for rows in any order
+    shuffled = pf.compute_pf(park_runs.iloc[[3, 0, 5, 1, 4, 2]], rolling_years=[3])
+    assert np.allclose(shuffled.sort_index()['pf_3yr'], park_factor['pf_3yr'])
+
+
+def test_load_steps(tmp_path):
+    from pathlib import Path
+    from .. import postgres_load_data as pld
+
+    steps = pld.get_load_steps(None, Path('../data'))
+    n_rollups = len(pld.season_rollup.ROLLUP_SOURCES) * len(pld.season_rollup.ROLLUP_LEVELS)
+    assert len(steps) == 1 + 2 * len(pld.TABLES) + len(pld.UNIQUE_CONSTRAINTS) + len(pld.FOREIGN_KEYS) + n_rollups
+    assert set(steps['rollup retro_batting_league_season'][2]) == {'load retro_batting', 'load retro_team_game'}
+    assert set(steps['fkey retro_team_id'][2]) == {'pkey retro_team_game', 'unique retro_team_unique'}
+    assert 'fkey batting_player_id' in steps['fkey pitching_player_id'][2]
+
+    # run the steps, without a database, and verify each ran after the steps it depends upon
+    finished = []
+    dummy = {name: (finished.append, (name,), deps) for name, (_, _, deps) in steps.items()}
+    pld.run_steps(dummy, workers=4)
+    assert len(finished) == len(steps)
+    for name, (_, _, deps) in steps.items():
+        assert all(finished.index(dep) < finished.index(name) for dep in deps)
+
+    # the steps run in the context of the stage, so they are profiled as it is
+    from .. import instrument
+    profiles = []
+    dummy = {name: (lambda: profiles.append(instrument._profile.get()), (), []) for name in 'ab'}
+    with instrument.stage('tmp', metrics_dir=tmp_path, profile={'target': 'b', 'interval': None, 'top': None}):
+        pld.run_steps(dummy, workers=2)
+    assert [p['target'] for p in profiles] == ['b', 'b']
+
+    # in bulk mode, a referenced table is SET LOGGED before the tables that reference it
+    steps = pld.get_load_steps(None, Path('../data'), bulk=True)
+    assert 'fkey batting_player_id' in steps['analyze lahman_people'][2]
+    assert 'logged lahman_people' in steps['logged retro_batting'][2]
+    assert 'logged lahman_teams' in steps['logged retro_team_game'][2]
+    assert not any(name.startswith('logged') for name in
+                   pld.get_load_steps(None, Path('../data'), bulk=True, keep_unlogged=True))
+
+    # the tables referenced by a partitioned table are not created unlogged
+    assert steps['load lahman_people'][1][4] is False
+    assert steps['load lahman_batting'][1][4] is True
+
+    # in incremental mode, nothing is dropped and a table is loaded after the tables it references
+    steps = pld.get_load_steps(None, Path('../data'), incremental=True)
+    assert steps['drop'][1][1] == []
+    assert 'load lahman_people' in steps['load retro_batting'][2]
+
+
+def test_season_rollup():
+    from .. import season_rollup as sr
+
+    fielding = pd.DataFrame({'game_id': ['BOS201904010', 'BOS201904010', 'BOS201904020', 'NYA201904030'],
+                             'player_id': ['aaa01', 'bbb01', 'aaa01', 'ccc01'],
+                             'team_id': ['BOS', 'BOS', 'BOS', 'NYA'],
+                             'pos': ['SS', 'SS', 'SS', 'C'],
+                             'po': [1, 2, 3, 4],
+                             'year': np.array([2019] * 4, dtype='int16')})
+    leagues = pd.DataFrame({'team_id': ['BOS', 'NYA'], 'year': [2019, 2019], 'lg_id': ['AL', 'AL']})
+
+    rollup = sr.compute_rollup(fielding, 'fielding', 'player_season')
+    assert rollup.columns.tolist() == ['player_id', 'team_id', 'year', 'pos', 'games', 'po']
+    assert rollup['po'].tolist() == [4, 2, 4]
+
+    # games counts each game once, regardless of the number of players
+    rollup = sr.compute_rollup(fielding, 'fielding', 'team_season')
+    assert rollup[['games', 'po']].values.tolist() == [[2, 6], [1, 4]]
+
+    rollup = sr.compute_rollup(fielding, 'fielding', 'league_season', leagues)
+    assert rollup.columns.tolist() == ['lg_id', 'year', 'pos', 'games', 'po']
+    assert rollup[['pos', 'games', 'po']].values.tolist() == [['C', 1, 4], ['SS', 2, 6]]
+
+
+def test_to_pg_binary():
+    import struct
+    from .. import postgres_load_data as pld
+
+    df = pd.DataFrame({'a': np.array([1, 300], dtype=np.uint16),
+                       'b': pd.array([None, -2], dtype='Int8'),
+                       'c': ['xy', None]})
+    pg_types = {'a': 'int4', 'b': 'int2', 'c': 'text'}
+
+    # field count, then length and value per field, with length -1 for NULL
+    expected = struct.pack('>hii', 3, 4, 1) + struct.pack('>i', -1) + struct.pack('>i2s', 2, b'xy')
+    expected += struct.pack('>hii', 3, 4, 300) + struct.pack('>ih', 2, -2) + struct.pack('>i', -1)
+    assert pld.to_pg_binary(df, pg_types) == expected
+
+
+def test_year_digests(tmp_path):
+    from .. import postgres_load_data as pld
+
+    df = pd.DataFrame({'game_id': ['BOS201904010', 'NYA201904020', 'BOS202004010'],
+                       'event_id': [1, 2, 1]})
+    dh.to_csv_with_types(df, tmp_path / 'tmp.csv.gz')
+    digests = pld.get_year_digests(tmp_path / 'tmp.csv.gz', pld.add_year, chunksize=2)
+    assert list(digests) == [0, 2019, 2020]
+
+    # the digest does not depend upon the order of the rows
+    dh.to_csv_with_types(df.iloc[::-1], tmp_path / 'tmp.csv.gz')
+    assert pld.get_year_digests(tmp_path / 'tmp.csv.gz', pld.add_year) == digests
+
+    # only the digest for the year which changed is different
+    df.loc[0, 'event_id'] = 3
+    dh.to_csv_with_types(df, tmp_path / 'tmp.csv.gz')
+    changed = pld.get_year_digests(tmp_path / 'tmp.csv.gz', pld.add_year)
+    assert [year for year in digests if digests[year] != changed[year]] == [2019]
+
+
+def test_load_embedded(tmp_path):
+    import sqlite3
+    import pytest
+    from .. import postgres_load_data as pld
+    from .. import db_backends
+
+    people = pd.DataFrame({'player_id': ['aaa01', 'bbb01'], 'retro_id': ['aaa01r', 'bbb01r']})
+    batting = pd.DataFrame({'player_id': ['aaa01r', 'bbb01r', 'aaa01r'],
+                            'game_id': ['BOS201904010', 'BOS201904010', 'NYA202004020'],
+                            'b_h': [1, 0, 2]})
+    dh.to_csv_with_types(people, tmp_path / 'tmp_people.csv.gz')
+    dh.to_csv_with_types(batting, tmp_path / 'tmp_batting.csv.gz')
+    tables = [('lahman_', '', 'tmp_people.csv.gz', ['player_id']),
+              ('retro_', '', 'tmp_batting.csv.gz', ['player_id', 'game_id', 'year'])]
+
+    # the table names must match the names used by the key constraints
+    pld.UNIQUE_CONSTRAINTS.append(('lahman_tmp_people', 'tmp_unique', ['retro_id']))
+    pld.FOREIGN_KEYS.append(('retro_tmp_batting', 'tmp_player_id', ['player_id'],
+                             'lahman_tmp_people', ['retro_id']))
+    pld.PARTITIONED.append('retro_tmp_batting')
+    try:
+        backend = db_backends.SqliteBackend(tmp_path / 'tmp.sqlite')
+        pld.load_embedded(backend, tmp_path, tables, chunksize=2)
+        assert backend.count('retro_tmp_batting') == 3
+        assert backend.con.execute('SELECT SUM(year) FROM retro_tmp_batting').fetchone()[0] == 2019 * 2 + 2020
+
+        # the same key constraints as Postgres
+        with pytest.raises(sqlite3.IntegrityError, match='UNIQUE'):
+            backend.insert('retro_tmp_batting', batting.iloc[:1].assign(year=2019))
+        with pytest.raises(sqlite3.IntegrityError, match='FOREIGN KEY'):
+            backend.insert('retro_tmp_batting', batting.iloc[:1].assign(year=2019, player_id='zzz01r'))
+        backend.close()
+    finally:
+        pld.UNIQUE_CONSTRAINTS.pop()
+        pld.FOREIGN_KEYS.pop()
+        pld.PARTITIONED.pop()
+
+
+def test_run_stages(tmp_path):
+    from .. import run_all_scripts as ras
+
+    def write(filename):
+        return [sys.executable, '-c', f'import pathlib; pathlib.Path({str(tmp_path / filename)!r}).write_text("x")']
+
+    (tmp_path / 'tmp_a').mkdir()
+    (tmp_path / 'tmp_b').mkdir()
+    stages = {'a': (write('tmp_a/a.csv'), [], ['tmp_a']),
+              'b': (write('tmp_b/b.csv'), ['tmp_a'], ['tmp_b']),
+              'c': ([sys.executable, '-c', 'import sys; sys.exit(1)'], [], ['tmp_c']),
+              'd': (write('tmp_b/d.csv'), ['tmp_c'], ['tmp_d'])}
+    assert ras.get_dependencies(stages) == {'a': [], 'b': ['a'], 'c': [], 'd': ['c']}
+
+    # a stage which depends upon a failed stage is not run
+    results = ras.run_stages(stages, tmp_path)
+    assert [status for status, _ in results.values()] == ['ok', 'ok', 'failed', 'not run']
+
+    # outputs newer than inputs are skipped, unless forced
+    results = ras.run_stages({name: stages[name] for name in 'ab'}, tmp_path)
+    assert [status for status, _ in results.values()] == ['skipped', 'skipped']
+    results = ras.run_stages({name: stages[name] for name in 'ab'}, tmp_path, force=True)
+    assert [status for status, _ in results.values()] == ['ok', 'ok']
+
+
+def test_run_stages_in_process(tmp_path):
+    from .. import run_all_scripts as ras
+
+    # two stage scripts: the first returns a DataFrame and writes it in the background,
+    # the second is passed the DataFrame by the runner
+    p_scripts = tmp_path / 'tmp_scripts'
+    p_scripts.mkdir()
+    (p_scripts / 'tmp_first.py').write_text(
+        'from concurrent.futures import ThreadPoolExecutor\n'
+        'import pandas as pd\n'
+        'def main(argv=None, writes=None):\n'
+        '    df = pd.DataFrame({"a": [1, 2]})\n'
+        '    writes.append(ThreadPoolExecutor(1).submit(df.to_csv, argv[0], index=False))\n'
+        '    return {"first": df}\n')
+    (p_scripts / 'tmp_second.py').write_text(
+        'def main(argv=None, frames=None):\n'
+        '    frames["first"].assign(b=3).to_csv(argv[0], index=False)\n')
+
+    (tmp_path / 'tmp_a').mkdir()
+    (tmp_path / 'tmp_b').mkdir()
+    stages = {'first': (['./tmp_first.py', str(tmp_path / 'tmp_a/a.csv')], [], ['tmp_a']),
+              'second': (['./tmp_second.py', str(tmp_path / 'tmp_b/b.csv')], ['tmp_a'], ['tmp_b'])}
+    sys.path.insert(0, str(p_scripts))
+    try:
+        results = ras.run_stages(stages, tmp_path, in_process=True)
+        assert [status for status, _ in results.values()] == ['ok', 'ok']
+        assert pd.read_csv(tmp_path / 'tmp_a/a.csv')['a'].tolist() == [1, 2]
+        assert pd.read_csv(tmp_path / 'tmp_b/b.csv')['b'].tolist() == [3, 3]
+    finally:
+        sys.path.remove(str(p_scripts))
+        for name in ['tmp_first', 'tmp_second']:
+            sys.modules.pop(name, None)
+
+
+def test_instrument(tmp_path):
+    import json
+    from .. import instrument
+
+    p_metrics = tmp_path / 'tmp_metrics'
+    filename = tmp_path / 'tmp_metrics.csv'
+    with instrument.stage('tmp', metrics_dir=p_metrics):
+        with instrument.step('write', year=2019) as s:
+            pd.DataFrame({'a': [1, 2, 3]}).to_csv(filename, index=False)
+            s.rows_out = 3
+            s.add_written(filename)
+
+        # the record of a failed step is still written
+        try:
+            with instrument.step('fail'):
+                raise ValueError('failed')
+        except ValueError:
+            pass
+
+    files = list(p_metrics.glob('tmp_*.jsonl'))
+    assert len(files) == 1
+    records = [json.loads(line) for line in files[0].read_text().splitlines()]
+    assert [(r['kind'], r['name'], r['ok']) for r in records] == \
+           [('step', 'write', True), ('step', 'fail', False), ('stage', 'tmp', True)]
+    assert records[0]['year'] == 2019
+    assert records[0]['rows_out'] == 3
+    assert records[0]['bytes_written'] == os.path.getsize(filename)
+    assert records[2]['wall_s'] >= records[0]['wall_s']
+
+    # after the stage, records are not written
+    with instrument.step('no file'):
+        pass
+    assert len(files[0].read_text().splitlines()) == 3
+
+
+def test_profile(tmp_path, monkeypatch):
+    import argparse
+    import pstats
+    import threading
+    from .. import instrument
+
+    def slow_function():
+        return sum(range(10 ** 6)), [0] * 10 ** 5
+
+    def run_other():
+        with instrument.stage('other', metrics_dir=tmp_path / 'metrics'):
+            with instrument.step('slow', year=2018):
+                slow_function()
+
+    parser = argparse.ArgumentParser()
+    instrument.add_profile_args(parser)
+
+    # the reports are written to profiles/ in the working directory
+    monkeypatch.chdir(tmp_path)
+
+    # only the steps named by --profile are profiled, and only within the stage given the options,
+    # a stage run concurrently in another thread has its own
+    profile = instrument.get_profile(parser.parse_args(['--profile=slow', '--profile-interval=0.001',
+                                                        '--profile-memory=5']))
+    assert instrument.get_profile(parser.parse_args([])) is None
+    with instrument.stage('tmp', metrics_dir=tmp_path / 'metrics', profile=profile):
+        with instrument.step('fast'):
+            pass
+        other = threading.Thread(target=run_other)
+        other.start()
+        other.join()
+        with instrument.step('slow', year=2019):
+            slow_function()
+    with instrument.step('slow', year=2020):
+        pass
+
+    files = sorted(file.name for file in (tmp_path / 'profiles').iterdir())
+    assert len(files) == 4
+    assert all(file.startswith('slow_2019_') for file in files)
+    prof = [file for file in files if file.endswith('.prof')][0]
+    stats = pstats.Stats(str(tmp_path / 'profiles' / prof))
+    assert any(func[2] == 'slow_function' for func in stats.stats)
+    assert 'peak traced memory' in (tmp_path / 'profiles' / prof.replace('.prof', '_memory.txt')).read_text()
+
+
+def test_synthetic_data(tmp_path, monkeypatch):
+    from .. import retrosheet_collect
+    from .. import synthetic_data
+
+    # the metrics of the collect stage are written to metrics/ in the working directory
+    p_data = tmp_path
+    monkeypatch.chdir(p_data)
+    synthetic_data.main([f'--data-dir={p_data}', '--start-year=2019', '--end-year=2019', '--scale=0.1'])
+    frames = retrosheet_collect.main([f'--data-dir={p_data}', '--use-datatypes'])
+    player_game, game = frames['player_game'], frames['game']
+
+    # 10% of the 30 teams, rounded to an even number, each playing one game a day
+    assert game['game_id'].is_unique
+    assert len(game) == 4 * 162 // 2
+    assert player_game['team_id'].nunique() == 4
+
+    # the player stats sum to the team stats of each game
+    team = player_game.groupby(['game_id', 'home_fl'])[['b_r', 'b_ab', 'b_h', 'p_out']].sum()
+    for side, prefix in enumerate(['away', 'home']):
+        t = team.xs(side, level='home_fl').reindex(game['game_id'])
+        assert (t['b_r'].values == game[f'{prefix}_score_ct'].values).all()
+        assert (t['b_ab'].values == game[f'{prefix}_ab_ct'].values).all()
+        assert (t['b_h'].values == game[f'{prefix}_hits_ct'].values).all()
+    assert team['p_out'].sum() == game['outs_ct'].sum()
+
+    # the events sum to the player stats, and the Lahman season stats are the sums of the player stats
+    event = pd.read_csv(p_data / 'retrosheet/parsed/cwevent2019.csv')
+    assert event['EVENT_RUNS_CT'].sum() == player_game['b_r'].sum()
+    assert (event['H_CD'] > 0).sum() == player_game['b_h'].sum()
+    batting = pd.read_csv(p_data / 'lahman/raw/Batting.csv')
+    assert batting['HR'].sum() == player_game['b_hr'].sum()
+    assert batting['playerID'].isin(pd.read_csv(p_data / 'lahman/raw/People.csv')['playerID']).all()
+
+
+def test_compare_benchmarks():
+    from .. import benchmark
+
+    baseline = {'benchmarks': {'a': {'min_s': 1.0}, 'b': {'min_s': 1.0}, 'c': {'min_s': 1.0},
+                               'd': {'min_s': 1.0}}}
+    current = {'benchmarks': {'a': {'min_s': 1.05}, 'b': {'min_s': 1.2}, 'c': {'min_s': 0.5},
+                              'e': {'min_s': 1.0}}}
+    comparison = benchmark.compare_results(baseline, current, threshold=0.1)
+    assert comparison['benchmark'].tolist() == ['a', 'b', 'c', 'd', 'e']
+    assert comparison['status'].tolist() == ['ok', 'regression', 'improvement', 'missing', 'new']
+    assert np.isclose(comparison['change'][1], 0.2)
+
+
+def test_get_pg_types():
+    from .. import benchmark
+
+    df = pd.DataFrame({'a': np.array([1], dtype=np.uint8), 'b': pd.array([None], dtype='UInt16'),
+                       'c': np.array([1], dtype=np.int64), 'd': [True], 'e': [1.5], 'f': ['x'],
+                       'g': pd.to_datetime(['2019-04-01'])})
+    assert benchmark.get_pg_types(df) == {'a': 'int2', 'b': 'int4', 'c': 'int8', 'd': 'bool', 'e': 'float8',
+                                          'f': 'text', 'g': 'timestamp'}
+
+
+def test_lazy_table(tmp_path):
+    from .. import column_store
+
+    df = pd.DataFrame({'game_start': pd.to_datetime(['1973-09-30', '1974-04-05', '2019-09-29', '2020-07-23']),
+                       'player_id': ['aaroh101', np.nan, 'bettm001', 'bettm001'],
+                       'hr': np.array([1, 0, 2, 1], dtype=np.uint8),
+                       'attendance': pd.array([100, None, 300, None], dtype='UInt32'),
+                       'bat_last': [True, False, True, False],
+                       'temperature': [71.5, 60.0, np.nan, 80.0]})
+    dh.to_csv_with_types(df, tmp_path / 'tmp.csv.gz')
+    cache_dir = tmp_path / 'tmp_cache'
+    expected = dh.from_csv_with_types(tmp_path / 'tmp.csv.gz').query('1974 <= game_start.dt.year <= 2019')
+
+    table = column_store.LazyTable(tmp_path / 'tmp.csv.gz', cache_dir, years=(1974, 2019))
+    assert table.columns.equals(df.columns)
+    assert len(table) == 2
+
+    # columns are loaded as they are selected, with the same values, dtypes and index as query()
+    assert table['hr'].equals(expected['hr'])
+    assert set(table._loaded) == {'game_start', 'hr'}
+    assert table.to_frame().equals(expected)
+
+    # a new handle reads the cached columns
+    assert column_store.LazyTable(tmp_path / 'tmp.csv.gz', cache_dir).to_frame().equals(
+        dh.from_csv_with_types(tmp_path / 'tmp.csv.gz'))
+
+    # the cache is rebuilt when the csv file changes
+    df.loc[1, 'hr'] = 5
+    dh.to_csv_with_types(df, tmp_path / 'tmp.csv.gz')
+    table = column_store.LazyTable(tmp_path / 'tmp.csv.gz', cache_dir, years=(1974, 2019))
+    assert table['hr'].tolist() == [5, 2]
+
+
+def test_lazy_table_shared(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+    from .. import column_store
+
+    df = pd.DataFrame({'game_start': pd.to_datetime(['1973-09-30', '1974-04-05', '2019-09-29', '2019-09-30']),
+                       'hr': np.array([1, 0, 2, 1], dtype=np.uint8),
+                       'attendance': pd.array([100, None, 300, None], dtype='UInt32')})
+    dh.to_csv_with_types(df, tmp_path / 'tmp.csv.gz')
+    cache_dir = tmp_path / 'tmp_cache'
+
+    # processes building the same cache at once wait for one of them to build it
+    with ProcessPoolExecutor(2) as executor:
+        manifests = list(executor.map(column_store.get_manifest, [tmp_path / 'tmp.csv.gz'] * 4, [cache_dir] * 4))
+    assert all(manifest == manifests[0] for manifest in manifests)
+    assert sorted(p.name for p in tmp_path.glob('tmp_cache*')) == ['tmp_cache', 'tmp_cache.lock']
+
+    # the rows in years are contiguous, so the columns are read-only views of the memory mapped files
+    table = column_store.LazyTable(tmp_path / 'tmp.csv.gz', cache_dir, years=(1974, 2019))
+    hr = table['hr']
+    assert isinstance(table.load('hr'), np.memmap)
+    assert np.shares_memory(hr.values, table.load('hr'))
+    assert not hr.values.flags.writeable
+    assert hr.index.tolist() == [1, 2, 3]
+    assert table['attendance'].isna().tolist() == [True, False, True]
+
+
+def test_validator(tmp_path):
+    from .. import validation
+
+    def check_sums(tables):
+        def compute(frames):
+            df = frames['t']
+            return {'rows': len(df), 'hr': int(df['hr'].sum()), 'max_hr': int(df['hr'].max())}
+
+        return {'t': ['hr']}, compute
+
+    # the validator's data dir, with its own test_cache
+    df = pd.DataFrame({'year': np.array([2018, 2018, 2019, 2020], dtype=np.uint16),
+                       'hr': np.array([1, 2, 3, 4], dtype=np.uint8)})
+    (tmp_path / 'tmp_validation').mkdir()
+    dh.to_csv_with_types(df, tmp_path / 'tmp_validation' / 't.csv.gz')
+    checks = {'sums': check_sums}
+    tables = {'t': 'tmp_validation/t.csv.gz'}
+
+    validator = validation.Validator(tmp_path, (2018, 2019), checks, tables)
+    assert validator.run('sums') == {'rows': 3, 'hr': 6, 'max_hr': 3}
+    assert validator.checked['sums'] == [2018, 2019]
+    assert (tmp_path / 'test_cache' / 'validation' / 'sums.json').is_file()
+
+    # the results are saved
+    validator = validation.Validator(tmp_path, (2018, 2019), checks, tables)
+    assert validator.run('sums') == {'rows': 3, 'hr': 6, 'max_hr': 3}
+    assert validator.checked['sums'] == []
+
+    # only the year which changed is checked
+    df.loc[2, 'hr'] = 5
+    dh.to_csv_with_types(df, tmp_path / 'tmp_validation' / 't.csv.gz')
+    validator = validation.Validator(tmp_path, (2018, 2019), checks, tables)
+    assert validator.run('sums') == {'rows': 3, 'hr': 8, 'max_hr': 5}
+    assert validator.checked['sums'] == [2019]
+
+
+def test_key_integrity():
+    from .. import key_integrity
+
+    df = pd.DataFrame({'game_id': ['BOS201904010', 'BOS201904010', 'NYA201904020', 'NYA201904020', 'BOS201904010'],
+                       'player_id': ['bettm001', 'sale001', 'bettm001', np.nan, 'bettm001'],
+                       'pos': pd.array([1, 2, 1, None, 1], dtype='UInt8')})
+    df_orig = df.copy()
+
+    for cols in [['game_id'], ['game_id', 'player_id'], ['game_id', 'player_id', 'pos'], ['player_id', 'pos']]:
+        assert key_integrity.is_unique(df, cols) == (not df.duplicated(subset=cols).any())
+        assert key_integrity.is_unique(df, cols, ignore_null=True) == \
+               (not df.dropna(subset=cols).duplicated(subset=cols).any())
+        for keep in ['first', 'last', False]:
+            assert key_integrity.duplicated(df, cols, keep).equals(df.duplicated(subset=cols, keep=keep))
+
+    assert not key_integrity.is_unique(df, ['game_id', 'player_id'])
+    assert key_integrity.is_unique(df.iloc[:4], ['game_id', 'player_id'])
+
+    # nulls are ignored, or are a value of their own
+    df.loc[1, 'player_id'] = np.nan
+    assert key_integrity.is_unique(df.iloc[:4], ['player_id'], ignore_null=True) is False
+    assert key_integrity.is_unique(df.iloc[1:4], ['player_id'], ignore_null=True)
+    assert not key_integrity.is_unique(df.iloc[1:4], ['player_id'])
+
+    # the codes are renumbered rather than overflow
+    key_integrity.MAX_CODES, max_codes = 4, key_integrity.MAX_CODES
+    try:
+        assert key_integrity.duplicated(df, ['game_id', 'player_id', 'pos']).equals(
+            df.duplicated(subset=['game_id', 'player_id', 'pos']))
+    finally:
+        key_integrity.MAX_CODES = max_codes
+
+    # the input is not modified
+    assert df.drop(index=1).equals(df_orig.drop(index=1))
+
+
+def test_parse_line_scores():
+    line_tx = pd.Series(['001001001', '0102(11)0500', '00300001x', '0000000000001', np.nan, '(10)00000000'],
+                        index=[5, 6, 7, 8, 9, 10])
+    runs = dh.parse_line_scores(line_tx)
+
+    assert runs.index.equals(line_tx.index)
+    assert runs.columns.tolist() == list(range(1, 14))
+    assert (runs.dtypes == 'UInt8').all()
+    assert runs.sum(axis=1).tolist() == [3, 19, 4, 1, 0, 10]
+    assert runs.loc[6, [4, 5]].tolist() == [2, 11]
+    assert runs.notna().sum(axis=1).tolist() == [9, 9, 8, 13, 0, 9]
+
+    # the same as parsing one at a time
+    for i, tx in line_tx.dropna().items():
+        assert runs.loc[i].astype('Int64').fillna(-1).tolist()[:len(dh.parse_line_score(tx))] == dh.parse_line_score(tx)
+
+    # the columns are the innings played, not the width of the longest line score
+    runs = dh.parse_line_scores(pd.Series(['0102(11)0500', '00300001x']))
+    assert runs.columns.tolist() == list(range(1, 10))
+    assert runs.sum(axis=1).tolist() == [19, 4]
+    assert dh.parse_line_scores(pd.Series([np.nan])).shape == (1, 0)
+
+    with pytest.raises(ValueError):
+        dh.parse_line_scores(pd.Series(['001?01001']))
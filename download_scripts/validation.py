@@ -0,0 +1,287 @@
+"""Incremental Data Consistency Validation
+
+The data consistency checks compare tables a year at a time.  The result of each check for
+each year is saved, together with a digest of its inputs: the values of the columns it reads
+for that year, and the source code of the checks.  When the check is run again, only the years
+whose inputs changed are checked, so after a one season refresh, only that season is checked.
+
+    validator = Validator(data_dir, years=(1974, 2019))
+    result = validator.run('batting_team_game')
+    assert result['mismatches'] == 0
+
+A check returns the inputs it reads and a function which computes its result for one year.  The
+results of the years are combined by combine_results(), so the assertions over all the years are
+made on the combined result.
+
+The results are saved in {data_dir}/test_cache/validation/{check}.json.  The tables are read
+with column_store, which saves the digests of their columns.
+"""
+
+__author__ = 'Stephen Diehl'
+
+import hashlib
+import inspect
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+import column_store
+
+TABLES = {
+    'batting': 'retrosheet/wrangled/batting.csv.gz',
+    'pitching': 'retrosheet/wrangled/pitching.csv.gz',
+    'fielding': 'retrosheet/wrangled/fielding.csv.gz',
+    'team_game': 'retrosheet/wrangled/team_game.csv.gz',
+    'event': 'retrosheet/wrangled/event.csv.gz',
+    'lahman_batting': 'lahman/wrangled/batting.csv',
+    'lahman_pitching': 'lahman/wrangled/pitching.csv',
+    'lahman_teams': 'lahman/wrangled/teams.csv',
+}
+
+
+def compare_team_game(df, team_game, cols):
+    """Compare df aggregated by (game_id, team_id) with team_game."""
+    key = ['game_id', 'team_id']
+    sums = df.groupby(key)[cols].sum()
+    tg = team_game.set_index(key)[cols].sort_index()
+
+    dtype_mismatches = int((sums.dtypes != tg.dtypes).sum())
+    missing = len(sums.index.symmetric_difference(tg.index))
+    sums = sums.reindex(tg.index)
+
+    return {'cols': cols, 'rows': len(tg), 'missing': missing,
+            'mismatches': int((sums != tg).to_numpy().sum()),
+            'dtype_mismatches': dtype_mismatches}
+
+
+def get_sums(df, cols):
+    return {col: int(df[col].sum()) for col in cols}
+
+
+def get_max(df):
+    """Max of all the values of df, or NaN if there are none."""
+    value = df.max().max()
+    return float(value) if pd.notna(value) else float('nan')
+
+
+def get_min(df):
+    value = df.min().min()
+    return float(value) if pd.notna(value) else float('nan')
+
+
+def check_batting_team_game(tables):
+    """Retrosheet batting aggregated by (game_id, team_id) is the same as team_game batting stats."""
+    exclude = ['game_id', 'team_id', 'player_id', 'game_start', 'year']
+    cols = sorted(set(tables['batting'].columns) & set(tables['team_game'].columns) - set(exclude))
+    inputs = {'batting': ['game_id', 'team_id'] + cols, 'team_game': ['game_id', 'team_id'] + cols}
+
+    def compute(frames):
+        return compare_team_game(frames['batting'], frames['team_game'], cols)
+
+    return inputs, compute
+
+
+def check_pitching_team_game(tables):
+    """Retrosheet pitching aggregated by (game_id, team_id) is the same as team_game pitching stats."""
+    cols = ['wp', 'bk', 'er']
+    inputs = {'pitching': ['game_id', 'team_id'] + cols, 'team_game': ['game_id', 'team_id'] + cols}
+
+    def compute(frames):
+        return compare_team_game(frames['pitching'], frames['team_game'], cols)
+
+    return inputs, compute
+
+
+def check_fielding_team_game(tables):
+    """Retrosheet fielding aggregated by (game_id, team_id) is the same as team_game fielding stats."""
+    cols = ['a', 'e', 'po', 'pb']
+    inputs = {'fielding': ['game_id', 'team_id'] + cols, 'team_game': ['game_id', 'team_id'] + cols}
+
+    def compute(frames):
+        return compare_team_game(frames['fielding'], frames['team_game'], cols)
+
+    return inputs, compute
+
+
+def check_event_team_game(tables):
+    """Play-by-play data aggregated by (game_id, team_id) is the same as team_game."""
+    key = ['game_id', 'team_id', 'opponent_team_id']
+    cols = sorted(set(tables['team_game'].columns) & set(tables['event'].columns) - set(key))
+    inputs = {'event': key + cols, 'team_game': ['game_id', 'team_id'] + cols}
+
+    def compute(frames):
+        event_team_game = frames['event'].groupby(key)[cols].agg('sum')
+
+        # e, dp, tp, pb, wp, and bk should be charged to the opponent when
+        # aggregating values to compare with team_game
+        opp_cols = ['e', 'dp', 'tp', 'pb', 'wp', 'bk']
+        tmp = event_team_game.reset_index()
+        opp = event_team_game.sort_values(['game_id', 'opponent_team_id']).reset_index()
+
+        # swap column values
+        tmp[opp_cols] = opp[opp_cols]
+        event_team_game = tmp
+
+        tg = frames['team_game'].set_index(['game_id', 'team_id']).sort_index()
+        etg = event_team_game.set_index(['game_id', 'team_id']).sort_index()
+
+        diff = tg[cols] - etg[cols]
+        return {'cols': cols, 'max_diff': get_max(diff), 'min_diff': get_min(diff)}
+
+    return inputs, compute
+
+
+def check_batting_lahman_teams(tables):
+    """Retrosheet batting aggregated by (year, team_id_lahman) is the same as Lahman teams."""
+    pkey = ['year', 'team_id']
+    common = set(tables['batting'].columns) & set(tables['lahman_teams'].columns)
+
+    # cannot sum g by player per team to get g per team
+    # sb and cs are close, but don't tie out as well as others
+    cols = sorted(common - set(pkey) - {'g', 'sb', 'cs'})
+    inputs = {'batting': pkey + cols, 'lahman_teams': ['team_id', 'year', 'team_id_retro'] + cols}
+
+    def compute(frames):
+        # Add team_id_lahman
+        lahman_teams = frames['lahman_teams']
+        retro_batting = pd.merge(frames['batting'], lahman_teams[['team_id', 'year', 'team_id_retro']],
+                                 left_on=['year', 'team_id'],
+                                 right_on=['year', 'team_id_retro'],
+                                 how='inner', suffixes=['_retrosheet', '_lahman'])
+
+        retro_batting_sums = retro_batting.groupby(['year', 'team_id_lahman'])[cols].sum().astype('int')
+        retro_batting_sums.sort_index(inplace=True)
+
+        l_teams = lahman_teams[pkey + cols].set_index(pkey).sort_index()
+        return {'cols': cols, 'max_rel_diff': get_max(np.abs(1.0 - (l_teams / retro_batting_sums)))}
+
+    return inputs, compute
+
+
+def check_lahman_retro_batting(tables):
+    """The sums of the Lahman batting and Retrosheet batting stats."""
+    cols = sorted(set(tables['batting'].columns) & set(tables['lahman_batting'].columns)
+                  - {'player_id', 'team_id', 'year'})
+    inputs = {'batting': cols, 'lahman_batting': cols}
+
+    def compute(frames):
+        return {'cols': cols, 'lahman': get_sums(frames['lahman_batting'], cols),
+                'retro': get_sums(frames['batting'], cols)}
+
+    return inputs, compute
+
+
+def check_lahman_retro_pitching(tables):
+    """The sums of the Lahman pitching and Retrosheet pitching stats."""
+    cols = sorted(set(tables['pitching'].columns) & set(tables['lahman_pitching'].columns)
+                  - {'player_id', 'team_id', 'year'})
+    inputs = {'pitching': cols, 'lahman_pitching': cols}
+
+    def compute(frames):
+        return {'cols': cols, 'lahman': get_sums(frames['lahman_pitching'], cols),
+                'retro': get_sums(frames['pitching'], cols)}
+
+    return inputs, compute
+
+
+CHECKS = {
+    'batting_team_game': check_batting_team_game,
+    'pitching_team_game': check_pitching_team_game,
+    'fielding_team_game': check_fielding_team_game,
+    'event_team_game': check_event_team_game,
+    'batting_lahman_teams': check_batting_lahman_teams,
+    'lahman_retro_batting': check_lahman_retro_batting,
+    'lahman_retro_pitching': check_lahman_retro_pitching,
+}
+
+
+def combine_results(results):
+    """Combine the results of the years.
+
+    Values whose names start with max_ or min_ are the max or min over the years, ignoring NaN.
+    Other numbers are summed, dicts are combined in the same way, and other values are
+    the same for each year.
+    """
+    if not results:
+        return {}
+
+    combined = {}
+    for name, value in results[0].items():
+        values = [result[name] for result in results]
+        if isinstance(value, dict):
+            combined[name] = combine_results(values)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values = [value for value in values if not np.isnan(value)]
+            if name.startswith('max_'):
+                combined[name] = max(values) if values else float('nan')
+            elif name.startswith('min_'):
+                combined[name] = min(values) if values else float('nan')
+            else:
+                combined[name] = sum(values)
+        else:
+            combined[name] = value
+    return combined
+
+
+def get_version(check):
+    """Digest of the source code of the check and of this module."""
+    source = inspect.getsource(sys.modules[__name__]) + inspect.getsource(check)
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+class Validator:
+    """Runs the checks for the years whose inputs have changed since they were last checked.
+
+    checked has the years which were checked by the last run of each check.
+    """
+
+    def __init__(self, data_dir, years, checks=None, tables=None):
+        self.data_dir = data_dir
+        self.years = years
+        self.checks = CHECKS if checks is None else checks
+        tables = TABLES if tables is None else tables
+        self.tables = {name: column_store.get_table(data_dir, filename) for name, filename in tables.items()}
+        self.checked = {}
+
+    def get_input_digests(self, inputs, version):
+        """Digest of the inputs for each year."""
+        digests = {table: self.tables[table].get_year_digests(cols) for table, cols in inputs.items()}
+
+        first, last = self.years
+        years = sorted({int(year) for table in digests.values() for col in table.values() for year in col
+                        if first <= int(year) <= last})
+
+        input_digests = {}
+        for year in years:
+            year_digests = {table: {col: digests[table][col].get(str(year)) for col in cols}
+                            for table, cols in inputs.items()}
+            input_digests[year] = hashlib.md5(
+                (version + json.dumps(year_digests, sort_keys=True)).encode()).hexdigest()
+        return input_digests
+
+    def run(self, name):
+        """The combined result of the check over the years."""
+        check = self.checks[name]
+        inputs, compute = check(self.tables)
+        input_digests = self.get_input_digests(inputs, get_version(check))
+
+        p_results = self.data_dir / 'test_cache' / 'validation' / f'{name}.json'
+        saved = json.loads(p_results.read_text()) if p_results.exists() else {}
+
+        results = {}
+        self.checked[name] = []
+        for year, digest in input_digests.items():
+            entry = saved.get(str(year))
+            if entry is None or entry['inputs'] != digest:
+                frames = {table: self.tables[table].select(cols, self.tables[table].get_year_rows(year))
+                          for table, cols in inputs.items()}
+                entry = {'inputs': digest, 'result': compute(frames)}
+                self.checked[name].append(year)
+            results[str(year)] = entry
+
+        if self.checked[name] or results.keys() != saved.keys():
+            column_store.save_json(p_results, results)
+
+        return combine_results([entry['result'] for entry in results.values()])
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""Compute the Win Expectancy table from {data_dir}/retrosheet/wrangled/event.csv.gz
+
+Count tables are cached per year in {data_dir}/retrosheet/we
+"""
+
+__author__ = 'Stephen Diehl'
+
+import argparse
+from pathlib import Path
+import logging
+import sys
+
+import pandas as pd
+import numpy as np
+
+import data_helper as dh
+import run_expectancy
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def get_parser():
+    """Args Description"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--data-dir", type=str, help="baseball data directory", default='../data')
+    parser.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    parser.add_argument("--log", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level")
+    parser.add_argument("--recompute", help="ignore the per year cache", action="store_true")
+    parser.add_argument("--start-year", type=int, help="first year in the win expectancy table", default='1955')
+    parser.add_argument("--end-year", type=int, help="last year in the win expectancy table", default='2019')
+    parser.add_argument("--prior-weight", type=float, default=20.0,
+                        help="number of pseudo-games used to smooth each state toward its inning and score")
+
+    return parser
+
+
+def get_home_win(team_game):
+    """Whether the home team won each game, from the runs of the team batting last.
+
+    Tie games are excluded.
+    """
+    home = team_game.loc[team_game['bat_last'], ['game_id', 'r']]
+    away = team_game.loc[~team_game['bat_last'], ['game_id', 'r']]
+    games = pd.merge(home, away, on='game_id', suffixes=['_home', '_away'])
+
+    games = games[games['r_home'] != games['r_away']]
+    games['home_win'] = games['r_home'] > games['r_away']
+
+    return games[['game_id', 'home_win']]
+
+
+def add_game_state(event, max_inning=9, max_diff=10):
+    """Label each event with the game state before the event.
+
+    New columns:
+      inning: inn_ct, with extra innings treated as the 9th inning
+      outs_start: outs before the event
+      score_diff: home score minus away score, limited to +/- max_diff
+
+    The base state is start_bases_cd.  The events of each half-inning must be consecutive
+    and in order, as they are in event.csv.gz.
+    """
+    event = run_expectancy.add_base_out_state(event)
+
+    event['inning'] = np.minimum(event['inn_ct'].to_numpy(), max_inning).astype('uint8')
+    score_diff = event['home_score_ct'].to_numpy(dtype=np.int16) - event['away_score_ct'].to_numpy(dtype=np.int16)
+    event['score_diff'] = np.clip(score_diff, -max_diff, max_diff).astype('int8')
+
+    return event
+
+
+def compute_we_counts(event, home_win):
+    """Count the plate appearances and home team wins per game state per year.
+
+    Counts rather than probabilities are returned, so that years can be combined exactly.
+    """
+    event = add_game_state(event)
+    if 'pa' in event.columns:
+        event = event[event['pa']]
+
+    event = pd.merge(event, home_win, on='game_id')
+    event['year'] = event['game_id'].str[3:7].astype('int16')
+
+    counts = event.groupby(['year', 'inning', 'home_half', 'outs_start', 'start_bases_cd', 'score_diff']).agg(
+        n=('home_win', 'size'), wins=('home_win', 'sum'))
+    counts = counts.reset_index().rename(columns={'outs_start': 'outs', 'start_bases_cd': 'bases'})
+
+    return counts
+
+
+def smooth_we(counts, prior_weight=20.0):
+    """Combine the count tables and compute the smoothed win expectancy per game state.
+
+    Rare states have noisy win percentages.  Each state is shrunk toward the win percentage
+    for its (inning, home_half, score_diff) over all base-out states, as if prior_weight
+    games had been played at that win percentage:
+
+      we = (wins + prior_weight * prior) / (n + prior_weight)
+    """
+    state = ['inning', 'home_half', 'outs', 'bases', 'score_diff']
+    we = counts.groupby(state, as_index=False)[['n', 'wins']].sum()
+
+    prior = we.groupby(['inning', 'home_half', 'score_diff'])[['n', 'wins']].transform('sum')
+    prior = prior['wins'] / prior['n']
+
+    we['we'] = (we['wins'] + prior_weight * prior) / (we['n'] + prior_weight)
+
+    return we
+
+
+def compute_we(p_event, p_team_game, p_we, start_year, end_year, prior_weight=20.0, recompute=False):
+    """Compute the win expectancy table.
+
+    The event file is streamed one group of games at a time and the counts per year
+    are cached in p_we, so memory is bounded and only the seasons whose events or
+    results have changed are computed.
+    """
+    team_game = dh.from_csv_with_types(p_team_game, usecols=['game_id', 'bat_last', 'r'])
+    home_win = get_home_win(team_game)
+
+    usecols = ['game_id', 'inn_ct', 'home_half', 'outs', 'r', 'start_bases_cd',
+               'away_score_ct', 'home_score_ct']
+    counts = run_expectancy.compute_counts_by_year(
+        p_event, usecols, lambda event: compute_we_counts(event, home_win), p_we, 'we_counts',
+        ['year', 'inning', 'home_half', 'outs', 'bases', 'score_diff'], ['n', 'wins'], home_win, recompute)
+
+    counts = counts.query('@start_year <= year <= @end_year')
+    we = smooth_we(counts, prior_weight)
+    dh.to_csv_with_types(we, p_we / 'we.csv')
+
+    return we
+
+
+def main():
+    """Compute the win expectancy table.
+    """
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.log_level:
+        fh = logging.FileHandler('download.log')
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        fh.setFormatter(formatter)
+        fh.setLevel(args.log_level)
+        logger.addHandler(fh)
+
+    if args.verbose:
+        # send INFO level logging to stdout
+        sh = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+        sh.setFormatter(formatter)
+        sh.setLevel(logging.INFO)
+        logger.addHandler(sh)
+
+    data_dir = Path(args.data_dir)
+    p_retrosheet_wrangled = (data_dir / 'retrosheet/wrangled').resolve()
+    p_we = (data_dir / 'retrosheet/we').resolve()
+
+    p_event = p_retrosheet_wrangled / 'event.csv.gz'
+    if not p_event.exists():
+        logger.warning('No event data -- run retrosheet_parse.py with --run-cwevent')
+        return
+
+    compute_we(p_event, p_retrosheet_wrangled / 'team_game.csv.gz', p_we,
+               args.start_year, args.end_year, args.prior_weight, args.recompute)
+
+    logger.info('Finished')
+
+
+if __name__ == '__main__':
+    main()